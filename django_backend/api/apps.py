@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+
+
+def _start_sheets_outbox(sender, **kwargs):
+    from .sheets_outbox import autostart
+    autostart()
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'api'
\ No newline at end of file
+    name = 'api'
+
+    def ready(self):
+        # Start the Sheets outbox worker in every process that serves requests,
+        # so entries left pending by a previous run are retried without waiting
+        # for the next session. Management commands (and a gunicorn master,
+        # which forks the workers) serve none and do not start it.
+        request_started.connect(_start_sheets_outbox, dispatch_uid='sheets_outbox_autostart')
@@ -0,0 +1,186 @@
+import numpy as np
+from django.db import IntegrityError, transaction
+from .models import AttendanceRecord, ClassRoster
+
+
+def roster_positions(semester, section, student_ids):
+    """
+    Bit positions of the given students in their class, {student_id: position}.
+    Students new to the class are appended to the roster, so a position never
+    changes once assigned. Call inside the transaction that saves the session.
+    """
+    for attempt in range(3):
+        roster = dict(
+            ClassRoster.objects.filter(semester=semester, section=section).values_list('student_id', 'position')
+        )
+        missing = [student_id for student_id in student_ids if student_id not in roster]
+        if not missing:
+            return roster
+        start = max(roster.values(), default=-1) + 1
+        new = {student_id: start + offset for offset, student_id in enumerate(missing)}
+        try:
+            # Another session of the class may take the same positions first; retry then.
+            with transaction.atomic():
+                ClassRoster.objects.bulk_create([
+                    ClassRoster(semester=semester, section=section, student_id=student_id, position=position)
+                    for student_id, position in new.items()
+                ])
+        except IntegrityError:
+            if attempt == 2:
+                raise
+            continue
+        roster.update(new)
+        return roster
+
+
+def pack_session(positions, status_by_student):
+    """
+    The (present_bits, marked_bits) of one session: bit `position` of each
+    student it recorded is set in marked_bits, and in present_bits as well when
+    they were present.
+    """
+    size = max(positions.values(), default=-1) + 1
+    present = np.zeros(size, dtype=bool)
+    marked = np.zeros(size, dtype=bool)
+    for student_id, status in status_by_student.items():
+        marked[positions[student_id]] = True
+        present[positions[student_id]] = status
+    return (np.packbits(present, bitorder='little').tobytes(),
+            np.packbits(marked, bitorder='little').tobytes())
+
+
+def _unpack(blobs, width):
+    """sessions x width bool matrix from packed rows. Rows packed before the roster grew are shorter."""
+    nbytes = (width + 7) // 8
+    if not blobs or not width:
+        return np.zeros((len(blobs), width), dtype=bool)
+    packed = np.frombuffer(b''.join(bytes(blob)[:nbytes].ljust(nbytes, b'\0') for blob in blobs), dtype=np.uint8)
+    return np.unpackbits(packed.reshape(len(blobs), nbytes), axis=1, count=width, bitorder='little').view(bool)
+
+
+class AttendanceMatrix:
+    """
+    The sessions x students attendance of a class and subject, in date order.
+    `present[i, j]` is True when student j attended session i; `marked[i, j]`
+    is False when session i did not record student j at all (they were not
+    on the class list yet).
+    """
+
+    def __init__(self, record_ids, dates, students, present, marked):
+        self.record_ids = record_ids
+        self.dates = dates
+        self.students = students  # (student_id, usn, name) per column
+        self.present = present
+        self.marked = marked
+
+    def between(self, date_from=None, date_to=None):
+        """The sessions held from date_from to date_to, inclusive."""
+        keep = np.ones(len(self.dates), dtype=bool)
+        if date_from:
+            keep &= np.array([date >= date_from for date in self.dates], dtype=bool)
+        if date_to:
+            keep &= np.array([date <= date_to for date in self.dates], dtype=bool)
+        return AttendanceMatrix(
+            [r for r, k in zip(self.record_ids, keep) if k],
+            [d for d, k in zip(self.dates, keep) if k],
+            self.students, self.present[keep], self.marked[keep],
+        )
+
+    def sessions_present(self):
+        return np.count_nonzero(self.present, axis=0)
+
+    def sessions_total(self):
+        return np.count_nonzero(self.marked, axis=0)
+
+    def percentages(self):
+        """Attendance percentage of each student over the sessions that recorded them (NaN if none)."""
+        total = self.sessions_total()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(total > 0, self.sessions_present() * 100.0 / total, np.nan)
+
+    def absence_streaks(self):
+        """
+        Longest and current (ending at the latest session) run of consecutive
+        absences of each student. Sessions that did not record a student
+        neither extend nor break their run.
+        """
+        absent = self.marked & ~self.present
+        run = np.zeros(len(self.students), dtype=np.intp)
+        longest = np.zeros(len(self.students), dtype=np.intp)
+        for session_absent, session_marked in zip(absent, self.marked):
+            run = np.where(session_absent, run + 1, np.where(session_marked, 0, run))
+            np.maximum(longest, run, out=longest)
+        return longest, run
+
+    def as_dict(self):
+        """JSON-ready export: one row per session, 1/0 for present/absent and None when not recorded."""
+        rows = np.where(self.marked, self.present.astype(np.int8), -1)
+        percentages = self.percentages()
+        longest, current = self.absence_streaks()
+        return {
+            'dates': [date.isoformat() for date in self.dates],
+            'record_ids': list(self.record_ids),
+            'students': [
+                {
+                    'usn': usn,
+                    'name': name,
+                    'percentage': None if np.isnan(percentages[j]) else float(percentages[j]),
+                    'longest_absence_streak': int(longest[j]),
+                    'current_absence_streak': int(current[j]),
+                }
+                for j, (_, usn, name) in enumerate(self.students)
+            ],
+            'matrix': [[None if v < 0 else int(v) for v in row] for row in rows.tolist()],
+        }
+
+
+def load_matrix(semester, section, subject, date_from=None, date_to=None):
+    """
+    Attendance matrix of a class and subject from the session bitmaps, with
+    two queries. Sessions saved without bitmaps are left out (see the
+    backfill_attendance_bitmaps command).
+    """
+    roster = list(
+        ClassRoster.objects.filter(semester=semester, section=section)
+        .order_by('position')
+        .values_list('position', 'student_id', 'student__usn', 'student__name')
+    )
+    records = AttendanceRecord.objects.filter(
+        semester=semester, section=section, subject=subject, marked_bits__isnull=False
+    )
+    if date_from:
+        records = records.filter(date__gte=date_from)
+    if date_to:
+        records = records.filter(date__lte=date_to)
+    rows = list(records.order_by('date', 'id').values_list('id', 'date', 'present_bits', 'marked_bits'))
+
+    # Positions of deleted students leave gaps; keep only live columns.
+    width = roster[-1][0] + 1 if roster else 0
+    columns = np.array([position for position, *_ in roster], dtype=np.intp)
+    present = _unpack([row[2] for row in rows], width)[:, columns]
+    marked = _unpack([row[3] for row in rows], width)[:, columns]
+    return AttendanceMatrix(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        [(student_id, usn, name) for _, student_id, usn, name in roster],
+        present,
+        marked,
+    )
+
+
+def backfill_bitmaps(batch_size=500):
+    """Pack the details of sessions saved before bitmaps were stored. Returns the number of sessions."""
+    done = 0
+    pending = AttendanceRecord.objects.filter(marked_bits__isnull=True).order_by('id')
+    while True:
+        with transaction.atomic():
+            records = list(pending[:batch_size].prefetch_related('details'))
+            if not records:
+                return done
+            for record in records:
+                status_by_student = {detail.student_id: detail.status for detail in record.details.all()}
+                positions = roster_positions(record.semester, record.section, sorted(status_by_student))
+                record.present_bits, record.marked_bits = pack_session(positions, status_by_student)
+            AttendanceRecord.objects.bulk_update(records, ['present_bits', 'marked_bits'])
+        done += len(records)
+
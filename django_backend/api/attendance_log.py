@@ -0,0 +1,159 @@
+import bisect
+import os
+from datetime import date, datetime
+from .file_lock import locked_file
+
+SESSION_HEADER = b"--- Attendance Session:"
+PRESENT_PREFIX = b"Present Students:"
+ABSENT_PREFIX = b"Absent Students:"
+
+
+def index_path(file_path):
+    """Sidecar file holding the byte offset and date of every session header of a log."""
+    return file_path + '.idx'
+
+
+def _locked(file_path):
+    """Exclusive lock on the log's index, held while the log or its index is written."""
+    return locked_file(index_path(file_path))
+
+
+def _header_date(line):
+    timestamp = line.decode('utf-8').split(": ")[1].strip().split(" ")[0]
+    return datetime.strptime(timestamp, "%Y-%m-%d")
+
+
+def _names(line):
+    return [student.strip() for student in line.decode('utf-8').split(":")[1].split(",") if student.strip()]
+
+
+def _scan_headers(file_path, start=0):
+    """(offset, date) of every session header from byte `start` on, reading one line at a time."""
+    headers = []
+    with open(file_path, 'rb') as log:
+        log.seek(start)
+        offset = start
+        for line in log:
+            if line.startswith(SESSION_HEADER):
+                headers.append((offset, _header_date(line).date()))
+            offset += len(line)
+    return headers
+
+
+def _parse_entry(line):
+    offset, day = line.split()
+    return int(offset), date.fromisoformat(day.decode())
+
+
+def _read_index(f):
+    f.seek(0)
+    return [_parse_entry(line) for line in f]
+
+
+def _last_entry(f):
+    """The last index entry, read from the tail of the index (entries are short)."""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if not size:
+        return None
+    f.seek(max(0, size - 64))
+    return _parse_entry(f.read().rstrip(b'\n').rsplit(b'\n', 1)[-1])
+
+
+def _write_entries(f, entries):
+    f.seek(0, os.SEEK_END)
+    f.write(b''.join(f"{offset} {day.isoformat()}\n".encode() for offset, day in entries))
+    f.flush()
+
+
+def _is_header_at(file_path, offset):
+    with open(file_path, 'rb') as log:
+        log.seek(offset)
+        return log.read(len(SESSION_HEADER)) == SESSION_HEADER
+
+
+def _sync(f, file_path):
+    """
+    Bring the index up to date with the log. Sessions appended by code that
+    does not keep the index are found by scanning on from the last indexed
+    session, so this normally reads a single session; an index that no longer
+    fits the log (the log was replaced or truncated) is rebuilt.
+    """
+    if not os.path.exists(file_path):
+        return
+    last = _last_entry(f)
+    if last and (last[0] >= os.path.getsize(file_path) or not _is_header_at(file_path, last[0])):
+        f.truncate(0)
+        last = None
+    if last:
+        _write_entries(f, _scan_headers(file_path, last[0])[1:])
+    else:
+        _write_entries(f, _scan_headers(file_path))
+
+
+def load_index(file_path):
+    """The (offset, date) of every session of a log, in file order."""
+    with _locked(file_path) as f:
+        _sync(f, file_path)
+        return _read_index(f)
+
+
+def append_session(file_path, timestamp, present_names, absent_names):
+    """Append one attendance session to a log and add its header to the index."""
+    with _locked(file_path) as f:
+        _sync(f, file_path)
+        with open(file_path, 'ab') as report:
+            offset = report.tell() + 1  # past the blank line before the header
+            report.write(
+                f"\n--- Attendance Session: {timestamp} ---\n"
+                f"Present Students: {', '.join(present_names)}\n"
+                f"Absent Students: {', '.join(absent_names)}\n".encode('utf-8')
+            )
+        _write_entries(f, [(offset, datetime.strptime(timestamp.split(" ")[0], "%Y-%m-%d").date())])
+
+
+def iter_sessions(file_path, date_from=None, date_to=None):
+    """
+    Lazily yield the sessions of a log as {"date", "present", "absent"} dicts,
+    the same records parse_attendance returns, holding one line in memory at
+    a time. With a date range, the index is used to seek straight to the first
+    session on or after date_from and reading stops after date_to.
+    """
+    if date_from:
+        date_from = datetime.combine(date_from, datetime.min.time())
+    if date_to:
+        date_to = datetime.combine(date_to, datetime.min.time())
+
+    start = 0
+    entries = load_index(file_path) if (date_from or date_to) else []
+    days = [day for _, day in entries]
+    # Sessions are appended in time order unless the clock was changed.
+    ordered = all(a <= b for a, b in zip(days, days[1:]))
+    if date_from and ordered:
+        first = bisect.bisect_left(days, date_from.date())
+        if first == len(entries):
+            return
+        start = entries[first][0]
+
+    with open(file_path, 'rb') as log:
+        log.seek(start)
+        session = None
+        for line in log:
+            if line.startswith(SESSION_HEADER):
+                if session is not None and _in_range(session["date"], date_from, date_to):
+                    yield session
+                session = {"date": _header_date(line), "present": [], "absent": []}
+                if ordered and date_to and session["date"] > date_to:
+                    return
+            elif session is None:
+                continue
+            elif line.startswith(PRESENT_PREFIX):
+                session["present"] = _names(line)
+            elif line.startswith(ABSENT_PREFIX):
+                session["absent"] = _names(line)
+        if session is not None and _in_range(session["date"], date_from, date_to):
+            yield session
+
+
+def _in_range(day, date_from, date_to):
+    return (not date_from or day >= date_from) and (not date_to or day <= date_to)
@@ -0,0 +1,223 @@
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from .models import Student, AttendanceRecord, AttendanceDetail
+from .attendance_bitmap import roster_positions, pack_session
+from .attendance_log import append_session
+from .statistics import rebuild_summaries
+
+# Synthetic encodings: each student gets a random centre and their encodings
+# scatter around it. With 128 dimensions the distance between two points is
+# about 16 * their spread, so students land ~0.9 apart and a student's own
+# encodings ~0.25 apart, as with real dlib descriptors.
+STUDENT_SPREAD = 0.056
+ENCODING_NOISE = 0.0156
+
+# Pixel size of each face tile in a fixture class photo.
+TILE_SIZE = 220
+
+SEMESTER = 'bench'
+
+
+def timed(func, repeat, warmup=1):
+    """Timings of `repeat` calls of `func` after `warmup` untimed ones, in milliseconds."""
+    for _ in range(warmup):
+        func()
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        runs.append((time.perf_counter() - started) * 1000)
+    return {
+        'runs': repeat,
+        'min_ms': min(runs),
+        'median_ms': statistics.median(runs),
+        'mean_ms': statistics.fmean(runs),
+        'max_ms': max(runs),
+    }
+
+
+def environment():
+    """What a result was measured on, to tell apart runs on different commits and machines."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'face_pipeline': settings.FACE_PIPELINE,
+        'face_pipeline_workers': settings.FACE_PIPELINE_MAX_WORKERS,
+        'face_pipeline_executor': settings.FACE_PIPELINE_EXECUTOR,
+    }
+
+
+def section_name(index):
+    return f'S{index}'
+
+
+def synthetic_students(count, encodings_per_student=3, class_size=60, seed=0):
+    """
+    Student dicts with synthetic 128-d encodings, in sections of `class_size`
+    named S0, S1, ... The same seed gives the same students.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0, STUDENT_SPREAD, (count, 128)).astype(np.float32)
+    noise = rng.normal(0, ENCODING_NOISE, (count, encodings_per_student, 128)).astype(np.float32)
+    return [
+        {
+            'name': f'Student {i}',
+            'usn': f'BENCH{i:06d}',
+            'semester': SEMESTER,
+            'section': section_name(i // class_size),
+            'encodings': list(centres[i] + noise[i]),
+        }
+        for i in range(count)
+    ]
+
+
+def probe_faces(students, count, seed=1):
+    """Encodings of `count` faces in a class photo: half of them enrolled students, half strangers."""
+    rng = np.random.default_rng(seed)
+    known = [
+        students[i]['encodings'][0] + rng.normal(0, ENCODING_NOISE, 128).astype(np.float32)
+        for i in rng.choice(len(students), size=min(count // 2, len(students)), replace=False)
+    ]
+    strangers = list(rng.normal(0, STUDENT_SPREAD, (count - len(known), 128)).astype(np.float32))
+    return known + strangers
+
+
+def face_tile(photo):
+    """The face of a single-face photo with some context around it, as a BGR tile."""
+    import cv2
+    from .face_pipeline import detect_photos
+
+    faces = detect_photos([photo], endpoint='enroll')[0]
+    if len(faces) != 1:
+        raise ValueError(f'The fixture face photo must show exactly one face, found {len(faces)}')
+    return cv2.resize(cv2.cvtColor(faces[0].crop, cv2.COLOR_RGB2BGR), (TILE_SIZE, TILE_SIZE))
+
+
+def _grid(tile, faces, rows=None):
+    """The face tile repeated `faces` times on a grid, every other one mirrored."""
+    columns = max(1, int(np.ceil(np.sqrt(faces)))) if rows is None else max(1, -(-faces // rows))
+    rows = max(1, -(-faces // columns))
+    canvas = np.full((rows * TILE_SIZE, columns * TILE_SIZE, 3), 255, dtype=np.uint8)
+    for i in range(faces):
+        y, x = divmod(i, columns)
+        canvas[y * TILE_SIZE:(y + 1) * TILE_SIZE, x * TILE_SIZE:(x + 1) * TILE_SIZE] = \
+            tile if i % 2 == 0 else tile[:, ::-1]
+    return canvas
+
+
+def class_photo(tile, faces):
+    """JPEG of a class photo: the face tile repeated `faces` times on a grid."""
+    import cv2
+
+    ok, jpeg = cv2.imencode('.jpg', _grid(tile, faces), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return jpeg.tobytes()
+
+
+def class_video(tile, faces, seconds=8, fps=25, size=(1280, 720)):
+    """
+    MP4 of a class video: the camera pans at a steady speed along three rows
+    of `faces` face tiles, a frame width of them in view at a time.
+    """
+    import cv2
+
+    width, height = size
+    strip = _grid(tile, faces, rows=3)
+    strip = cv2.resize(strip, (max(1, round(strip.shape[1] * height / strip.shape[0])), height))
+    canvas = np.full((height, strip.shape[1] + width, 3), 255, dtype=np.uint8)
+    canvas[:, width // 2:width // 2 + strip.shape[1]] = strip
+    frames = max(2, int(seconds * fps))
+
+    with tempfile.NamedTemporaryFile(suffix='.mp4') as f:
+        writer = cv2.VideoWriter(f.name, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+        for n in range(frames):
+            x = round(strip.shape[1] * n / (frames - 1))
+            writer.write(np.ascontiguousarray(canvas[:, x:x + width]))
+        writer.release()
+        return f.read()
+
+
+def reset_data():
+    """Empty the scratch database tables, encoding store and logs between runs."""
+    from .encoding_store import encoding_store
+    from .encoding_cache import encoding_cache
+
+    Student.objects.all().delete()
+    AttendanceRecord.objects.all().delete()
+    encoding_store.write_students([])
+    encoding_cache.invalidate()
+    for name in os.listdir(settings.STUDENT_DATA_PATH):
+        if name.startswith('attendance_'):
+            os.unlink(os.path.join(settings.STUDENT_DATA_PATH, name))
+
+
+def load_students(students):
+    """Enroll synthetic students directly into the encoding store and the database."""
+    from .encoding_store import encoding_store
+    from .encoding_cache import encoding_cache
+
+    encoding_store.write_students(students)
+    encoding_cache.invalidate()
+    Student.objects.bulk_create([
+        Student(name=s['name'], usn=s['usn'], semester=s['semester'], section=s['section']) for s in students
+    ], batch_size=1000)
+
+
+def attendance_history(section, subject, sessions, attendance=0.8, seed=0):
+    """
+    Record `sessions` daily sessions of a class, with the details, bitmaps,
+    summaries and text log that taking attendance would leave. Returns the
+    log path and the ID of the last record.
+    """
+    rng = np.random.default_rng(seed)
+    students = list(Student.objects.filter(semester=SEMESTER, section=section).order_by('id'))
+    file_path = os.path.join(settings.STUDENT_DATA_PATH, f'attendance_{SEMESTER}_{subject}_{section}.txt')
+    start = date.today() - timedelta(days=sessions)
+
+    with transaction.atomic():
+        positions = roster_positions(SEMESTER, section, [student.id for student in students])
+        records = []
+        statuses = []
+        for day in range(sessions):
+            present = rng.random(len(students)) < attendance
+            status = {student.id: bool(p) for student, p in zip(students, present)}
+            present_bits, marked_bits = pack_session(positions, status)
+            records.append(AttendanceRecord(semester=SEMESTER, section=section, subject=subject,
+                                            file_path=file_path, present_bits=present_bits,
+                                            marked_bits=marked_bits))
+            statuses.append((start + timedelta(days=day), status))
+        records = AttendanceRecord.objects.bulk_create(records, batch_size=500)
+        for record, (day, _) in zip(records, statuses):
+            record.date = day  # auto_now_add ignores the value given on create
+        AttendanceRecord.objects.bulk_update(records, ['date'], batch_size=500)
+        AttendanceDetail.objects.bulk_create([
+            AttendanceDetail(record=record, student_id=student_id, status=present)
+            for record, (_, status) in zip(records, statuses)
+            for student_id, present in status.items()
+        ], batch_size=2000)
+    rebuild_summaries()
+
+    names = {student.id: student.name for student in students}
+    for day, status in statuses:
+        append_session(file_path, f'{day.isoformat()} 09:00:00',
+                       [names[i] for i, present in status.items() if present],
+                       [names[i] for i, present in status.items() if not present])
+    return file_path, records[-1].id
@@ -0,0 +1,269 @@
+import csv
+import io
+import json
+import posixpath
+import zipfile
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from .models import Student
+from .face_matching import stack_encodings, match_matrix
+from .face_pipeline import detect_photos, describe_faces
+from .encoding_cache import encoding_cache
+from .encoding_store import encoding_store
+
+MANIFEST_NAMES = ('manifest.json', 'manifest.csv')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+REQUIRED_FIELDS = ('name', 'usn', 'semester', 'section')
+
+# Batch encodings compared with each other per block, to bound the distance matrix.
+BATCH_MATCH_CHUNK = 1024
+
+
+class BulkEnrollmentError(Exception):
+    """The upload as a whole cannot be processed (bad archive or manifest)."""
+
+
+def parse_manifest(data, filename, defaults=None):
+    """
+    Student entries from a manifest: JSON (a list, or {"students": [...]}) or
+    CSV with name, usn, semester, section and photos (separated by ';').
+    `defaults` fills fields missing from every entry, e.g. a class-wide
+    semester and section.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    try:
+        if filename.lower().endswith('.csv'):
+            entries = list(csv.DictReader(io.StringIO(data)))
+            for entry in entries:
+                photos = entry.get('photos') or ''
+                entry['photos'] = [photo.strip() for photo in photos.split(';') if photo.strip()]
+        else:
+            entries = json.loads(data)
+            if isinstance(entries, dict):
+                entries = entries.get('students', [])
+    except (ValueError, csv.Error) as e:
+        raise BulkEnrollmentError(f'Could not read the manifest: {e}')
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise BulkEnrollmentError('The manifest must list one object per student')
+
+    students = []
+    for entry in entries:
+        student = {field: str(entry.get(field) or (defaults or {}).get(field) or '').strip()
+                   for field in REQUIRED_FIELDS}
+        photos = entry.get('photos') or []
+        student['photos'] = [photos] if isinstance(photos, str) else [str(photo) for photo in photos]
+        students.append(student)
+    return students
+
+
+class ArchivePhotos:
+    """Photos and manifest read lazily from an uploaded zip archive."""
+
+    def __init__(self, upload):
+        try:
+            self.archive = zipfile.ZipFile(upload)
+        except zipfile.BadZipFile:
+            raise BulkEnrollmentError('The archive is not a valid zip file')
+        infos = [info for info in self.archive.infolist() if not info.is_dir()]
+        if sum(info.file_size for info in infos) > settings.BULK_ENROLL_MAX_ARCHIVE_BYTES:
+            raise BulkEnrollmentError('The archive is too large once extracted')
+        self.names = [info.filename for info in infos]
+
+    def manifest(self):
+        for name in self.names:
+            if posixpath.basename(name).lower() in MANIFEST_NAMES and posixpath.dirname(name) in ('', '.'):
+                return self.archive.read(name), name
+        raise BulkEnrollmentError(f'The archive has no {" or ".join(MANIFEST_NAMES)} at its top level')
+
+    def read(self, name):
+        return self.archive.read(name)
+
+
+class UploadedPhotos:
+    """Photos uploaded as multipart files, looked up by file name."""
+
+    def __init__(self, files):
+        self.files = {file.name: file for file in files}
+        self.names = list(self.files)
+
+    def read(self, name):
+        upload = self.files[name]
+        upload.seek(0)
+        return upload.read()
+
+
+def _photos_by_usn(names):
+    """
+    Photos grouped by the USN their path names, for students the manifest lists
+    no photos for: '<usn>/...', '<usn>_...' or '<usn>.<ext>'.
+    """
+    photos = {}
+    for name in names:
+        base = posixpath.basename(name)
+        stem, extension = posixpath.splitext(base)
+        if extension.lower() not in IMAGE_EXTENSIONS:
+            continue
+        keys = {stem, base.split('_', 1)[0] if '_' in base else stem}
+        if '/' in name:
+            keys.add(name.split('/', 1)[0])
+        for key in keys:
+            photos.setdefault(key, []).append(name)
+    return photos
+
+
+def _validate(students, source):
+    """Report entry per student, with the reason it is rejected before any face work."""
+    names = set(source.names)
+    by_usn = None
+    seen = set()
+    reports = []
+    for student in students:
+        report = {'usn': student['usn'], 'name': student['name'], 'status': 'pending', 'message': ''}
+        if not student['photos']:
+            if by_usn is None:
+                by_usn = _photos_by_usn(source.names)
+            student['photos'] = sorted(by_usn.get(student['usn'], []))
+        missing = [photo for photo in student['photos'] if photo not in names]
+        if not all(student[field] for field in REQUIRED_FIELDS):
+            report.update(status='rejected', message='Missing required fields')
+        elif student['usn'] in seen:
+            report.update(status='rejected', message='USN appears more than once in the batch')
+        elif not student['photos']:
+            report.update(status='rejected', message='No photos found for this student')
+        elif missing:
+            report.update(status='rejected', message=f'Photos not found in the upload: {", ".join(missing)}')
+        seen.add(student['usn'])
+        reports.append(report)
+    return reports
+
+
+def _extract_encodings(students, reports, source):
+    """
+    Detect and describe the faces of every pending student, a chunk of
+    students at a time so only one chunk of photos is held in memory. Every
+    photo must show exactly one face, as with single enrollment.
+    """
+    chunk_size = settings.BULK_ENROLL_CHUNK_STUDENTS
+    pending = [i for i, report in enumerate(reports) if report['status'] == 'pending']
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        photos = []
+        owners = []
+        for i in chunk:
+            for photo in students[i]['photos']:
+                photos.append(source.read(photo))
+                owners.append(i)
+        detected = detect_photos(photos, endpoint='enroll')
+        del photos
+
+        faces = {i: [] for i in chunk}
+        for i, found in zip(owners, detected):
+            if reports[i]['status'] != 'pending':
+                continue
+            if not found:
+                reports[i].update(status='rejected', message='No face detected in one of the uploaded images. '
+                                                             'Please ensure clear, well-lit photos.')
+            elif len(found) > 1:
+                reports[i].update(status='rejected', message='Multiple faces detected in one image. Please upload '
+                                                             'photos with only the student\'s face.')
+            else:
+                faces[i].append(found[0])
+
+        accepted = [i for i in chunk if reports[i]['status'] == 'pending']
+        encodings = describe_faces([face for i in accepted for face in faces[i]])
+        offset = 0
+        for i in accepted:
+            students[i]['encodings'] = encodings[offset:offset + len(faces[i])]
+            offset += len(faces[i])
+
+
+def _check_duplicates(students, reports):
+    """
+    Reject students whose face matches another student, in two vectorized
+    passes: against everyone already stored (other than their own USN), and
+    against the students earlier in the batch.
+    """
+    pending = [i for i, report in enumerate(reports) if report['status'] == 'pending']
+    if not pending:
+        return
+
+    existing = encoding_cache.duplicate_index().find_duplicates(
+        [students[i]['encodings'] for i in pending], [students[i]['usn'] for i in pending]
+    )
+    for i, duplicate in zip(pending, existing):
+        if duplicate is not None:
+            reports[i].update(status='rejected', message=f'This face appears to match an existing student '
+                                                         f'({duplicate["name"]}). Please verify the student\'s identity.')
+
+    pending = [i for i in pending if reports[i]['status'] == 'pending']
+    if len(pending) < 2:
+        return
+    batch = stack_encodings([students[i] for i in pending])
+    # matches[a, b]: some encoding of pending student a matches pending student b.
+    matches = np.zeros((len(pending), len(pending)), dtype=bool)
+    for start in range(0, len(batch.encodings), BATCH_MATCH_CHUNK):
+        block = match_matrix(batch.encodings[start:start + BATCH_MATCH_CHUNK], batch)
+        np.logical_or.at(matches, batch.owners[start:start + BATCH_MATCH_CHUNK], block)
+    np.fill_diagonal(matches, False)
+
+    # Earlier students win: a student is rejected when they match one accepted before them.
+    accepted = np.zeros(len(pending), dtype=bool)
+    for a, i in enumerate(pending):
+        earlier = np.flatnonzero(matches[a, :a] & accepted[:a])
+        if len(earlier):
+            other = students[pending[earlier[0]]]
+            reports[i].update(status='rejected', message=f'This face appears to match another student in the '
+                                                         f'batch ({other["name"]}, {other["usn"]}).')
+        else:
+            accepted[a] = True
+
+
+def _commit(students, reports):
+    """Write the accepted students with one encoding store write and bulk database writes."""
+    accepted = [i for i, report in enumerate(reports) if report['status'] == 'pending']
+    if not accepted:
+        return
+
+    existed = encoding_store.upsert_many([
+        {key: students[i][key] for key in ('name', 'usn', 'encodings', 'semester', 'section')}
+        for i in accepted
+    ])
+    encoding_cache.invalidate()
+
+    with transaction.atomic():
+        rows = Student.objects.in_bulk([students[i]['usn'] for i in accepted], field_name='usn')
+        updated = []
+        created = []
+        for i in accepted:
+            student = students[i]
+            row = rows.get(student['usn'])
+            if row is None:
+                created.append(Student(name=student['name'], usn=student['usn'],
+                                       semester=student['semester'], section=student['section']))
+            else:
+                row.name, row.semester, row.section = student['name'], student['semester'], student['section']
+                updated.append(row)
+        Student.objects.bulk_create(created, batch_size=500)
+        Student.objects.bulk_update(updated, ['name', 'semester', 'section'], batch_size=500)
+
+    for i, was_stored in zip(accepted, existed):
+        status = 'updated' if was_stored or students[i]['usn'] in rows else 'enrolled'
+        reports[i].update(status=status, message=f'Student {status} successfully')
+
+
+def bulk_enroll(students, source):
+    """
+    Enroll a batch of students (manifest entries) whose photos come from
+    `source`. Returns one report per entry, in manifest order, with status
+    'enrolled', 'updated' or 'rejected' and a message.
+    """
+    if len(students) > settings.BULK_ENROLL_MAX_STUDENTS:
+        raise BulkEnrollmentError(f'At most {settings.BULK_ENROLL_MAX_STUDENTS} students can be enrolled at once')
+
+    reports = _validate(students, source)
+    _extract_encodings(students, reports, source)
+    _check_duplicates(students, reports)
+    _commit(students, reports)
+    return reports
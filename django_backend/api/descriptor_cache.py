@@ -0,0 +1,220 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple
+import numpy as np
+from django.conf import settings
+
+# A process scans the directory for entries to evict on its first write, then
+# each time it has written this share of DESCRIPTOR_CACHE_MAX_BYTES.
+EVICT_EVERY = 0.05
+
+COUNTERS = (
+    'hits',                  # photos whose faces all came with their descriptors
+    'partial_hits',          # photos whose faces came from the cache, some still to describe
+    'misses',
+    'descriptors_reused',
+    'writes',
+    'evicted',
+)
+
+# Counts of the current worker job, None outside of one (see capture).
+_job_counts = ContextVar('descriptor_cache_counts', default=None)
+
+
+class CachedFaces(NamedTuple):
+    """
+    The faces found in one photo: the photo's (width, height), each face's
+    position (as in DetectedFace) and appearance hash, and its descriptor
+    (a row of NaNs until it has been described).
+    """
+    size: np.ndarray
+    positions: np.ndarray
+    signatures: np.ndarray
+    descriptors: np.ndarray
+
+
+class DescriptorCache:
+    """
+    Faces found in uploaded photos, keyed by a hash of the photo bytes and the
+    face pipeline settings. Each entry is an .npz file in one directory, so
+    every process on the machine shares them; writes go to a temporary file
+    renamed into place. Reads mark an entry as used (its mtime) and the least
+    recently used entries are deleted once the directory outgrows `max_bytes`.
+    Counters are per process; worker jobs hand theirs back to be merged.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._written = None  # Bytes written since the last eviction scan; None before the first
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def count(self, name, amount=1):
+        counts = _job_counts.get()
+        if counts is not None:
+            counts[name] = counts.get(name, 0) + amount
+            return
+        with self._lock:
+            self.counters[name] += amount
+
+    def get(self, key):
+        """The CachedFaces stored under `key`, or None."""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                entry = CachedFaces(data['size'], data['positions'], data['signatures'], data['descriptors'])
+            os.utime(path)  # Mark as recently used for eviction
+        except (OSError, ValueError, KeyError):
+            return None  # Missing, evicted meanwhile or unreadable: recompute
+        return entry
+
+    def put(self, key, entry):
+        """Store an entry. A cache that cannot be written to only costs the recomputation."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError as e:
+            print(f"Error writing descriptor cache entry: {e}")
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **entry._asdict())
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing descriptor cache entry: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self.count('writes')
+        self._maybe_evict(key, size)
+
+    def add_descriptors(self, key, descriptors):
+        """Fill in descriptors ({face index: descriptor}) of an entry, if it is still cached."""
+        entry = self.get(key)
+        if entry is None:
+            return
+        updated = entry.descriptors.copy()
+        for index, descriptor in descriptors.items():
+            updated[index] = descriptor
+        self.put(key, entry._replace(descriptors=updated))
+
+    def _maybe_evict(self, keep, size):
+        with self._lock:
+            if self._written is not None:
+                self._written += size
+                if self._written < self.max_bytes * EVICT_EVERY:
+                    return
+            self._written = 0
+        self.evict(keep=self._path(keep))
+
+    def usage(self):
+        """Entries on disk, as (mtime, size, path), least recently used first."""
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if not item.name.endswith('.npz'):
+                        continue
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+        except FileNotFoundError:
+            pass
+        entries.sort()
+        return entries
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries until the cache is within max_bytes. Returns the number deleted."""
+        entries = self.usage()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        deleted = 0
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            deleted += 1
+        self.count('evicted', deleted)
+        return deleted
+
+    def stats(self):
+        entries = self.usage()
+        with self._lock:
+            return {
+                **self.counters,
+                'entries': len(entries),
+                'bytes': sum(entry_size for _, entry_size, _ in entries),
+                'max_bytes': self.max_bytes,
+            }
+
+
+def entry_of(photo_size, faces):
+    """A new CachedFaces for the DetectedFaces of a photo, none of them described yet."""
+    return CachedFaces(
+        np.array(photo_size, dtype=np.int64),
+        np.array([face.position for face in faces], dtype=np.float64).reshape(-1, 4),
+        np.array([face.signature for face in faces], dtype=np.uint64),
+        np.full((len(faces), 128), np.nan),
+    )
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide DescriptorCache for the configured directory, or None when it is disabled."""
+    global _cache
+    directory, max_bytes = settings.DESCRIPTOR_CACHE_DIR, settings.DESCRIPTOR_CACHE_MAX_BYTES
+    if not directory:
+        return None
+    with _cache_lock:
+        if _cache is None or (_cache.directory, _cache.max_bytes) != (directory, max_bytes):
+            _cache = DescriptorCache(directory, max_bytes)
+        return _cache
+
+
+@contextmanager
+def capture():
+    """
+    Collect the counts of the block instead of adding them to the cache, for a
+    job that runs in a worker thread or process and hands them back to be merged.
+    """
+    counts = {}
+    token = _job_counts.set(counts)
+    try:
+        yield counts
+    finally:
+        _job_counts.reset(token)
+
+
+def merge(counts):
+    """Add the counts captured by a worker job to this process's cache."""
+    cache = get_cache()
+    if cache is not None and counts:
+        for name, amount in counts.items():
+            cache.count(name, amount)
+
+
+def stats():
+    cache = get_cache()
+    if cache is None:
+        return {'enabled': False}
+    return {'enabled': True, **cache.stats()}
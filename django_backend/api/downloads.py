@@ -0,0 +1,117 @@
+import mimetypes
+import os
+import re
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_etags, parse_http_date_safe
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def resolve_media_path(root, filename):
+    """
+    The real path of `filename` under `root`, or None if it is not a regular
+    file inside it. '..' components and symlinks pointing outside are refused.
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, filename))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        return None
+    return path
+
+
+def file_etag(stat):
+    """Strong validator from the file's modification time and size."""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single 'bytes=' range, None when the header
+    should be ignored (absent, malformed or multiple ranges), or 'unsatisfiable'.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        start, end = max(size - length, 0), size - 1
+    if start >= size:
+        return 'unsatisfiable'
+    return start, end
+
+
+def _if_range_passes(request, etag, last_modified):
+    """A Range is only honoured when If-Range (if sent) still names this version of the file."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return parse_etags(if_range) == [etag]
+    date = parse_http_date_safe(if_range)
+    return date is not None and date == last_modified
+
+
+def _read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def serve_file(request, path, as_attachment=True):
+    """
+    Serve a file with ETag/Last-Modified validators, answering conditional
+    requests with 304 and a single byte range with 206.
+    """
+    stat = os.stat(path)
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+    validators = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+    }
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        for header, value in validators.items():
+            conditional.headers.setdefault(header, value)
+        return conditional
+
+    byte_range = None
+    if request.method == 'GET' and _if_range_passes(request, etag, last_modified):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response.headers['Content-Range'] = f'bytes */{stat.st_size}'
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(open(path, 'rb'), start, end - start + 1), status=206)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response.headers['Content-Length'] = str(end - start + 1)
+        response.headers['Content-Type'] = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response.headers['Content-Disposition'] = content_disposition_header(as_attachment, os.path.basename(path))
+    else:
+        response = FileResponse(open(path, 'rb'), as_attachment=as_attachment)
+    for header, value in validators.items():
+        response.headers[header] = value
+    return response
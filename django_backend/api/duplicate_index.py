@@ -0,0 +1,247 @@
+import threading
+import numpy as np
+from .encoding_formats import DECODE_CHUNK, decode, sq_norms
+from .face_matching import MATCH_THRESHOLD, MIN_CLOSE_MATCHES
+
+# Rows assigned per k-means chunk, to bound the (rows x lists) distance block.
+ASSIGN_CHUNK = 8192
+
+# Query encodings searched together, to bound the (queries x rows) distance block.
+QUERY_CHUNK = 1024
+
+
+def _sq_norms(rows):
+    return np.einsum('ij,ij->i', rows, rows)
+
+
+def _distances(queries, rows, row_sq_norms):
+    """Euclidean distances, computed the same way as face_matching.face_distances."""
+    sq = _sq_norms(queries)[:, None] + row_sq_norms[None, :] - 2.0 * (queries @ rows.T)
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
+
+
+class DuplicateIndex:
+    """
+    IVF-style nearest-neighbour index over every stored encoding, used by the
+    enrollment duplicate check.
+
+    A k-means coarse quantizer splits the encodings into lists. Each list keeps
+    its radius (the furthest member from the centroid), so by the triangle
+    inequality a list can only hold an encoding within `threshold` of a query
+    when dist(query, centroid) - radius < threshold. Probing exactly those lists
+    gives the same verdicts as a full scan. Setting `nprobe` additionally caps
+    the lists probed per encoding, trading recall for speed.
+
+    The index follows the encoding store: rows appended since the last sync are
+    assigned to the existing centroids, and the quantizer is only retrained after
+    compaction or once the store has grown well past the training size.
+    """
+
+    def __init__(self, nprobe=None, min_rows=2048, retrain_growth=4, seed=0):
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+        self.retrain_growth = retrain_growth
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.generation = None
+        self.stamp = None
+        self.matrix = None
+        self.scale = None
+        self.indexed_rows = 0
+        self.trained_rows = 0
+        self.centroids = None
+        self.radii = None
+        self.lists = []
+        self.row_sq_norms = np.empty(0, dtype=np.float32)
+        self.students = []
+        self.usn_index = {}
+        self.owners = np.empty(0, dtype=np.intp)
+        self.counts = np.empty(0, dtype=np.intp)
+
+    # Building
+
+    def _assign(self, rows, scale=None):
+        """Nearest centroid and distance to it for each (stored, with `scale`) row, in chunks."""
+        labels = np.empty(len(rows), dtype=np.intp)
+        dists = np.empty(len(rows), dtype=np.float32)
+        centroid_sq = _sq_norms(self.centroids)
+        for start in range(0, len(rows), ASSIGN_CHUNK):
+            chunk = np.asarray(decode(rows[start:start + ASSIGN_CHUNK], scale), dtype=np.float32)
+            d = _distances(chunk, self.centroids, centroid_sq)
+            labels[start:start + len(chunk)] = np.argmin(d, axis=1)
+            dists[start:start + len(chunk)] = d[np.arange(len(chunk)), labels[start:start + len(chunk)]]
+        return labels, dists
+
+    def _train(self, matrix, iterations=10):
+        """Fit the coarse quantizer on (a sample of) the current rows."""
+        rng = np.random.default_rng(self.seed)
+        nlist = int(np.clip(np.sqrt(len(matrix)), 1, 1024))
+        sample_size = min(len(matrix), nlist * 64)
+        sample = np.asarray(decode(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))], self.scale),
+                            dtype=np.float32)
+
+        self.centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels, _ = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            sizes = np.bincount(labels, minlength=nlist)
+            filled = sizes > 0
+            self.centroids[filled] = sums[filled] / sizes[filled, None]
+
+        self.radii = np.zeros(nlist, dtype=np.float32)
+        self.lists = [np.empty(0, dtype=np.intp) for _ in range(nlist)]
+        self.row_sq_norms = np.empty(0, dtype=np.float32)
+        self.indexed_rows = 0
+        self.trained_rows = len(matrix)
+
+    def _add_rows(self, matrix, start):
+        """Assign rows [start, len(matrix)) to the existing lists."""
+        rows = matrix[start:]
+        labels, dists = self._assign(rows, self.scale)
+        np.maximum.at(self.radii, labels, dists)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(len(self.lists) + 1))
+        for l in np.unique(labels):
+            new = order[bounds[l]:bounds[l + 1]] + start
+            self.lists[l] = np.concatenate([self.lists[l], new])
+        self.row_sq_norms = np.concatenate([self.row_sq_norms, sq_norms(rows, self.scale).astype(np.float32)])
+        self.indexed_rows = len(matrix)
+
+    def sync(self, snapshot):
+        """Bring the index up to date with a store snapshot."""
+        with self._lock:
+            if snapshot.stamp == self.stamp and snapshot.stamp is not None:
+                return
+            matrix = snapshot.matrix
+
+            if snapshot.generation != self.generation or len(matrix) < self.indexed_rows:
+                self._reset()
+            # Rows of a quantized store are decoded as they are indexed and scanned.
+            self.scale = snapshot.scale
+            if len(matrix) >= self.min_rows:
+                if self.centroids is None or len(matrix) > self.trained_rows * self.retrain_growth:
+                    self._train(matrix)
+                if len(matrix) > self.indexed_rows:
+                    self._add_rows(matrix, self.indexed_rows)
+
+            # Row owners are rebuilt from the (small) index; dead rows map to -1.
+            self.students = snapshot.student_dicts(with_encodings=False)
+            self.usn_index = {student['usn']: index for index, student in enumerate(self.students)}
+            self.owners = np.full(len(matrix), -1, dtype=np.intp)
+            self.counts = np.zeros(len(self.students), dtype=np.intp)
+            for index, entry in enumerate(snapshot.students):
+                self.owners[entry['start']:entry['start'] + entry['count']] = index
+                self.counts[index] = entry['count']
+
+            self.matrix = matrix
+            self.generation = snapshot.generation
+            self.stamp = snapshot.stamp
+
+    # Querying
+
+    def _candidate_rows(self, queries, threshold):
+        """Rows of every list that may hold an encoding within threshold of a query."""
+        if self.centroids is None:
+            # Too small to be worth indexing: scan everything.
+            return np.arange(len(self.matrix))
+        centroid_dists = _distances(queries, self.centroids, _sq_norms(self.centroids))
+        reachable = centroid_dists - self.radii[None, :] < threshold
+        if self.nprobe is not None:
+            nearest = np.argsort(centroid_dists, axis=1, kind='stable')[:, :self.nprobe]
+            capped = np.zeros_like(reachable)
+            np.put_along_axis(capped, nearest, True, axis=1)
+            reachable &= capped
+        probe = np.flatnonzero(reachable.any(axis=0))
+        if not len(probe):
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate([self.lists[l] for l in probe]))
+
+    def find_duplicate(self, encodings, exclude_usn=None, threshold=MATCH_THRESHOLD):
+        """
+        Return the first student (in roster order, other than `exclude_usn`) that
+        any of the given encodings matches under the is_same_person rule, or None.
+        """
+        return self.find_duplicates([encodings], [exclude_usn], threshold)[0]
+
+    def find_duplicates(self, groups, exclude_usns=None, threshold=MATCH_THRESHOLD):
+        """
+        find_duplicate for many students at once: `groups` holds the encodings of
+        each student and `exclude_usns` the USN each may match (their own). The
+        encodings of every group are searched together, in chunks.
+        """
+        with self._lock:
+            results = [None] * len(groups)
+            if self.matrix is None or not len(self.students) or not len(groups):
+                return results
+
+            sizes = [len(group) for group in groups]
+            queries = np.concatenate([np.asarray(group, dtype=np.float32).reshape(-1, 128) for group in groups])
+            query_group = np.repeat(np.arange(len(groups)), sizes)
+            excluded = np.array([self.usn_index.get(usn, -1) for usn in (exclude_usns or [None] * len(groups))],
+                                dtype=np.intp)
+            # Index of the first matching student per group; len(students) means none.
+            first = np.full(len(groups), len(self.students), dtype=np.intp)
+
+            for start in range(0, len(queries), QUERY_CHUNK):
+                chunk = queries[start:start + QUERY_CHUNK]
+                face_idx, owners = self._close_pairs(chunk, threshold)
+                if not len(face_idx):
+                    continue
+                chunk_group = query_group[start:start + QUERY_CHUNK][face_idx]
+                keep = owners != excluded[chunk_group]
+                np.minimum.at(first, chunk_group[keep], owners[keep])
+
+            return [self.students[index] if index < len(self.students) else None for index in first]
+
+    def _close_rows(self, queries, rows, threshold):
+        """
+        (query, position in `rows`) of every stored row within threshold of a
+        query. Rows are decoded DECODE_CHUNK at a time, so a compact matrix is
+        never widened as a whole.
+        """
+        face_parts, row_parts = [], []
+        for start in range(0, len(rows), DECODE_CHUNK):
+            chunk = rows[start:start + DECODE_CHUNK]
+            if len(chunk) and chunk[-1] - chunk[0] == len(chunk) - 1:
+                block = self.matrix[chunk[0]:chunk[-1] + 1]  # A contiguous run: slice, don't gather
+            else:
+                block = self.matrix[chunk]
+            candidates = np.asarray(decode(block, self.scale), dtype=np.float32)
+            face_idx, row_idx = np.nonzero(_distances(queries, candidates, self.row_sq_norms[chunk]) < threshold)
+            face_parts.append(face_idx)
+            row_parts.append(row_idx + start)
+        if not face_parts:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        return np.concatenate(face_parts), np.concatenate(row_parts)
+
+    def _close_pairs(self, queries, threshold):
+        """(query, student) pairs where the query matches the student under the is_same_person rule."""
+        empty = np.empty(0, dtype=np.intp)
+        rows = self._candidate_rows(queries, threshold)
+        if not len(rows):
+            return empty, empty
+
+        # Exact distances against the candidate rows only. When most lists are
+        # reachable a straight scan is cheaper than gathering rows.
+        if self.centroids is None or len(rows) > len(self.matrix) // 2:
+            rows = np.arange(len(self.matrix))
+            if len(self.row_sq_norms) != len(rows):
+                self.row_sq_norms = sq_norms(self.matrix, self.scale).astype(np.float32)
+        face_idx, row_idx = self._close_rows(queries, rows, threshold)
+        owners = self.owners[rows[row_idx]]
+        live = owners >= 0
+        if not live.any():
+            return empty, empty
+
+        # Close matches per (encoding, student), then the is_same_person rule.
+        pairs, close_counts = np.unique(
+            np.stack([face_idx[live], owners[live]], axis=1), axis=0, return_counts=True
+        )
+        required = np.minimum(self.counts[pairs[:, 1]], MIN_CLOSE_MATCHES)
+        matched = pairs[close_counts >= required]
+        return matched[:, 0], matched[:, 1]
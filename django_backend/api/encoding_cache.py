@@ -0,0 +1,121 @@
+import threading
+import numpy as np
+from django.conf import settings
+from .face_matching import EncodingMatrix
+from .encoding_store import encoding_store
+from .duplicate_index import DuplicateIndex
+
+
+class EncodingCache:
+    """
+    Process-wide cache of enrolled students and their stacked encodings.
+
+    The store is read once and kept in memory together with the
+    memory-mapped matrix. Each lookup compares the store's version stamp
+    with the one seen at load time, so a write made by another worker
+    process triggers a reload. Stacked matrices are built per (semester, section)
+    on first use.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._matrices = {}
+        self._duplicate_index = DuplicateIndex(
+            nprobe=settings.DUPLICATE_INDEX_NPROBE,
+            min_rows=settings.DUPLICATE_INDEX_MIN_ROWS,
+        )
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.invalidations = 0
+
+    def _ensure_loaded(self):
+        """Reload the store if it changed on disk. Caller holds the lock."""
+        if self._snapshot is not None and self.store.stamp() == self._snapshot.stamp:
+            return
+        if self._snapshot is not None:
+            self.reloads += 1
+        self._snapshot = self.store.snapshot()
+        self._matrices = {}
+
+    def _build(self, entries):
+        """Gather the rows of `entries` into an EncodingMatrix."""
+        snapshot = self._snapshot
+        students = snapshot.student_dicts(entries, with_encodings=False)
+        counts = [entry['count'] for entry in entries]
+        owners = np.repeat(np.arange(len(entries), dtype=np.intp), counts)
+        if entries is snapshot.students and sum(counts) == len(snapshot.matrix):
+            # Every row is live and in roster order: use the mapping as is.
+            encodings = snapshot.matrix
+        elif entries:
+            rows = np.concatenate([
+                np.arange(entry['start'], entry['start'] + entry['count']) for entry in entries
+            ])
+            encodings = np.ascontiguousarray(snapshot.matrix[rows])
+        else:
+            encodings = snapshot.matrix[:0]
+        return EncodingMatrix(students, encodings, owners, snapshot.scale)
+
+    def _matrix(self, key, select):
+        self._ensure_loaded()
+        matrix = self._matrices.get(key)
+        if matrix is None:
+            self.misses += 1
+            entries = self._snapshot.students
+            if select is not None:
+                entries = [entry for entry in entries if select(entry)]
+            matrix = self._build(entries)
+            self._matrices[key] = matrix
+        else:
+            self.hits += 1
+        return matrix
+
+    def students(self):
+        """Return all enrolled students as dicts (encodings are matrix views)."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._snapshot.student_dicts()
+
+    def all_matrix(self):
+        """Stacked encodings of every enrolled student."""
+        with self._lock:
+            return self._matrix(None, None)
+
+    def class_matrix(self, semester, section):
+        """Stacked encodings of the students of one semester/section."""
+        with self._lock:
+            return self._matrix(
+                (semester, section),
+                lambda s: s['semester'] == semester and s['section'] == section,
+            )
+
+    def duplicate_index(self):
+        """Nearest-neighbour index over every stored encoding, synced with the store."""
+        with self._lock:
+            self._ensure_loaded()
+            snapshot = self._snapshot
+        self._duplicate_index.sync(snapshot)
+        return self._duplicate_index
+
+    def invalidate(self):
+        """Drop everything so the next lookup reads the store again."""
+        with self._lock:
+            self._snapshot = None
+            self._matrices = {}
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'invalidations': self.invalidations,
+                'cached_classes': len([k for k in self._matrices if k is not None]),
+                'students': len(self._snapshot.students) if self._snapshot is not None else 0,
+            }
+
+
+encoding_cache = EncodingCache(encoding_store)
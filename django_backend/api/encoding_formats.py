@@ -0,0 +1,78 @@
+import numpy as np
+
+# Formats the encoding matrix can be stored in, with the suffix of its file.
+# float16 halves the float32 matrix and int8 quarters it: each dimension is
+# stored as a multiple of its own scale, rounded to the nearest of -127..127.
+FORMATS = {
+    'float32': 'f32',
+    'float16': 'f16',
+    'int8': 'i8',
+}
+
+# int8 scales cover the largest value of each dimension times this margin, so
+# students enrolled after the scale was fitted rarely exceed it (the store
+# re-quantizes when they do, see saturated).
+INT8_HEADROOM = 1.25
+
+# Range assumed for every dimension when an int8 matrix starts out empty
+# (descriptor components are well within it).
+INT8_DEFAULT_RANGE = 0.5
+
+# Rows widened to float32 at a time when computing with a compact matrix.
+DECODE_CHUNK = 8192
+
+
+def int8_scale(rows):
+    """Per-dimension int8 scale fitted to float rows."""
+    rows = np.asarray(rows, dtype=np.float32).reshape(-1, 128)
+    if len(rows):
+        limit = np.abs(rows).max(axis=0) * INT8_HEADROOM
+    else:
+        limit = np.zeros(128, dtype=np.float32)
+    limit = np.where(limit > 0, limit, INT8_DEFAULT_RANGE)
+    return (limit / 127).astype(np.float32)
+
+
+def encode(rows, dtype, scale=None):
+    """
+    Float rows in a stored format. Returns the rows and, for int8, the scale
+    they were quantized with (fitted to the rows unless given), else None.
+    """
+    rows = np.asarray(rows, dtype=np.float32).reshape(-1, 128)
+    if dtype == 'int8':
+        if scale is None:
+            scale = int8_scale(rows)
+        return np.clip(np.rint(rows / scale), -127, 127).astype(np.int8), scale
+    return rows.astype(dtype), None
+
+
+def saturated(rows, scale):
+    """Which float rows have a value beyond an int8 scale, i.e. would be clipped by encode."""
+    rows = np.asarray(rows, dtype=np.float32).reshape(-1, 128)
+    return (np.abs(rows) > scale * 127.5).any(axis=1)
+
+
+def decode(rows, scale=None):
+    """Stored rows as float32 (float64 rows are left as they are)."""
+    rows = np.asarray(rows)
+    if scale is not None:
+        return rows.astype(np.float32) * scale
+    if rows.dtype == np.float16:
+        return rows.astype(np.float32)
+    return rows
+
+
+def is_compact(rows, scale=None):
+    """Whether rows are stored in a format numpy's BLAS cannot multiply directly."""
+    return scale is not None or rows.dtype == np.float16
+
+
+def sq_norms(rows, scale=None):
+    """Squared norm of every (decoded) row."""
+    if not is_compact(rows, scale):
+        return np.einsum('ij,ij->i', rows, rows)
+    norms = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), DECODE_CHUNK):
+        block = decode(rows[start:start + DECODE_CHUNK], scale)
+        norms[start:start + len(block)] = np.einsum('ij,ij->i', block, block)
+    return norms
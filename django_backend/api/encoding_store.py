@@ -0,0 +1,566 @@
+import os
+import json
+import pickle
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from . import encoding_formats
+from .file_lock import locked_file
+
+ENCODING_DIM = 128
+ENCODING_DTYPE = np.float32
+
+# Bump when the on-disk layout changes. Format 2 indexes are format 3 without
+# the int8 scale, so they can still be read.
+STORE_FORMAT = 3
+READABLE_FORMATS = (2, 3)
+
+
+class EncodingStoreError(Exception):
+    """The store on disk cannot be used: an unknown format, or a legacy import that failed."""
+
+
+def read_pickle_students(path):
+    """Read every student dict from a legacy pickle stream file."""
+    students = []
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    students.append(pickle.load(f))
+                except EOFError:
+                    break
+    except FileNotFoundError:
+        pass
+    return students
+
+
+def _atomic_write(path, data, mode='wb'):
+    """Write a file next to `path` and rename it into place."""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _unlink_quietly(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class StoreSnapshot:
+    """
+    A consistent view of the store: the student entries and the memory-mapped
+    matrix they point at. Rows are only read when they are touched. The matrix
+    is in the store's format; `scale` is its int8 scale, if any.
+    """
+
+    def __init__(self, students, matrix, stamp, generation=0, dead_rows=0, scale=None):
+        self.students = students
+        self.matrix = matrix
+        self.stamp = stamp
+        # Row numbers are stable within a generation; compaction starts a new one.
+        self.generation = generation
+        self.dead_rows = dead_rows
+        self.scale = scale
+
+    def encodings(self, entry):
+        """One student's rows as floats: a zero-copy view unless the store is quantized."""
+        return encoding_formats.decode(self.matrix[entry['start']:entry['start'] + entry['count']], self.scale)
+
+    def student_dicts(self, entries=None, with_encodings=True):
+        """
+        Students in the legacy dict format. Matrices built from the snapshot
+        leave out the encodings, which a quantized store would have to decode.
+        """
+        students = []
+        for entry in (self.students if entries is None else entries):
+            student = {
+                'name': entry['name'],
+                'usn': entry['usn'],
+                'semester': entry['semester'],
+                'section': entry['section'],
+            }
+            if with_encodings:
+                student['encodings'] = self.encodings(entry)
+            students.append(student)
+        return students
+
+    def find(self, usn):
+        for entry in self.students:
+            if entry['usn'] == usn:
+                return entry
+        return None
+
+
+class _State:
+    """Replayed view of one generation: its index plus the journal read so far."""
+
+    def __init__(self, index, index_stamp):
+        self.index_stamp = index_stamp
+        self.generation = index['generation']
+        self.matrix_name = index['matrix']
+        self.journal_name = index['journal']
+        self.entries = {entry['usn']: entry for entry in index['students']}
+        self.rows = index['rows']
+        self.dead_rows = index.get('dead_rows', 0)
+        self.dtype = index.get('dtype', 'float32')
+        self.scale = np.asarray(index['scale'], dtype=np.float32) if index.get('scale') else None
+        self.journal_offset = 0
+        self.journal_seen = 0
+
+    def apply(self, record):
+        if record.get('op') != 'put':
+            return
+        for entry in record['students']:
+            old = self.entries.get(entry['usn'])
+            if old is not None:
+                # The old rows become a tombstone until the next compaction.
+                self.dead_rows += old['count']
+            # Re-enrolled USNs keep their position in the roster.
+            self.entries[entry['usn']] = entry
+        self.rows = max(self.rows, record['rows'])
+
+
+class EncodingStore:
+    """
+    Columnar, append-only encoding storage.
+
+    Encodings live in a fixed-width matrix file opened with np.memmap, so
+    worker processes share the page cache instead of unpickling their own
+    copy. Each generation of the store consists of:
+
+    - encodings.<gen>.f32 (.f16, .i8): the matrix, in the format named by
+      ENCODING_STORE_DTYPE when the generation was written. Enrollment only
+      appends rows to it, in the generation's format; an int8 generation
+      keeps the per-dimension scale it was written with in the index, and
+      rows beyond that scale are written as a new, re-quantized generation
+      instead of being clipped.
+    - encodings.<gen>.journal: one JSON line per write, naming the row range of
+      every student it touched. A re-enrolled USN replaces its entry and its
+      old rows become dead until compaction.
+    - encodings_index.json: the snapshot the journal is replayed on top of.
+
+    Writers serialise on a lock file, fsync the rows before the journal line
+    that references them and ignore a torn last line, so a crash never loses
+    an acknowledged enrollment. Compaction copies the live rows into a new
+    generation and swaps the index with an atomic rename; it also converts a
+    store whose format differs from the configured one, and refits the int8
+    scale to the rows it keeps.
+    """
+
+    def __init__(self, directory, index_name='encodings_index.json', legacy_pickle=None):
+        self.directory = directory
+        # Imported the first time the store is used, if the store does not exist yet
+        self.legacy_pickle = legacy_pickle
+        self.index_path = os.path.join(directory, index_name)
+        self.lock_path = os.path.join(directory, 'encodings.lock')
+        self.compact_dead_ratio = getattr(settings, 'ENCODING_COMPACT_DEAD_RATIO', 0.5)
+        self.compact_min_dead_rows = getattr(settings, 'ENCODING_COMPACT_MIN_DEAD_ROWS', 256)
+        self.dtype = getattr(settings, 'ENCODING_STORE_DTYPE', 'float32')
+        if self.dtype not in encoding_formats.FORMATS:
+            raise ValueError(f'Unknown ENCODING_STORE_DTYPE {self.dtype!r}')
+        self._lock = threading.RLock()
+        self._state = None
+        self._matrix = None
+        self._compaction_thread = None
+        self._file_lock_depth = 0
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process that writes to the store (reentrant)."""
+        with self._lock:
+            if self._file_lock_depth:
+                self._file_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth -= 1
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with locked_file(self.lock_path):
+                self._file_lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth = 0
+
+    # Reading
+
+    def stamp(self):
+        """Cheap version stamp; changes on every write and every compaction."""
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        index_stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        state = self._state
+        if state is None or state.index_stamp != index_stamp:
+            return (index_stamp, None)
+        try:
+            journal_size = os.path.getsize(self._path(state.journal_name))
+        except FileNotFoundError:
+            journal_size = None
+        return (index_stamp, journal_size)
+
+    def _load_index(self):
+        with open(self.index_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            index = json.loads(f.read().decode('utf-8'))
+        if index.get('format') not in READABLE_FORMATS or index.get('dim') != ENCODING_DIM:
+            raise EncodingStoreError(
+                f"{self.index_path} has format {index.get('format')!r} and dimension {index.get('dim')!r}; "
+                f"this version reads formats {READABLE_FORMATS} of dimension {ENCODING_DIM}"
+            )
+        return index, (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _replay_journal(self, state):
+        """Apply journal lines written since the last call. Caller holds self._lock."""
+        with open(self._path(state.journal_name), 'rb') as f:
+            f.seek(state.journal_offset)
+            tail = f.read()
+        state.journal_seen = state.journal_offset + len(tail)
+        # A line without its newline is a torn write; it is skipped until completed.
+        complete = tail[:tail.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            if line.strip():
+                state.apply(json.loads(line.decode('utf-8')))
+        state.journal_offset += len(complete)
+
+    def _refresh(self):
+        """Bring the in-memory state up to date with the files. Caller holds self._lock."""
+        for _ in range(5):
+            try:
+                index, index_stamp = self._load_index()
+            except FileNotFoundError:
+                self._state = None
+                self._matrix = None
+                return None
+            if self._state is None or self._state.index_stamp != index_stamp:
+                self._state = _State(index, index_stamp)
+                self._matrix = None
+            try:
+                self._replay_journal(self._state)
+                return self._state
+            except FileNotFoundError:
+                # Compacted underneath us; the fresh index names the new generation.
+                self._state = None
+                continue
+        raise RuntimeError('Encoding store changed too often while opening it')
+
+    def _open_matrix(self, state):
+        if not state.rows:
+            return np.empty((0, ENCODING_DIM), dtype=state.dtype)
+        if self._matrix is None or len(self._matrix) != state.rows:
+            self._matrix = np.memmap(
+                self._path(state.matrix_name),
+                dtype=state.dtype,
+                mode='r',
+                shape=(state.rows, ENCODING_DIM),
+            )
+        return self._matrix
+
+    def snapshot(self):
+        """The current students and matrix as a consistent pair."""
+        self._migrate_legacy()
+        with self._lock:
+            for _ in range(5):
+                state = self._refresh()
+                if state is None:
+                    empty = np.empty((0, ENCODING_DIM), dtype=ENCODING_DTYPE)
+                    return StoreSnapshot([], empty, None)
+                try:
+                    matrix = self._open_matrix(state)
+                except FileNotFoundError:
+                    # Compacted between reading the index and opening its matrix.
+                    self._state = None
+                    self._matrix = None
+                    continue
+                return StoreSnapshot(
+                    list(state.entries.values()),
+                    matrix,
+                    (state.index_stamp, state.journal_seen),
+                    state.generation,
+                    state.dead_rows,
+                    state.scale,
+                )
+        raise RuntimeError('Encoding store changed too often while opening it')
+
+    # Writing
+
+    def _write_generation(self, entries, matrix, generation, scale=None):
+        """
+        Write a complete new generation and make it current. `matrix` holds rows
+        already in a store format (with their int8 scale). Caller holds the file lock.
+        """
+        dtype = np.dtype(matrix.dtype).name
+        matrix_name = f'encodings.{generation}.{encoding_formats.FORMATS[dtype]}'
+        journal_name = f'encodings.{generation}.journal'
+        _atomic_write(self._path(matrix_name), np.ascontiguousarray(matrix).tobytes())
+        _atomic_write(self._path(journal_name), b'')
+
+        index = {
+            'format': STORE_FORMAT,
+            'dim': ENCODING_DIM,
+            'dtype': dtype,
+            'scale': scale.tolist() if scale is not None else None,
+            'generation': generation,
+            'matrix': matrix_name,
+            'journal': journal_name,
+            'rows': len(matrix),
+            'dead_rows': 0,
+            'students': entries,
+        }
+        _atomic_write(self.index_path, json.dumps(index).encode('utf-8'))
+
+    def _retire(self, state):
+        """Delete the files of a replaced generation. Open memmaps keep their pages."""
+        if state is not None:
+            _unlink_quietly(self._path(state.matrix_name))
+            _unlink_quietly(self._path(state.journal_name))
+
+    def write_students(self, students):
+        """Replace the whole store with the given student dicts."""
+        entries = []
+        blocks = []
+        row = 0
+        for student in students:
+            block = np.asarray(student['encodings'], dtype=ENCODING_DTYPE).reshape(-1, ENCODING_DIM)
+            entries.append({
+                'usn': student['usn'],
+                'name': student['name'],
+                'semester': student['semester'],
+                'section': student['section'],
+                'start': row,
+                'count': len(block),
+            })
+            blocks.append(block)
+            row += len(block)
+        matrix = np.concatenate(blocks) if blocks else np.empty((0, ENCODING_DIM), dtype=ENCODING_DTYPE)
+
+        with self._file_lock():
+            old_state = self._refresh()
+            generation = old_state.generation + 1 if old_state is not None else 1
+            rows, scale = encoding_formats.encode(matrix, self.dtype)
+            self._write_generation(entries, rows, generation, scale)
+            self._retire(old_state)
+            self._refresh()
+
+    @staticmethod
+    def _truncate_torn_tail(f, unit):
+        """Drop a partial record left at the end of an append-only file by a crash."""
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if unit is not None:
+            keep = size - size % unit
+        else:
+            # Journal lines end with a newline; cut back to the last one.
+            keep = size
+            while keep:
+                chunk_start = max(0, keep - 65536)
+                f.seek(chunk_start)
+                chunk = f.read(keep - chunk_start)
+                if keep == size and chunk.endswith(b'\n'):
+                    break
+                newline = chunk.rfind(b'\n')
+                if newline >= 0:
+                    keep = chunk_start + newline + 1
+                    break
+                keep = chunk_start
+        if keep != size:
+            f.truncate(keep)
+        f.seek(keep)
+        return keep
+
+    def upsert_many(self, students):
+        """
+        Add students, or replace the entries with the same USN, in one write.
+        Returns a list of flags telling which students already existed.
+        """
+        self._migrate_legacy()
+        with self._file_lock():
+            state = self._refresh()
+            if state is None:
+                rows, scale = encoding_formats.encode(np.empty((0, ENCODING_DIM)), self.dtype)
+                self._write_generation([], rows, 1, scale)
+                state = self._refresh()
+            existed = [s['usn'] in state.entries for s in students]
+            if state.scale is not None:
+                clipped = sum(int(encoding_formats.saturated(s['encodings'], state.scale).sum()) for s in students)
+                if clipped:
+                    # Appended as they are, these rows would be clipped to the
+                    # generation's int8 scale; rewrite the store with a new one.
+                    self._rewrite(state, students)
+                    print(f"{clipped} new encodings exceeded the int8 scale of the encoding store; "
+                          f"re-quantized it with a new scale")
+                    return existed
+            # Rows are appended in the generation's format.
+            blocks = [encoding_formats.encode(s['encodings'], state.dtype, state.scale)[0] for s in students]
+            row_bytes = ENCODING_DIM * np.dtype(state.dtype).itemsize
+
+            # 1. Append the rows and make them durable.
+            with open(self._path(state.matrix_name), 'r+b') as f:
+                start = self._truncate_torn_tail(f, row_bytes) // row_bytes
+                for block in blocks:
+                    f.write(np.ascontiguousarray(block).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            # 2. Only then publish them with a single journal line.
+            entries = []
+            row = start
+            for student, block in zip(students, blocks):
+                entries.append({
+                    'usn': student['usn'],
+                    'name': student['name'],
+                    'semester': student['semester'],
+                    'section': student['section'],
+                    'start': row,
+                    'count': len(block),
+                })
+                row += len(block)
+            record = {'op': 'put', 'rows': row, 'students': entries}
+            with open(self._path(state.journal_name), 'r+b') as f:
+                self._truncate_torn_tail(f, None)
+                f.write(json.dumps(record).encode('utf-8') + b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._refresh()
+
+        self.maybe_compact()
+        return existed
+
+    def upsert(self, student):
+        """
+        Add a student, or replace the entry with the same USN.
+        Returns True if the student already existed.
+        """
+        return self.upsert_many([student])[0]
+
+    # Compaction
+
+    def needs_compaction(self):
+        with self._lock:
+            state = self._refresh()
+        if state is None or not state.dead_rows:
+            return False
+        return (state.dead_rows >= self.compact_min_dead_rows
+                and state.dead_rows >= self.compact_dead_ratio * state.rows)
+
+    def compact(self):
+        """
+        Copy the live rows into a new generation, in the configured format.
+        Returns the number of rows reclaimed.
+        """
+        with self._file_lock():
+            state = self._refresh()
+            if state is None or not state.dead_rows and state.dtype == self.dtype:
+                return 0
+            return self._rewrite(state)
+
+    def _rewrite(self, state, students=()):
+        """
+        Write the live rows of `state`, with `students` added (replacing the
+        entries with the same USN), as a new generation in the configured
+        format. An int8 generation gets a scale fitted to all of its rows.
+        Caller holds the file lock. Returns the number of rows of `state` not
+        carried over (dead and replaced rows).
+        """
+        matrix = self._open_matrix(state)
+        pending = {}
+        for student in students:
+            pending[student['usn']] = student
+        entries = []
+        blocks = []
+        row = carried = 0
+        for usn, entry in state.entries.items():
+            student = pending.pop(usn, None)
+            if student is None:
+                block = encoding_formats.decode(matrix[entry['start']:entry['start'] + entry['count']], state.scale)
+                carried += entry['count']
+            else:
+                block = student['encodings']
+                entry = {key: student[key] for key in ('usn', 'name', 'semester', 'section')}
+            block = np.asarray(block, dtype=ENCODING_DTYPE).reshape(-1, ENCODING_DIM)
+            blocks.append(block)
+            entries.append(dict(entry, start=row, count=len(block)))
+            row += len(block)
+        for student in pending.values():
+            block = np.asarray(student['encodings'], dtype=ENCODING_DTYPE).reshape(-1, ENCODING_DIM)
+            blocks.append(block)
+            entry = {key: student[key] for key in ('usn', 'name', 'semester', 'section')}
+            entries.append(dict(entry, start=row, count=len(block)))
+            row += len(block)
+        live = np.concatenate(blocks) if blocks else np.empty((0, ENCODING_DIM), dtype=ENCODING_DTYPE)
+        rows, scale = encoding_formats.encode(live, self.dtype)
+        self._write_generation(entries, rows, state.generation + 1, scale)
+        self._retire(state)
+        self._refresh()
+        return state.rows - carried
+
+    def maybe_compact(self):
+        """Start a background compaction when enough rows are dead."""
+        if not self.needs_compaction():
+            return
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            self._compaction_thread = threading.Thread(
+                target=self._compact_in_background, name='encoding-store-compaction', daemon=True
+            )
+            self._compaction_thread.start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Error compacting encoding store: {e}")
+
+    # Migration
+
+    def migrate_from_pickle(self, pickle_path):
+        """One-shot import of the legacy encodings.pkl stream. Returns the student count."""
+        students = read_pickle_students(pickle_path)
+        self.write_students(students)
+        return len(students)
+
+
+    def _migrate_legacy(self):
+        """
+        Import `legacy_pickle` into the store if the store has not been created
+        yet. Until the import succeeds the store is neither read nor written,
+        so a failed import is retried rather than replaced by an empty store.
+        """
+        if not self.legacy_pickle or self.exists() or not os.path.exists(self.legacy_pickle):
+            return
+        try:
+            with self._file_lock():
+                # Another worker may have finished the migration while we waited.
+                if self.exists():
+                    return
+                count = self.migrate_from_pickle(self.legacy_pickle)
+        except Exception as e:
+            raise EncodingStoreError(f"Could not import the legacy encodings in {self.legacy_pickle}: {e}") from e
+        print(f"Migrated {count} students from {self.legacy_pickle} to the encoding store")
+
+
+encoding_store = EncodingStore(settings.ENCODING_STORE_DIR, legacy_pickle=settings.PICKLE_FILE)
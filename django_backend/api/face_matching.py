@@ -0,0 +1,147 @@
+import numpy as np
+from .encoding_formats import DECODE_CHUNK, is_compact, sq_norms
+
+# Same threshold as is_same_person (stricter than dlib's usual 0.6).
+MATCH_THRESHOLD = 0.4
+
+# A student with several stored encodings needs at least this many close matches.
+MIN_CLOSE_MATCHES = 2
+
+
+class EncodingMatrix:
+    """
+    All encodings of a group of students stacked into one contiguous matrix.
+
+    `encodings` has one row per stored encoding and `owners[i]` is the index
+    (into `students`) of the student that row belongs to. Rows may be in any
+    store format (see encoding_formats); `scale` is the int8 scale, if any.
+    """
+
+    def __init__(self, students, encodings, owners, scale=None):
+        self.students = students
+        self.encodings = encodings
+        self.owners = owners
+        self.scale = scale
+        self.counts = np.bincount(owners, minlength=len(students))
+        # Squared norms are reused by every distance computation.
+        self.sq_norms = sq_norms(encodings, scale)
+
+    def __len__(self):
+        return len(self.students)
+
+
+def stack_encodings(students):
+    """Build an EncodingMatrix from a list of student dicts."""
+    students = list(students)
+    rows = []
+    owners = []
+    for index, student in enumerate(students):
+        for encoding in student['encodings']:
+            rows.append(np.asarray(encoding, dtype=np.float64))
+            owners.append(index)
+
+    if rows:
+        encodings = np.ascontiguousarray(np.vstack(rows))
+    else:
+        encodings = np.empty((0, 128), dtype=np.float64)
+
+    return EncodingMatrix(students, encodings, np.asarray(owners, dtype=np.intp))
+
+
+def face_distances(face_encodings, matrix):
+    """
+    Euclidean distances between every face and every stored encoding.
+    Returns an array of shape (faces, stored encodings).
+    """
+    if is_compact(matrix.encodings, matrix.scale):
+        return _compact_distances(face_encodings, matrix)
+
+    # Work in the stored dtype so a float32 memory-mapped matrix is never upcast.
+    faces = np.asarray(face_encodings, dtype=matrix.encodings.dtype).reshape(-1, 128)
+    if not len(faces) or not len(matrix.encodings):
+        return np.empty((len(faces), len(matrix.encodings)), dtype=faces.dtype)
+
+    # |a - b|^2 = |a|^2 + |b|^2 - 2ab, as a single matrix product.
+    face_sq = np.einsum('ij,ij->i', faces, faces)
+    sq = face_sq[:, None] + matrix.sq_norms[None, :] - 2.0 * (faces @ matrix.encodings.T)
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
+
+
+def _compact_distances(face_encodings, matrix):
+    """
+    face_distances against a float16 or int8 matrix. BLAS only multiplies
+    floats, so rows are widened to float32 a chunk at a time and the matrix
+    is never decoded as a whole. An int8 row times the scale is the encoding,
+    so the scale is applied to the faces once instead of to every row.
+    """
+    faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, 128)
+    rows = matrix.encodings
+    if not len(faces) or not len(rows):
+        return np.empty((len(faces), len(rows)), dtype=np.float32)
+
+    weighted = faces * matrix.scale if matrix.scale is not None else faces
+    dot = np.empty((len(faces), len(rows)), dtype=np.float32)
+    for start in range(0, len(rows), DECODE_CHUNK):
+        block = rows[start:start + DECODE_CHUNK].astype(np.float32)
+        dot[:, start:start + len(block)] = weighted @ block.T
+
+    face_sq = np.einsum('ij,ij->i', faces, faces)
+    sq = face_sq[:, None] + matrix.sq_norms[None, :] - 2.0 * dot
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
+
+
+def match_matrix(face_encodings, matrix, threshold=MATCH_THRESHOLD):
+    """
+    Boolean array of shape (faces, students): True where is_same_person would
+    accept the face for that student.
+    """
+    faces = np.asarray(face_encodings).reshape(-1, 128)
+    num_students = len(matrix)
+    if not len(faces) or not num_students:
+        return np.zeros((len(faces), num_students), dtype=bool)
+
+    close = face_distances(faces, matrix) < threshold
+
+    # Count close matches per (face, student) in one pass over the owners vector.
+    close_counts = np.zeros((len(faces), num_students), dtype=np.intp)
+    face_idx, enc_idx = np.nonzero(close)
+    np.add.at(close_counts, (face_idx, matrix.owners[enc_idx]), 1)
+
+    # One stored encoding needs one close match, several need MIN_CLOSE_MATCHES.
+    required = np.minimum(matrix.counts, MIN_CLOSE_MATCHES)
+    return (close_counts >= required[None, :]) & (matrix.counts > 0)[None, :]
+
+
+def match_faces(face_encodings, matrix, threshold=MATCH_THRESHOLD):
+    """
+    For each face, the index of the first student (in roster order) it matches,
+    or -1 when it matches nobody.
+    """
+    matches = match_matrix(face_encodings, matrix, threshold)
+    if not matches.size:
+        return np.full(len(matches), -1, dtype=np.intp)
+    first = np.argmax(matches, axis=1)
+    return np.where(matches.any(axis=1), first, -1)
+
+
+def find_duplicate(encodings, matrix, exclude_usn=None, threshold=MATCH_THRESHOLD):
+    """
+    Return the first student in `matrix` (other than `exclude_usn`) that any of
+    the given encodings matches, or None.
+    """
+    matches = match_matrix(encodings, matrix, threshold)
+    if not matches.size:
+        return None
+
+    hits = matches.any(axis=0)
+    if exclude_usn is not None:
+        for index, student in enumerate(matrix.students):
+            if student['usn'] == exclude_usn:
+                hits[index] = False
+
+    candidates = np.flatnonzero(hits)
+    if not len(candidates):
+        return None
+    return matrix.students[candidates[0]]
@@ -0,0 +1,491 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from functools import partial
+from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from django.conf import settings
+from .instrumentation import stage, capture, merge, enabled
+from . import descriptor_cache
+
+# cv2 and dlib are imported where they are used, so importing this module (and
+# every manage.py command that loads the URLconf) does not pay for them.
+
+# Model files for each choice of detector and landmark predictor.
+DETECTOR_MODELS = {
+    'hog': None,
+    'cnn': 'mmod_human_face_detector.dat',
+}
+LANDMARK_MODELS = {
+    68: 'shape_predictor_68_face_landmarks.dat',
+    5: 'shape_predictor_5_face_landmarks.dat',
+}
+RECOGNITION_MODEL = 'dlib_face_recognition_resnet_model_v1.dat'
+
+# Context kept around each face when it is cropped out for the descriptor stage,
+# as a fraction of the box size. The aligned chip dlib extracts (box plus 25%
+# padding) always fits inside it.
+CROP_MARGIN = 0.75
+
+# Size and padding of the aligned chip the ResNet model expects.
+CHIP_SIZE = 150
+CHIP_PADDING = 0.25
+
+
+def detection_frame(bgr_img, width):
+    """
+    The frame the detector runs on: the photo scaled down (INTER_AREA, i.e. one
+    pyramid level) to at most `width` pixels across, converted to RGB.
+    Returns the frame and the scale factor from photo to frame.
+    """
+    import cv2
+
+    height, photo_width = bgr_img.shape[:2]
+    scale = 1.0
+    if width and photo_width > width:
+        scale = width / photo_width
+        bgr_img = cv2.resize(bgr_img, (width, max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB), scale
+
+
+def appearance_hash(bgr_face):
+    """
+    64-bit average hash of a face region: whether each pixel of an 8x8
+    grayscale thumbnail is brighter than the thumbnail's mean. Cheap, and
+    stable across shots of the same face taken moments apart (changes in
+    exposure, and the few pixels the detector's box moves by).
+    """
+    import cv2
+
+    if not bgr_face.size:
+        return 0
+    gray = cv2.cvtColor(bgr_face, cv2.COLOR_BGR2GRAY)
+    thumbnail = cv2.resize(gray, (8, 8), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(thumbnail > thumbnail.mean()).tobytes(), 'big')
+
+
+class DetectedFace(NamedTuple):
+    """
+    One face found in a photo. `crop` is a copy of the region around the face
+    and `box` the face rectangle as (left, top, right, bottom) in crop
+    coordinates. `position` is the same rectangle as fractions of the photo's
+    width and height, and `signature` its appearance_hash.
+
+    Faces of photos seen before come from the descriptor cache: `source` is
+    their (cache key, index) there, and `descriptor` is set (with no crop or
+    box) once the face has been described.
+    """
+    crop: np.ndarray
+    box: tuple
+    position: tuple
+    signature: int
+    descriptor: np.ndarray = None
+    source: tuple = None
+
+
+def decode(img_bytes):
+    import cv2
+
+    with stage('decode'):
+        return cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+
+def face_at(bgr_img, rect):
+    """The DetectedFace of a photo at face rectangle (left, top, right, bottom), in photo pixels."""
+    import cv2
+
+    height, width = bgr_img.shape[:2]
+    left, top, right, bottom = rect
+    margin = int(max(right - left, bottom - top) * CROP_MARGIN)
+    x0 = max(left - margin, 0)
+    y0 = max(top - margin, 0)
+    x1 = min(right + margin + 1, width)
+    y1 = min(bottom + margin + 1, height)
+    # Only the crop is converted to RGB, never the full frame.
+    crop = cv2.cvtColor(bgr_img[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+    return DetectedFace(
+        crop,
+        (left - x0, top - y0, right - x0, bottom - y0),
+        (left / width, top / height, right / width, bottom / height),
+        appearance_hash(bgr_img[max(top, 0):bottom + 1, max(left, 0):right + 1]),
+    )
+
+
+class FacePipeline:
+    """
+    Detection, alignment and description of faces, with swappable parts:
+
+    - detector: 'hog' (dlib's frontal face detector) or 'cnn' (the MMOD CNN
+      detector; more robust to pose, much slower without CUDA).
+    - landmarks: 68 or 5. The 5-point predictor is a fraction of the size and
+      cost of the 68-point one and is all the aligner needs.
+    - batch_descriptors: align every face into a chip first and run the ResNet
+      model once over the whole batch instead of once per face.
+    """
+
+    def __init__(self, detector='hog', landmarks=68, batch_descriptors=True, model_dir=None):
+        import dlib
+
+        model_dir = model_dir or settings.BASE_DIR
+        if detector not in DETECTOR_MODELS:
+            raise ValueError(f"Unknown face detector '{detector}'")
+        if landmarks not in LANDMARK_MODELS:
+            raise ValueError(f"Unsupported landmark count {landmarks}")
+
+        self.detector_name = detector
+        self.landmarks = landmarks
+        self.batch_descriptors = batch_descriptors
+        if detector == 'cnn':
+            self.detector = dlib.cnn_face_detection_model_v1(os.path.join(model_dir, DETECTOR_MODELS['cnn']))
+        else:
+            self.detector = dlib.get_frontal_face_detector()
+        self.shape_predictor = dlib.shape_predictor(os.path.join(model_dir, LANDMARK_MODELS[landmarks]))
+        self.face_recognizer = dlib.face_recognition_model_v1(os.path.join(model_dir, RECOGNITION_MODEL))
+
+    @classmethod
+    def from_settings(cls):
+        return cls(**settings.FACE_PIPELINE)
+
+    def detect(self, img_bytes, endpoint='attendance'):
+        """
+        Decode a photo and detect its faces.
+
+        Detection runs on a downscaled copy, sized by settings.FACE_DETECTION for
+        the endpoint; the boxes are mapped back to the full-resolution photo and
+        landmarks/descriptors later run on full-resolution crops.
+
+        Returns one DetectedFace per face, in detection order. Crops are small
+        enough to ship to a worker process.
+        """
+        return self.detect_image(decode(img_bytes), endpoint)
+
+    def detect_image(self, bgr_img, endpoint='attendance'):
+        with stage('decode'):
+            frame, scale = detection_frame(bgr_img, settings.FACE_DETECTION[endpoint]['width'])
+        return self.detect_frame(bgr_img, frame, scale, endpoint)
+
+    def detect_frame(self, bgr_img, frame, scale, endpoint='attendance'):
+        """Faces of a decoded photo, given its detection_frame and scale."""
+        with stage('detect'):
+            detections = self.detector(frame, settings.FACE_DETECTION[endpoint]['upsample'])
+
+        faces = []
+        for detection in detections:
+            # The CNN detector wraps its rectangle in an mmod_rect.
+            face = getattr(detection, 'rect', detection)
+            faces.append(face_at(bgr_img, (
+                int(round(face.left() / scale)),
+                int(round(face.top() / scale)),
+                int(round(face.right() / scale)),
+                int(round(face.bottom() / scale)),
+            )))
+        return faces
+
+    def shape(self, crop, box):
+        import dlib
+
+        return self.shape_predictor(crop, dlib.rectangle(*box))
+
+    def describe(self, faces):
+        """128-d descriptors for a list of DetectedFaces, in order."""
+        import dlib
+
+        if not faces:
+            return []
+        with stage('landmarks'):
+            shapes = [self.shape(face.crop, face.box) for face in faces]
+        with stage('descriptors'):
+            if self.batch_descriptors:
+                chips = [
+                    dlib.get_face_chip(face.crop, shape, size=CHIP_SIZE, padding=CHIP_PADDING)
+                    for face, shape in zip(faces, shapes)
+                ]
+                return [np.array(descriptor) for descriptor in self.face_recognizer.compute_face_descriptor(chips)]
+            return [
+                np.array(self.face_recognizer.compute_face_descriptor(face.crop, shape))
+                for face, shape in zip(faces, shapes)
+            ]
+
+
+_pipeline = None
+_pipeline_error = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """
+    The process-wide FacePipeline, loading the models on first use. Safe to
+    call from several threads; returns None if the models could not be loaded.
+    """
+    global _pipeline, _pipeline_error
+    if _pipeline is None and _pipeline_error is None:
+        with _pipeline_lock:
+            if _pipeline is None and _pipeline_error is None:
+                try:
+                    _pipeline = FacePipeline.from_settings()
+                except Exception as e:
+                    print(f"Error loading face recognition models: {e}")
+                    _pipeline_error = e
+    return _pipeline
+
+
+def _service():
+    """Client of the out-of-process recognition service, when one is configured."""
+    from .recognition_service import get_client
+    return get_client()
+
+
+def models_loaded():
+    service = _service()
+    if service is not None:
+        try:
+            return service.call('ping')
+        except Exception:
+            return False
+    if _workers_own_models():
+        return run_job(_models_ready)
+    return get_pipeline() is not None
+
+
+def _models_ready():
+    return get_pipeline() is not None
+
+
+def cache_key(img_bytes, endpoint):
+    """Descriptor cache key of a photo: a hash of its bytes and of everything its faces depend on."""
+    config = json.dumps([
+        settings.FACE_PIPELINE, settings.FACE_DETECTION[endpoint], CROP_MARGIN, CHIP_SIZE, CHIP_PADDING,
+    ], sort_keys=True)
+    digest = hashlib.sha256(config.encode('utf-8'))
+    digest.update(img_bytes)
+    return digest.hexdigest()
+
+
+def detect_cached(img_bytes, endpoint, cache):
+    """
+    The faces of a photo, from the descriptor cache when it has been seen
+    before: faces described then come with their descriptor and are not
+    decoded or detected again; the photo is only decoded (never detected in)
+    to crop faces still to be described.
+    """
+    key = cache_key(img_bytes, endpoint)
+    entry = cache.get(key)
+    if entry is None:
+        cache.count('misses')
+        bgr_img = decode(img_bytes)
+        faces = get_pipeline().detect_image(bgr_img, endpoint)
+        cache.put(key, descriptor_cache.entry_of(bgr_img.shape[1::-1], faces))
+        return [face._replace(source=(key, i)) for i, face in enumerate(faces)]
+
+    missing = np.isnan(entry.descriptors).any(axis=1)
+    cache.count('partial_hits' if missing.any() else 'hits')
+    cache.count('descriptors_reused', int((~missing).sum()))
+    bgr_img = decode(img_bytes) if missing.any() else None
+    width, height = entry.size
+    faces = []
+    for i, (position, signature) in enumerate(zip(entry.positions, entry.signatures)):
+        if missing[i]:
+            left, top, right, bottom = position
+            face = face_at(bgr_img, (int(round(left * width)), int(round(top * height)),
+                                     int(round(right * width)), int(round(bottom * height))))
+        else:
+            face = DetectedFace(None, None, tuple(position), int(signature), entry.descriptors[i])
+        faces.append(face._replace(source=(key, i)))
+    return faces
+
+
+def _remember(faces, encodings):
+    """Store the descriptors of faces that came from the descriptor cache."""
+    cache = descriptor_cache.get_cache()
+    if cache is None:
+        return
+    by_key = {}
+    for face, encoding in zip(faces, encodings):
+        if face.source is not None:
+            key, index = face.source
+            by_key.setdefault(key, {})[index] = encoding
+    for key, descriptors in by_key.items():
+        cache.add_descriptors(key, descriptors)
+
+
+# Worker jobs return their stage timings and descriptor cache counts along with
+# the result, since a worker thread or process does not see the request it works
+# for, and counts made in a worker process would stay there. Whether to time
+# stages is decided by the process that submits the job: a worker process has
+# its own settings, without the overrides of the web process.
+
+def _job(func, timed, *args):
+    with capture(timed) as timings, descriptor_cache.capture() as counts:
+        value = func(*args)
+    return value, timings, counts
+
+
+def _detect(img_bytes, endpoint):
+    cache = descriptor_cache.get_cache()
+    if cache is None:
+        return get_pipeline().detect(img_bytes, endpoint)
+    return detect_cached(img_bytes, endpoint, cache)
+
+
+def _describe(faces):
+    encodings = get_pipeline().describe(faces)
+    _remember(faces, encodings)
+    return encodings
+
+
+def _merged(results):
+    """Results of worker jobs, adding their stage timings to the current request."""
+    values = []
+    for value, timings, counts in results:
+        merge(timings)
+        descriptor_cache.merge(counts)
+        values.append(value)
+    return values
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Set in worker processes, which run their jobs inline.
+_in_worker = False
+
+
+def _init_worker():
+    global _in_worker
+    _in_worker = True
+
+
+def _process_context():
+    # A web worker runs request (and Sheets outbox) threads, and forking it
+    # could copy a lock another thread holds, such as _pipeline_lock while it
+    # loads the models, and hang the child. Workers are started from a clean
+    # fork server instead and each loads the models on first use.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def get_executor(mp_context=None):
+    """
+    The shared worker pool, or None when the pipeline runs inline. A process
+    pool is started with `mp_context` if given, when it is created; the
+    recognition service forks its workers before starting any threads, so
+    they share the models it loaded.
+    """
+    global _executor
+    workers = settings.FACE_PIPELINE_MAX_WORKERS
+    if not workers or workers <= 1 or _in_worker:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            if settings.FACE_PIPELINE_EXECUTOR == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context or _process_context(),
+                                                initializer=_init_worker)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='face-pipeline')
+    return _executor
+
+
+def _workers_own_models():
+    """
+    Whether inference belongs to a pool of worker processes that load the
+    models themselves, so this process must not load them too. Not so in the
+    recognition service, whose workers were forked after it loaded them.
+    """
+    return isinstance(get_executor(), ProcessPoolExecutor) and _pipeline is None
+
+
+def _discard_executor(executor):
+    """Drop a broken pool so the next job starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _map(func, items):
+    """
+    Map `func` over `items` on the worker pool, keeping input order, and add
+    what the jobs timed and counted to the current request. A single item
+    runs inline unless only the workers have the models. A worker process
+    that died (killed when out of memory, say) breaks the whole pool; it is
+    replaced and the jobs are run once more.
+    """
+    job = partial(_job, func, enabled())
+    executor = get_executor()
+    if executor is None or len(items) <= 1 and not _workers_own_models():
+        return _merged(job(item) for item in items)
+    try:
+        return _merged(list(executor.map(job, items)))
+    except BrokenProcessPool as e:
+        print(f"Error in face pipeline worker pool, restarting it: {e}")
+        _discard_executor(executor)
+    return _merged(list(get_executor().map(job, items)))
+
+
+def _call(func):
+    return func()
+
+
+def run_job(func, *args):
+    """func(*args) as one job, on a worker when only the workers have the models (see _map)."""
+    return _map(_call, [partial(func, *args)])[0]
+
+
+def detect_photos(photos, endpoint='attendance'):
+    """Detect faces in every photo (a list of image bytes), in parallel."""
+    service = _service()
+    if service is not None:
+        return service.call('detect', photos=photos, endpoint=endpoint)
+    return _map(partial(_detect, endpoint=endpoint), photos)
+
+
+def describe_faces(faces):
+    """
+    Descriptors for a list of DetectedFaces, in order. Faces that came with
+    their descriptor from the cache are skipped; the rest are split into one
+    contiguous batch per worker.
+    """
+    encodings = [face.descriptor for face in faces]
+    todo = [i for i, encoding in enumerate(encodings) if encoding is None]
+    if not todo:
+        return encodings
+    pending = [faces[i] for i in todo]
+
+    service = _service()
+    if service is not None:
+        described = service.call('describe', faces=pending)
+    else:
+        workers = settings.FACE_PIPELINE_MAX_WORKERS or 1
+        size = max(1, -(-len(pending) // workers))
+        batches = [pending[i:i + size] for i in range(0, len(pending), size)]
+        described = [encoding for batch in _map(_describe, batches) for encoding in batch]
+    for i, encoding in zip(todo, described):
+        encodings[i] = encoding
+    return encodings
+
+
+def encode_photos(photos, endpoint='attendance'):
+    """
+    Run the whole pipeline over several photos: photos are decoded and
+    searched for faces in parallel, then every face of every photo is
+    described in parallel. Returns one list of encodings per photo, in upload
+    and detection order, so results do not depend on scheduling.
+    """
+    service = _service()
+    if service is not None:
+        return service.call('encode', photos=photos, endpoint=endpoint)
+    detected = detect_photos(photos, endpoint)
+    flat = [face for faces in detected for face in faces]
+    encodings = describe_faces(flat)
+
+    per_photo = []
+    offset = 0
+    for faces in detected:
+        per_photo.append(encodings[offset:offset + len(faces)])
+        offset += len(faces)
+    return per_photo
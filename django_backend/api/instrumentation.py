@@ -0,0 +1,204 @@
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from time import perf_counter
+from django.conf import settings
+
+# Upper bounds, in seconds, of the histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Counters exposed by the metrics endpoint, with their help text.
+COUNTERS = {
+    'photos': 'Photos run through face detection',
+    'faces': 'Faces detected in class photos, or followed through class videos',
+    'descriptors_skipped': 'Faces of class photos and video frames not described: seen earlier or the class was complete',
+    'photos_skipped': 'Class photos not processed because every student was already found',
+    'students_present': 'Students marked present',
+    'sheets_rows': 'Attendance rows written to Google Sheets',
+}
+
+_NOOP = nullcontext()
+
+# Stage timings of the current request or worker job, None outside of one.
+_current = ContextVar('instrumentation_timings', default=None)
+
+
+class Timings(dict):
+    """Seconds spent in each stage of one request or worker job."""
+
+    def add(self, name, seconds):
+        self[name] = self.get(name, 0.0) + seconds
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Histograms and counters of this process. Every worker process keeps its
+    own, so scrape each of them (or run a single worker) to see all requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.requests = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def observe_request(self, view, seconds, timings):
+        with self._lock:
+            self.requests.setdefault(view, Histogram()).observe(seconds)
+            for stage, stage_seconds in timings.items():
+                self.stages.setdefault(stage, Histogram()).observe(stage_seconds)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+            _render_histograms(lines, 'attendance_stage_seconds', 'stage', self.stages,
+                               'Time spent in each stage of a request, summed over its workers')
+            _render_histograms(lines, 'attendance_request_seconds', 'view', self.requests,
+                               'Time spent handling requests')
+            for name, value in self.counters.items():
+                lines.append(f'# HELP attendance_{name}_total {COUNTERS[name]}')
+                lines.append(f'# TYPE attendance_{name}_total counter')
+                lines.append(f'attendance_{name}_total {value}')
+            return '\n'.join(lines) + '\n'
+
+
+def _render_histograms(lines, metric, label, histograms, help_text):
+    lines.append(f'# HELP {metric} {help_text}')
+    lines.append(f'# TYPE {metric} histogram')
+    for value, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram.buckets):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{label}="{value}"}} {histogram.sum}')
+        lines.append(f'{metric}_count{{{label}="{value}"}} {histogram.count}')
+
+
+registry = Registry()
+
+
+def enabled():
+    return settings.METRICS_ENABLED
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        record(self.name, perf_counter() - self.start)
+
+
+def stage(name):
+    """
+    Context manager timing one stage of the current request, or of a worker
+    job its process asked to time. Otherwise, when metrics are disabled, it
+    is a shared no-op, so instrumented code pays one settings lookup.
+    """
+    if not settings.METRICS_ENABLED and _current.get() is None:
+        return _NOOP
+    return _Stage(name)
+
+
+def record(name, seconds):
+    """Add time to a stage of the current request, or observe it directly outside of one."""
+    timings = _current.get()
+    if timings is None:
+        registry.observe_stage(name, seconds)
+    else:
+        timings.add(name, seconds)
+
+
+def merge(timings):
+    """Add the stage timings captured by a worker job to the current request."""
+    if timings:
+        for name, seconds in timings.items():
+            record(name, seconds)
+
+
+def increment(name, amount=1):
+    if settings.METRICS_ENABLED:
+        registry.increment(name, amount)
+
+
+@contextmanager
+def capture(timed=None):
+    """
+    Collect the stages timed inside the block, for a job that runs in a worker
+    thread or process and hands them back to be merged. `timed` is whether the
+    submitting process has metrics enabled (this process's setting if None);
+    yields None when not.
+    """
+    if timed is None:
+        timed = settings.METRICS_ENABLED
+    if not timed:
+        yield None
+        return
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def server_timing(timings, total):
+    """Server-Timing header value, with durations in milliseconds."""
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    Times every request and its stages, adds a Server-Timing header to the
+    response and records the timings in the process's histograms.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        timings = Timings()
+        token = _current.set(timings)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = perf_counter() - start
+
+        match = request.resolver_match
+        registry.observe_request(match.url_name if match and match.url_name else 'unmatched', total, timings)
+        response.headers['Server-Timing'] = server_timing(timings, total)
+        return response
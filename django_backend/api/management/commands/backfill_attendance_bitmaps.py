@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.attendance_bitmap import backfill_bitmaps
+
+
+class Command(BaseCommand):
+    help = 'Store attendance bitmaps for sessions saved before they were introduced.'
+
+    def handle(self, *args, **options):
+        sessions = backfill_bitmaps()
+        self.stdout.write(self.style.SUCCESS(f'Packed {sessions} attendance sessions'))
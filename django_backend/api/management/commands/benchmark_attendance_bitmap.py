@@ -0,0 +1,118 @@
+import random
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from api.models import Student, AttendanceRecord, AttendanceDetail, ClassRoster
+from api.attendance_bitmap import pack_session, load_matrix
+
+SEMESTER = 'bench'
+SECTION = 'X'
+
+
+class Command(BaseCommand):
+    help = ('Compare per-student percentages and absence streaks computed from AttendanceDetail rows '
+            'with the same analytics over attendance bitmaps, on synthetic data that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=120)
+        parser.add_argument('--sessions', type=int, default=200, help='Sessions per subject')
+        parser.add_argument('--subjects', type=int, default=8)
+        parser.add_argument('--attendance', type=float, default=0.8, help='Chance a student is present')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per path; the best is reported')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            subjects = self._populate(options)
+            self._report(subjects, options['repeat'])
+            transaction.set_rollback(True)
+
+    def _populate(self, options):
+        rng = random.Random(options['seed'])
+        students = Student.objects.bulk_create([
+            Student(name=f'Bench {i}', usn=f'BENCH{i:05d}', semester=SEMESTER, section=SECTION)
+            for i in range(options['students'])
+        ])
+        ClassRoster.objects.bulk_create([
+            ClassRoster(semester=SEMESTER, section=SECTION, student=student, position=i)
+            for i, student in enumerate(students)
+        ])
+        positions = {student.id: i for i, student in enumerate(students)}
+
+        subjects = [f'S{i}' for i in range(options['subjects'])]
+        start = date(2000, 1, 1)
+        records = []
+        statuses = []
+        for subject in subjects:
+            for day in range(options['sessions']):
+                status = {student.id: rng.random() < options['attendance'] for student in students}
+                present_bits, marked_bits = pack_session(positions, status)
+                records.append(AttendanceRecord(semester=SEMESTER, section=SECTION, subject=subject,
+                                                present_bits=present_bits, marked_bits=marked_bits))
+                statuses.append((start + timedelta(days=day), status))
+        records = AttendanceRecord.objects.bulk_create(records, batch_size=500)
+        for record, (day, _) in zip(records, statuses):
+            record.date = day  # auto_now_add ignores the value given on create
+        AttendanceRecord.objects.bulk_update(records, ['date'], batch_size=500)
+        AttendanceDetail.objects.bulk_create([
+            AttendanceDetail(record=record, student_id=student_id, status=present)
+            for record, (_, status) in zip(records, statuses)
+            for student_id, present in status.items()
+        ], batch_size=2000)
+
+        self.stdout.write(f'{len(records)} sessions, {AttendanceDetail.objects.filter(record__in=records).count()} '
+                          f'detail rows, {sum(len(r.present_bits) + len(r.marked_bits) for r in records)} '
+                          f'bytes of bitmaps')
+        return subjects
+
+    def _rows(self, subject):
+        """Percentages and longest absence streaks from the detail rows."""
+        details = AttendanceDetail.objects.filter(
+            record__semester=SEMESTER, record__section=SECTION, record__subject=subject
+        )
+        percentages = {
+            row['student_id']: row['present'] * 100.0 / row['total']
+            for row in details.values('student_id').annotate(
+                total=Count('id'), present=Count('id', filter=Q(status=True))
+            )
+        }
+        run = {}
+        longest = {}
+        for student_id, status in details.order_by('record__date', 'record_id').values_list('student_id', 'status'):
+            run[student_id] = 0 if status else run.get(student_id, 0) + 1
+            longest[student_id] = max(longest.get(student_id, 0), run[student_id])
+        return percentages, longest
+
+    def _bitmaps(self, subject):
+        """The same analytics over the attendance matrix."""
+        matrix = load_matrix(SEMESTER, SECTION, subject)
+        percentages = matrix.percentages()
+        longest, _ = matrix.absence_streaks()
+        ids = [student_id for student_id, _, _ in matrix.students]
+        return dict(zip(ids, percentages.tolist())), dict(zip(ids, longest.tolist()))
+
+    def _time(self, func, subjects, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = [func(subject) for subject in subjects]
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, results
+
+    def _report(self, subjects, repeat):
+        rows_time, rows_results = self._time(self._rows, subjects, repeat)
+        bitmap_time, bitmap_results = self._time(self._bitmaps, subjects, repeat)
+
+        for (row_pct, row_streak), (bit_pct, bit_streak) in zip(rows_results, bitmap_results):
+            if row_streak != bit_streak or any(abs(row_pct[s] - bit_pct[s]) > 1e-9 for s in row_pct):
+                self.stderr.write(self.style.ERROR('The two paths disagree'))
+                break
+
+        self.stdout.write(f'Database: {connection.vendor}')
+        self.stdout.write(f'Detail rows: {rows_time * 1000:.1f} ms for {len(subjects)} subjects')
+        self.stdout.write(f'Bitmaps:     {bitmap_time * 1000:.1f} ms for {len(subjects)} subjects')
+        if bitmap_time:
+            self.stdout.write(self.style.SUCCESS(f'Speedup: {rows_time / bitmap_time:.1f}x'))
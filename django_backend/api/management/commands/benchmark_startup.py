@@ -0,0 +1,106 @@
+import json
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Code run in a fresh interpreter for each measurement. It prints one JSON line.
+PROBE = '''
+import json, os, resource, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+stage = {stage!r}
+if stage in ('urls', 'models'):
+    import api.urls
+if stage == 'models':
+    from api.face_pipeline import get_pipeline
+    get_pipeline()
+elapsed = time.perf_counter() - started
+heavy = [name for name in ('cv2', 'dlib', 'googleapiclient.discovery', 'reportlab.pdfgen') if name in sys.modules]
+print(json.dumps({{'ms': elapsed * 1000, 'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'heavy': heavy}}))
+'''
+
+# Forks `workers` processes that each make sure the models are loaded, like a
+# gunicorn master with or without --preload, and reports their memory.
+WORKERS_PROBE = '''
+import json, os, sys
+import django
+django.setup()
+from api.face_pipeline import get_pipeline
+if {preload!r}:
+    from api.preload import preload
+    preload()
+
+def memory():
+    usage = {{}}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, value = line.split(':', 1)
+            usage[key] = int(value.split()[0]) / 1024
+    return {{'rss_mb': usage['Rss'], 'pss_mb': usage['Pss'],
+            'private_mb': usage['Private_Clean'] + usage['Private_Dirty']}}
+
+readers = []
+for _ in range({workers}):
+    read_fd, write_fd = os.pipe()
+    if os.fork() == 0:
+        os.close(read_fd)
+        get_pipeline()
+        os.write(write_fd, json.dumps(memory()).encode())
+        os._exit(0)
+    os.close(write_fd)
+    readers.append(read_fd)
+results = []
+for fd in readers:
+    with os.fdopen(fd) as f:
+        results.append(json.loads(f.read()))
+    os.wait()
+print(json.dumps(results))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Measure interpreter startup: time and peak RSS to set up Django, load the URLconf and load the '
+            'face models, each in a fresh process; optionally the memory of forked workers with and without '
+            'preloading.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per stage; the fastest is reported')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Also fork this many workers with and without PRELOAD_MODELS (Linux only)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def _run(self, code):
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env=os.environ.copy(),
+                                capture_output=True, text=True, check=True)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        results = {'stages': {}}
+        for stage in ('settings', 'urls', 'models'):
+            runs = [self._run(PROBE.format(stage=stage)) for _ in range(options['repeat'])]
+            results['stages'][stage] = min(runs, key=lambda run: run['ms'])
+
+        if options['workers']:
+            if not os.path.exists('/proc/self/smaps_rollup'):
+                self.stderr.write('Worker memory needs /proc/self/smaps_rollup; skipping')
+            else:
+                results['workers'] = {
+                    mode: self._run(WORKERS_PROBE.format(preload=mode == 'preload', workers=options['workers']))
+                    for mode in ('lazy', 'preload')
+                }
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for stage, run in results['stages'].items():
+            self.stdout.write(f"{stage:<9} {run['ms']:8.0f} ms  {run['maxrss_mb']:7.1f} MB peak RSS  "
+                              f"heavy modules: {', '.join(run['heavy']) or 'none'}")
+        for mode, workers in results.get('workers', {}).items():
+            private = sum(worker['private_mb'] for worker in workers) / len(workers)
+            pss = sum(worker['pss_mb'] for worker in workers) / len(workers)
+            self.stdout.write(f"{len(workers)} workers ({mode}): {private:.1f} MB private, {pss:.1f} MB PSS per worker")
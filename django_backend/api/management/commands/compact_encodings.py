@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from api.encoding_store import encoding_store
+
+
+class Command(BaseCommand):
+    help = ('Reclaim rows left behind by re-enrolled students in the encoding store, '
+            'and convert it to ENCODING_STORE_DTYPE if it is stored in another format.')
+
+    def handle(self, *args, **options):
+        reclaimed = encoding_store.compact()
+        dtype = encoding_store.snapshot().matrix.dtype
+        self.stdout.write(self.style.SUCCESS(f'Reclaimed {reclaimed} rows; the store is in {dtype}'))
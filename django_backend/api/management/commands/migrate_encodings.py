@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.encoding_store import encoding_store
+
+
+class Command(BaseCommand):
+    help = 'Import student encodings from the legacy pickle file into the memory-mapped encoding store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pickle-file', default=settings.PICKLE_FILE,
+                            help='Legacy encodings.pkl stream to import (default: settings.PICKLE_FILE)')
+        parser.add_argument('--force', action='store_true',
+                            help='Overwrite an existing encoding store')
+
+    def handle(self, *args, **options):
+        if encoding_store.exists() and not options['force']:
+            raise CommandError('The encoding store already exists. Use --force to overwrite it.')
+
+        count = encoding_store.migrate_from_pickle(options['pickle_file'])
+        self.stdout.write(self.style.SUCCESS(f'Migrated {count} students to {encoding_store.directory}'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.statistics import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-student and per-class attendance summary tables from the saved attendance details.'
+
+    def handle(self, *args, **options):
+        rows = rebuild_summaries()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} attendance summaries'))
@@ -0,0 +1,231 @@
+import json
+import os
+import pickle
+import shutil
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from api import benchmarks
+from api.benchmarks import timed
+
+GROUPS = ('matching', 'loading', 'endpoints', 'statistics')
+
+# A photo from the repository that shows exactly one face.
+DEFAULT_FACE = os.path.join(os.path.dirname(settings.BASE_DIR), 'src', 'assets', 'cto.jpg')
+
+
+class Command(BaseCommand):
+    help = ('Benchmark matching, loading encodings, enrollment, attendance and statistics on synthetic data '
+            'at several class sizes, offline, and write the results as JSON. Run with '
+            '--settings=attendance_system.benchmark_settings.')
+
+    # The checks would import the views, and with them the real encoding store, before we are set up.
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', default='100,1000,10000,50000',
+                            help='Comma-separated numbers of enrolled students to benchmark with')
+        parser.add_argument('--encodings', type=int, default=3, help='Encodings per student')
+        parser.add_argument('--class-size', type=int, default=60, help='Students per section')
+        parser.add_argument('--faces', type=int, default=40, help='Faces in each fixture class photo')
+        parser.add_argument('--photos', type=int, default=2, help='Class photos per attendance request')
+        parser.add_argument('--video-seconds', type=float, default=8, help='Length of the fixture class video')
+        parser.add_argument('--sessions', type=int, default=500, help='Sessions of attendance history')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per measurement')
+        parser.add_argument('--face-photo', default=DEFAULT_FACE,
+                            help='Photo of a single face, tiled into the fixture class photos')
+        parser.add_argument('--only', default=','.join(GROUPS), help=f'Comma-separated groups: {", ".join(GROUPS)}')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='-', help='JSON file to write the results to (- for stdout)')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'BENCHMARK_MODE', False):
+            raise CommandError('Benchmarks replace the stored students. Run them with '
+                               '--settings=attendance_system.benchmark_settings.')
+        groups = [group.strip() for group in options['only'].split(',') if group.strip()]
+        unknown = set(groups) - set(GROUPS)
+        if unknown:
+            raise CommandError(f'Unknown groups: {", ".join(sorted(unknown))}')
+
+        call_command('migrate', verbosity=0)
+        from api import face_pipeline
+
+        results = {'environment': benchmarks.environment(), 'options': {
+            key: options[key] for key in ('students', 'encodings', 'class_size', 'faces', 'photos',
+                                          'video_seconds', 'sessions', 'repeat', 'seed', 'only')
+        }, 'sizes': {}}
+        try:
+            fixture = None
+            if 'endpoints' in groups:
+                if not face_pipeline.models_loaded():
+                    results['endpoints_skipped'] = 'face recognition models not loaded'
+                elif not os.path.exists(options['face_photo']):
+                    results['endpoints_skipped'] = f"face photo {options['face_photo']} not found"
+                else:
+                    fixture = self._fixture(options)
+                    results['fixture'] = fixture['info']
+
+            for size in [int(n) for n in options['students'].split(',')]:
+                self.stderr.write(f'{size} students...')
+                results['sizes'][str(size)] = self._size(size, groups, fixture, options)
+            if 'statistics' in groups:
+                self.stderr.write('Statistics...')
+                results['statistics'] = self._statistics(options)
+        finally:
+            benchmarks.reset_data()
+            if not os.environ.get('BENCHMARK_DIR'):
+                shutil.rmtree(settings.BENCHMARK_DIR, ignore_errors=True)
+
+        output = json.dumps(results, indent=2, default=str)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def _fixture(self, options):
+        """Enrollment photo and class photos with a known number of faces."""
+        from api.face_pipeline import detect_photos
+
+        with open(options['face_photo'], 'rb') as f:
+            face = f.read()
+        tile = benchmarks.face_tile(face)
+        photo = benchmarks.class_photo(tile, options['faces'])
+        video = benchmarks.class_video(tile, options['faces'], options['video_seconds'])
+        detected = len(detect_photos([photo])[0])
+        return {
+            'face': face,
+            'class_photo': photo,
+            'class_video': video,
+            'info': {'faces_per_photo': options['faces'], 'faces_detected_per_photo': detected,
+                     'class_photo_bytes': len(photo), 'class_video_bytes': len(video),
+                     'class_video_seconds': options['video_seconds']},
+        }
+
+    def _size(self, size, groups, fixture, options):
+        from api.views import is_same_person
+        from api.face_matching import stack_encodings, match_faces
+        from api.encoding_store import EncodingStore, read_pickle_students
+        from api.encoding_cache import encoding_cache
+
+        repeat = options['repeat']
+        benchmarks.reset_data()
+        students = benchmarks.synthetic_students(size, options['encodings'], options['class_size'], options['seed'])
+        faces = benchmarks.probe_faces(students, options['faces'], options['seed'] + 1)
+        result = {}
+
+        if 'matching' in groups:
+            matrix = stack_encodings(students)
+            known = [student['encodings'] for student in students]
+
+            def scan():
+                # The per-student loop that recognition used before batch matching
+                for face in faces[:4]:
+                    any(is_same_person(encodings, face) for encodings in known)
+
+            scan_timing = timed(scan, max(1, repeat // 2), warmup=0)
+            match_timing = timed(lambda: match_faces(faces, matrix), repeat)
+            result['matching'] = {
+                'is_same_person_scan': {**scan_timing, 'faces': 4,
+                                        'faces_per_second': 4000 / scan_timing['median_ms']},
+                'match_faces': {**match_timing, 'faces': len(faces),
+                                'faces_per_second': len(faces) * 1000 / match_timing['median_ms']},
+            }
+
+        benchmarks.load_students(students)
+
+        if 'loading' in groups:
+            pickle_path = os.path.join(settings.BENCHMARK_DIR, 'students.pkl')
+            with open(pickle_path, 'wb') as f:
+                for student in students:
+                    pickle.dump(student, f)
+
+            def cold_class_matrix():
+                encoding_cache.invalidate()
+                encoding_cache.class_matrix(benchmarks.SEMESTER, benchmarks.section_name(0))
+
+            result['loading'] = {
+                'legacy_pickle': timed(lambda: read_pickle_students(pickle_path), repeat),
+                'store_snapshot': timed(lambda: EncodingStore(settings.ENCODING_STORE_DIR).snapshot(), repeat),
+                'cold_class_matrix': timed(cold_class_matrix, repeat),
+                'duplicate_check': timed(
+                    lambda: encoding_cache.duplicate_index().find_duplicate(faces[:3], exclude_usn='nobody'), repeat
+                ),
+            }
+            os.unlink(pickle_path)
+
+        if 'endpoints' in groups and fixture is not None:
+            client = Client()
+            section = benchmarks.section_name(0)
+
+            def enroll():
+                # Re-enrolls the same student, so the store does not grow between runs
+                response = client.post('/api/enroll/', {
+                    'name': 'Benchmark Student', 'usn': 'BENCHMARK', 'semester': benchmarks.SEMESTER,
+                    'section': section, 'photos': [SimpleUploadedFile('face.jpg', fixture['face'])],
+                })
+                assert response.json()['success'], response.json()
+
+            def take_attendance():
+                response = client.post('/api/take-attendance/', {
+                    'subject': 'BENCH', 'semester': benchmarks.SEMESTER, 'section': section,
+                    'class_images': [SimpleUploadedFile(f'class{i}.jpg', fixture['class_photo'])
+                                     for i in range(options['photos'])],
+                })
+                assert response.json()['success'], response.json()
+
+            def take_video_attendance():
+                response = client.post('/api/take-attendance/video/', {
+                    'subject': 'BENCH', 'semester': benchmarks.SEMESTER, 'section': section,
+                    'video': SimpleUploadedFile('class.mp4', fixture['class_video']),
+                })
+                assert response.json()['success'], response.json()
+
+            result['endpoints'] = {
+                'enroll_student': timed(enroll, repeat),
+                'take_attendance': {**timed(take_attendance, repeat), 'photos': options['photos']},
+                'take_video_attendance': {**timed(take_video_attendance, repeat),
+                                          'seconds': options['video_seconds']},
+            }
+        return result
+
+    def _statistics(self, options):
+        from api.reports import generate_pdf, cached_report
+        from api.statistics import log_statistics
+        from api.models import AttendanceRecord
+
+        repeat = options['repeat']
+        benchmarks.reset_data()
+        students = benchmarks.synthetic_students(options['class_size'], 1, options['class_size'], options['seed'])
+        benchmarks.load_students(students)
+        section = benchmarks.section_name(0)
+        file_path, record_id = benchmarks.attendance_history(section, 'HIST', options['sessions'],
+                                                             seed=options['seed'])
+        dates = list(AttendanceRecord.objects.filter(subject='HIST').order_by('date').values_list('date', flat=True))
+        date_from, date_to = dates[len(dates) // 4].isoformat(), dates[3 * len(dates) // 4].isoformat()
+        client = Client()
+
+        def statistics(**dates):
+            response = client.post('/api/generate-statistics/', {'file_id': record_id, **dates})
+            assert response.json()['success'], response.json()
+
+        stats = log_statistics(file_path)
+        pdf_path = os.path.join(settings.BENCHMARK_DIR, 'report.pdf')
+        cached_report(benchmarks.SEMESTER, 'HIST', section, stats)
+        return {
+            'sessions': options['sessions'],
+            'students': options['class_size'],
+            'log_bytes': os.path.getsize(file_path),
+            'generate_statistics': timed(statistics, repeat),
+            'generate_statistics_date_range': timed(lambda: statistics(date_from=date_from, date_to=date_to),
+                                                    repeat),
+            'log_statistics': timed(lambda: log_statistics(file_path), repeat),
+            'log_statistics_date_range': timed(
+                lambda: log_statistics(file_path, dates[len(dates) // 4], dates[3 * len(dates) // 4]), repeat
+            ),
+            'generate_pdf': timed(lambda: generate_pdf(stats, pdf_path), repeat),
+            'cached_report_hit': timed(lambda: cached_report(benchmarks.SEMESTER, 'HIST', section, stats), repeat),
+        }
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.recognition_service import serve
+
+
+class Command(BaseCommand):
+    help = 'Run the face recognition service: a local worker pool that owns the models and serves web workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.RECOGNITION_SERVICE_SOCKET,
+                            help='Unix socket to listen on (default: settings.RECOGNITION_SERVICE_SOCKET)')
+        parser.add_argument('--workers', type=int, default=settings.FACE_PIPELINE_MAX_WORKERS,
+                            help='Worker processes running detection and descriptors')
+        parser.add_argument('--max-pending', type=int, default=settings.RECOGNITION_SERVICE_MAX_PENDING,
+                            help='Jobs handled at once; more wait for a slot')
+        parser.add_argument('--queue-wait', type=float, default=settings.RECOGNITION_SERVICE_QUEUE_WAIT,
+                            help='Seconds a job waits for a slot before it is refused as busy')
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError('No socket given. Pass --socket or set RECOGNITION_SERVICE_SOCKET.')
+
+        # The pool lives in this process, whatever the web workers are configured with.
+        settings.FACE_PIPELINE_MAX_WORKERS = options['workers']
+        settings.FACE_PIPELINE_EXECUTOR = 'process'
+
+        self.stdout.write(f"Recognition service on {options['socket']} with {options['workers']} workers")
+        try:
+            serve(options['socket'], options['max_pending'], options['queue_wait'])
+        except KeyboardInterrupt:
+            pass
+        except RuntimeError as e:
+            raise CommandError(str(e))
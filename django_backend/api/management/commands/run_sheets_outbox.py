@@ -0,0 +1,27 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api import sheets
+from api.sheets_outbox import flush_once
+
+
+class Command(BaseCommand):
+    help = 'Send queued attendance sessions to Google Sheets, retrying failures with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Flush what is due and exit')
+        parser.add_argument('--interval', type=float, default=settings.SHEETS_OUTBOX_POLL_SECONDS,
+                            help='Seconds to wait when nothing is due')
+
+    def handle(self, *args, **options):
+        if not sheets.sheets_configured():
+            raise CommandError('Google API not configured. Please check server configuration.')
+
+        while True:
+            sent = flush_once()
+            if sent:
+                self.stdout.write(f'Sent {sent} attendance sessions')
+            if options['once']:
+                break
+            if not sent:
+                time.sleep(options['interval'])
@@ -0,0 +1,75 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.duplicate_index import DuplicateIndex
+from api.encoding_store import encoding_store
+from api.face_matching import MATCH_THRESHOLD, EncodingMatrix, find_duplicate
+
+
+class Command(BaseCommand):
+    help = ('Replay stored students through the enrollment duplicate check, as if enrolled again under a new USN, '
+            'and report the recall of each DUPLICATE_INDEX_NPROBE against the exact find_duplicate scan.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+                            help='Caps on the lists probed per encoding to measure')
+        parser.add_argument('--sample', type=int, default=500,
+                            help='Stored students to replay, chosen at random (0 for all of them)')
+        parser.add_argument('--threshold', type=float, default=MATCH_THRESHOLD)
+        parser.add_argument('--min-recall', type=float, default=1.0,
+                            help='Share of the exact verdicts an nprobe must reproduce to be recommended')
+        parser.add_argument('--noise', type=float, default=0.015,
+                            help='Standard deviation of the noise added to each replayed encoding, so it stands '
+                                 'for a new photo of the student (0.015 moves it about 0.17 away)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        snapshot = encoding_store.snapshot()
+        students = snapshot.student_dicts(with_encodings=False)
+        if not students:
+            raise CommandError('The encoding store has no students')
+
+        # The reference is a plain scan of every live row, decoded to float32.
+        rows = np.concatenate([snapshot.encodings(entry) for entry in snapshot.students]).astype(np.float32)
+        owners = np.repeat(np.arange(len(students), dtype=np.intp), [entry['count'] for entry in snapshot.students])
+        reference = EncodingMatrix(students, rows, owners)
+
+        rng = np.random.default_rng(options['seed'])
+        replayed = np.arange(len(students))
+        if options['sample'] and options['sample'] < len(students):
+            replayed = np.sort(rng.choice(len(students), options['sample'], replace=False))
+        groups = []
+        for i in replayed:
+            encodings = snapshot.encodings(snapshot.students[i])
+            groups.append(encodings + rng.normal(0, options['noise'], encodings.shape))
+        expected = [find_duplicate(group, reference, threshold=options['threshold']) for group in groups]
+        found = sum(student is not None for student in expected)
+        self.stdout.write(f'{len(students)} students, {len(snapshot.matrix)} rows; replaying {len(groups)} students, '
+                          f'{found} of which the exact scan finds a match for')
+        if len(snapshot.matrix) < settings.DUPLICATE_INDEX_MIN_ROWS:
+            self.stdout.write(f'The store has fewer than DUPLICATE_INDEX_MIN_ROWS ({settings.DUPLICATE_INDEX_MIN_ROWS}) '
+                              f'rows and is always scanned; nprobe has no effect yet')
+
+        recommended = None
+        for nprobe in sorted(options['nprobe']):
+            recall = self._recall(snapshot, nprobe, groups, expected, options['threshold'])
+            self.stdout.write(f'nprobe {nprobe:>4}: recall {recall:.4f}')
+            if recommended is None and recall >= options['min_recall']:
+                recommended = nprobe
+
+        if recommended is None:
+            self.stdout.write(self.style.WARNING('No nprobe is within --min-recall; keep DUPLICATE_INDEX_NPROBE = None'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Smallest nprobe within --min-recall: '
+                                                 f'DUPLICATE_INDEX_NPROBE = {recommended}'))
+
+    @staticmethod
+    def _recall(snapshot, nprobe, groups, expected, threshold):
+        """Share of the verdicts that found a student where the index finds the same one."""
+        index = DuplicateIndex(nprobe=nprobe, min_rows=settings.DUPLICATE_INDEX_MIN_ROWS)
+        index.sync(snapshot)
+        actual = index.find_duplicates(groups, threshold=threshold)
+        positives = [(e, a) for e, a in zip(expected, actual) if e is not None]
+        if not positives:
+            return 1.0
+        return sum(a is not None and a['usn'] == e['usn'] for e, a in positives) / len(positives)
@@ -0,0 +1,94 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from api import encoding_formats
+from api.encoding_store import encoding_store
+from api.face_matching import MATCH_THRESHOLD, EncodingMatrix, face_distances, match_matrix
+from api.views import is_same_person
+
+# Stored encodings replayed against the whole store at a time.
+QUERY_CHUNK = 256
+
+# Pairs further apart than threshold + this (in float64) are rejected by every
+# format, so is_same_person is only asked about the others.
+REFERENCE_MARGIN = 0.05
+
+
+class Command(BaseCommand):
+    help = ('Replay the stored encodings against every enrolled student in each store format and report how many '
+            'decisions differ from is_same_person on float64 encodings, to pick the smallest safe '
+            'ENCODING_STORE_DTYPE.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=2000,
+                            help='Stored encodings to replay, chosen at random (0 for all of them)')
+        parser.add_argument('--threshold', type=float, default=MATCH_THRESHOLD)
+        parser.add_argument('--max-changes', type=int, default=0,
+                            help='Changed decisions a format may cause and still be recommended')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        snapshot = encoding_store.snapshot()
+        students = snapshot.student_dicts(with_encodings=False)
+        if not students:
+            raise CommandError('The encoding store has no students')
+
+        # The reference is the baseline's check, is_same_person, on the stored
+        # encodings widened to float64 (the format of the legacy pickle).
+        rows = np.concatenate([snapshot.encodings(entry) for entry in snapshot.students]).astype(np.float64)
+        owners = np.repeat(np.arange(len(students), dtype=np.intp), [entry['count'] for entry in snapshot.students])
+        reference = EncodingMatrix(students, rows, owners)
+
+        queries = rows
+        if options['sample'] and options['sample'] < len(rows):
+            rng = np.random.default_rng(options['seed'])
+            queries = rows[np.sort(rng.choice(len(rows), options['sample'], replace=False))]
+        stored_dtype = np.dtype(snapshot.matrix.dtype).name
+        self.stdout.write(f'{len(students)} students, {len(rows)} encodings stored as {stored_dtype}; '
+                          f'replaying {len(queries)} encodings at threshold {options["threshold"]}')
+
+        chunks = [queries[start:start + QUERY_CHUNK] for start in range(0, len(queries), QUERY_CHUNK)]
+        expected = [self._expected(chunk, reference, options['threshold']) for chunk in chunks]
+
+        recommended = None
+        for dtype in encoding_formats.FORMATS:
+            encoded, scale = encoding_formats.encode(rows, dtype)
+            result = self._replay(chunks, expected, reference, EncodingMatrix(students, encoded, owners, scale),
+                                  options['threshold'])
+            size = encoded.nbytes + (scale.nbytes if scale is not None else 0)
+            self.stdout.write(
+                f'{dtype:>8}: {size / 1024 / 1024:8.2f} MB, {result["changed"]} of {result["decisions"]} decisions '
+                f'changed ({result["gained"]} accepted, {result["lost"]} rejected), '
+                f'largest distance error {result["max_error"]:.4f}'
+            )
+            if result['changed'] <= options['max_changes']:
+                recommended = dtype
+
+        if recommended is None:
+            self.stdout.write(self.style.WARNING('No format is within --max-changes'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Smallest safe format: ENCODING_STORE_DTYPE = '{recommended}'"))
+
+    @staticmethod
+    def _expected(queries, reference, threshold):
+        """is_same_person of every query against every student, as a (queries, students) array."""
+        starts = np.concatenate([[0], np.cumsum(reference.counts)[:-1]])
+        nearest = np.minimum.reduceat(face_distances(queries, reference), starts, axis=1)
+        expected = np.zeros(nearest.shape, dtype=bool)
+        for face, student in zip(*np.nonzero(nearest < threshold + REFERENCE_MARGIN)):
+            known = list(reference.encodings[starts[student]:starts[student] + reference.counts[student]])
+            expected[face, student] = is_same_person(known, queries[face], threshold)
+        return expected
+
+    @staticmethod
+    def _replay(chunks, expected_chunks, reference, candidate, threshold):
+        """Decisions of every query against every student, compared between the reference and a format."""
+        result = {'decisions': 0, 'changed': 0, 'gained': 0, 'lost': 0, 'max_error': 0.0}
+        for chunk, expected in zip(chunks, expected_chunks):
+            actual = match_matrix(chunk, candidate, threshold)
+            result['decisions'] += expected.size
+            result['gained'] += int((actual & ~expected).sum())
+            result['lost'] += int((expected & ~actual).sum())
+            error = np.abs(face_distances(chunk, candidate) - face_distances(chunk, reference))
+            result['max_error'] = max(result['max_error'], float(error.max()) if error.size else 0.0)
+        result['changed'] = result['gained'] + result['lost']
+        return result
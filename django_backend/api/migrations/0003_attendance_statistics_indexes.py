@@ -0,0 +1,21 @@
+# Generated by Django 4.2.10 on 2026-10-17 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_sheets_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancedetail',
+            index=models.Index(fields=['record', 'status'], name='api_attenda_record__5c7f23_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(fields=['semester', 'section', 'subject', 'date'], name='api_attenda_semeste_275048_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.10 on 2026-10-17 18:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_attendance_statistics_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('semester', models.CharField(max_length=10)),
+                ('section', models.CharField(max_length=10)),
+                ('subject', models.CharField(max_length=100)),
+                ('sessions_total', models.PositiveIntegerField(default=0)),
+                ('sessions_present', models.PositiveIntegerField(default=0)),
+                ('percentage', models.FloatField(default=0)),
+                ('last_session_date', models.DateField(blank=True, null=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_summaries', to='api.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['semester', 'section', 'subject', 'percentage'], name='api_attenda_semeste_df485f_idx')],
+                'unique_together': {('student', 'semester', 'section', 'subject')},
+            },
+        ),
+    ]
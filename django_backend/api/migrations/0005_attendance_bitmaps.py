@@ -0,0 +1,37 @@
+# Generated by Django 4.2.10 on 2026-10-17 18:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_attendance_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancerecord',
+            name='marked_bits',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attendancerecord',
+            name='present_bits',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ClassRoster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('semester', models.CharField(max_length=10)),
+                ('section', models.CharField(max_length=10)),
+                ('position', models.PositiveIntegerField()),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='roster_entries', to='api.student')),
+            ],
+            options={
+                'unique_together': {('semester', 'section', 'student'), ('semester', 'section', 'position')},
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.models import Count, Max, Q
+
+
+def backfill_summaries(apps, schema_editor):
+    # Sessions saved before the summary table existed have no running totals yet.
+    AttendanceDetail = apps.get_model('api', 'AttendanceDetail')
+    AttendanceSummary = apps.get_model('api', 'AttendanceSummary')
+    rows = (
+        AttendanceDetail.objects
+        .values('student_id', 'record__semester', 'record__section', 'record__subject')
+        .annotate(
+            total=Count('id'),
+            present=Count('id', filter=Q(status=True)),
+            last_date=Max('record__date'),
+        )
+        .order_by()
+    )
+    AttendanceSummary.objects.all().delete()
+    AttendanceSummary.objects.bulk_create([
+        AttendanceSummary(
+            student_id=row['student_id'],
+            semester=row['record__semester'],
+            section=row['record__section'],
+            subject=row['record__subject'],
+            sessions_total=row['total'],
+            sessions_present=row['present'],
+            percentage=row['present'] * 100.0 / row['total'],
+            last_session_date=row['last_date'],
+        )
+        for row in rows.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_attendance_bitmaps'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.10 on 2026-10-17 19:23
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_class_sessions(apps, schema_editor):
+    # Like the text log, only sessions saved with their details count.
+    AttendanceRecord = apps.get_model('api', 'AttendanceRecord')
+    AttendanceClassSummary = apps.get_model('api', 'AttendanceClassSummary')
+    classes = (
+        AttendanceRecord.objects
+        .filter(details__isnull=False)
+        .values('semester', 'section', 'subject')
+        .annotate(sessions=Count('id', distinct=True))
+        .order_by()
+    )
+    AttendanceClassSummary.objects.bulk_create([AttendanceClassSummary(**row) for row in classes], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_backfill_attendance_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceClassSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('semester', models.CharField(max_length=10)),
+                ('section', models.CharField(max_length=10)),
+                ('subject', models.CharField(max_length=100)),
+                ('sessions', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='attendancesummary',
+            name='api_attenda_semeste_df485f_idx',
+        ),
+        migrations.RemoveField(
+            model_name='attendancesummary',
+            name='percentage',
+        ),
+        migrations.AddIndex(
+            model_name='attendancesummary',
+            index=models.Index(fields=['semester', 'section', 'subject'], name='api_attenda_semeste_809820_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='attendanceclasssummary',
+            unique_together={('semester', 'section', 'subject')},
+        ),
+        migrations.RunPython(backfill_class_sessions, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 class User(models.Model):
     username = models.CharField(max_length=50, unique=True)
@@ -23,10 +24,29 @@ class AttendanceRecord(models.Model):
     subject = models.CharField(max_length=100)
     sheet_id = models.CharField(max_length=255, blank=True, null=True)
     file_path = models.CharField(max_length=255, blank=True, null=True)
+    # Packed bitsets over the class roster (ClassRoster.position, least significant bit first)
+    present_bits = models.BinaryField(blank=True, null=True)
+    marked_bits = models.BinaryField(blank=True, null=True)  # students the session recorded at all
+    
+    class Meta:
+        indexes = [models.Index(fields=['semester', 'section', 'subject', 'date'])]
     
     def __str__(self):
         return f"{self.subject} - {self.date} - Sem {self.semester} Sec {self.section}"
 
+class ClassRoster(models.Model):
+    """Stable bit position of a student in the attendance bitmaps of their class."""
+    semester = models.CharField(max_length=10)
+    section = models.CharField(max_length=10)
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='roster_entries')
+    position = models.PositiveIntegerField()
+    
+    class Meta:
+        unique_together = [('semester', 'section', 'student'), ('semester', 'section', 'position')]
+    
+    def __str__(self):
+        return f"Sem {self.semester} Sec {self.section} #{self.position}: {self.student.usn}"
+
 class AttendanceDetail(models.Model):
     record = models.ForeignKey(AttendanceRecord, on_delete=models.CASCADE, related_name='details')
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
@@ -34,7 +54,71 @@ class AttendanceDetail(models.Model):
     
     class Meta:
         unique_together = ('record', 'student')
+        indexes = [models.Index(fields=['record', 'status'])]
     
     def __str__(self):
         status = "Present" if self.status else "Absent"
-        return f"{self.student.name} - {status}"
\ No newline at end of file
+        return f"{self.student.name} - {status}"
+
+class SheetsOutbox(models.Model):
+    """An attendance session waiting to be written to its Google Sheet."""
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    record = models.ForeignKey(AttendanceRecord, on_delete=models.CASCADE, related_name='sheet_writes')
+    semester = models.CharField(max_length=10)
+    section = models.CharField(max_length=10)
+    subject = models.CharField(max_length=100)
+    timestamp = models.CharField(max_length=32)
+    present = models.JSONField(default=list)  # "Name (USN)" strings
+    absent = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True, default='')
+    claimed_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} - {self.timestamp} - {self.status}"
+
+class AttendanceSummary(models.Model):
+    """Running attendance totals of a student in one class, kept up to date as sessions are saved."""
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='attendance_summaries')
+    semester = models.CharField(max_length=10)
+    section = models.CharField(max_length=10)
+    subject = models.CharField(max_length=100)
+    sessions_total = models.PositiveIntegerField(default=0)
+    sessions_present = models.PositiveIntegerField(default=0)
+    last_session_date = models.DateField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('student', 'semester', 'section', 'subject')
+        indexes = [models.Index(fields=['semester', 'section', 'subject'])]
+
+    def __str__(self):
+        return f"{self.student.name} - {self.subject} - {self.sessions_present}/{self.sessions_total}"
+
+class AttendanceClassSummary(models.Model):
+    """Running count of the sessions of one class, the denominator of its whole-term percentages."""
+    semester = models.CharField(max_length=10)
+    section = models.CharField(max_length=10)
+    subject = models.CharField(max_length=100)
+    sessions = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('semester', 'section', 'subject')
+
+    def __str__(self):
+        return f"{self.subject} - Sem {self.semester} Sec {self.section}: {self.sessions} sessions"
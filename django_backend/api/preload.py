@@ -0,0 +1,15 @@
+def preload():
+    """
+    Load what every worker would otherwise load on its first request: the
+    face models and the libraries behind them. Called from the WSGI module when
+    settings.PRELOAD_MODELS is set, so under `gunicorn --preload` it runs once
+    in the master and forked workers share the pages copy-on-write.
+
+    The Google API clients are left out on purpose: their HTTP connections
+    must not be shared between processes.
+    """
+    import cv2
+    import reportlab.pdfgen.canvas
+    from .face_pipeline import get_pipeline
+
+    return get_pipeline() is not None
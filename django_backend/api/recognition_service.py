@@ -0,0 +1,191 @@
+import multiprocessing
+import os
+import pickle
+import signal
+import socket
+import socketserver
+import struct
+import threading
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from .instrumentation import capture, merge, enabled
+
+# Every message is a 4-byte big-endian length followed by a pickle. Only local
+# processes that can open the socket file talk to the service.
+_HEADER = struct.Struct('>I')
+
+# Set in the service process (and inherited by its workers) so the face
+# pipeline runs locally there instead of calling itself.
+_serving = False
+
+
+class RecognitionServiceError(APIException):
+    status_code = 503
+    default_detail = 'Face recognition service unavailable. Please try again shortly.'
+    default_code = 'recognition_unavailable'
+
+
+class RecognitionServiceBusy(RecognitionServiceError):
+    default_detail = 'Face recognition service is busy. Please try again shortly.'
+    default_code = 'recognition_busy'
+
+
+def _send(sock, message):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError('Connection closed mid-message')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock):
+    (size,) = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+class RecognitionClient:
+    """Submits face pipeline jobs to the recognition service over its Unix socket."""
+
+    def __init__(self, socket_path, timeout):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def call(self, op, **args):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                _send(sock, {'op': op, 'args': args, 'timed': enabled()})
+                reply = _recv(sock)
+        except socket.timeout:
+            raise RecognitionServiceError('Face recognition timed out. Please try again.')
+        except (OSError, ConnectionError, pickle.UnpicklingError) as e:
+            print(f"Error contacting recognition service: {e}")
+            raise RecognitionServiceError()
+        merge(reply.get('timings'))
+        if not reply['ok']:
+            if reply.get('busy'):
+                raise RecognitionServiceBusy()
+            raise RecognitionServiceError(f"Face recognition failed: {reply['error']}")
+        return reply['result']
+
+
+def get_client():
+    """A client for the configured recognition service, or None to run the pipeline in-process."""
+    if _serving or not settings.RECOGNITION_SERVICE_SOCKET:
+        return None
+    return RecognitionClient(settings.RECOGNITION_SERVICE_SOCKET, settings.RECOGNITION_SERVICE_TIMEOUT)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        try:
+            request = _recv(self.request)
+        except (ConnectionError, struct.error, pickle.UnpicklingError):
+            return
+
+        # Backpressure: a job waits a little for a slot, then is turned away.
+        if not server.slots.acquire(timeout=server.queue_wait):
+            server.rejected += 1
+            _send(self.request, {'ok': False, 'busy': True, 'error': 'busy'})
+            return
+        try:
+            # Stage timings go back to the web worker, which adds them to its request.
+            with capture(request.get('timed')) as timings:
+                result = server.dispatch(request['op'], request.get('args', {}))
+            reply = {'ok': True, 'result': result, 'timings': timings}
+            server.completed += 1
+        except Exception as e:
+            print(f"Error in recognition job: {e}")
+            server.failed += 1
+            reply = {'ok': False, 'error': str(e)}
+        finally:
+            server.slots.release()
+        try:
+            _send(self.request, reply)
+        except OSError:
+            pass  # The client gave up (timed out) meanwhile
+
+
+class RecognitionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Owns the face models and the worker pool, and runs detection and
+    description jobs for web processes. At most `max_pending` jobs run at
+    once; others wait up to `queue_wait` seconds and are then refused as busy.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, max_pending, queue_wait):
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.queue_wait = queue_wait
+        self.completed = self.failed = self.rejected = 0
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # Left behind by a previous run
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def dispatch(self, op, args):
+        from . import face_pipeline
+
+        if op == 'ping':
+            return face_pipeline.models_loaded()
+        if op == 'detect':
+            return face_pipeline.detect_photos(args['photos'], args['endpoint'])
+        if op == 'describe':
+            return face_pipeline.describe_faces(args['faces'])
+        if op == 'encode':
+            return face_pipeline.encode_photos(args['photos'], args['endpoint'])
+        if op == 'video':
+            from .video_attendance import VideoError, track_video
+            try:
+                return track_video(args['video'], args['matrix'])
+            except VideoError as e:
+                # A fault of the upload, not of the service: match_video raises it again.
+                return e
+        if op == 'stats':
+            from .descriptor_cache import stats
+            return {'completed': self.completed, 'failed': self.failed, 'rejected': self.rejected,
+                    'descriptor_cache': stats()}
+        raise ValueError(f"Unknown operation '{op}'")
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def serve(socket_path, max_pending, queue_wait):
+    """Load the models, start the worker pool and serve jobs until interrupted."""
+    global _serving
+    _serving = True
+    from .preload import preload
+    from .face_pipeline import get_executor
+
+    if not preload():
+        raise RuntimeError('Face recognition models could not be loaded')
+    # Fork the workers now, after the models are loaded (so they share them) and
+    # before the server starts any threads.
+    executor = get_executor(multiprocessing.get_context('fork'))
+    if executor is not None:
+        list(executor.map(abs, range(settings.FACE_PIPELINE_MAX_WORKERS * 2)))
+    server = RecognitionServer(socket_path, max_pending, queue_wait)
+    # Stop as on Ctrl+C when the process manager asks, so the socket and workers are cleaned up.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from django.conf import settings
+
+# Bump whenever generate_pdf draws differently, so cached reports are not reused.
+PDF_LAYOUT_VERSION = 1
+
+_evict_lock = threading.Lock()
+
+
+def generate_pdf(stats, output_file):
+    """Generate PDF report with attendance statistics."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(output_file, pagesize=letter)
+    width, height = letter
+
+    # Title
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(220, height - 40, "Attendance Statistics")
+
+    # Column Headers
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(50, height - 80, "Above 75% Attendance")
+    c.drawString(350, height - 80, "Below 75% Attendance")
+
+    # Draw the lists of students
+    c.setFont("Helvetica", 10)
+
+    above_75 = [(student, percentage) for student, percentage in stats.items() if percentage >= 75]
+    below_75 = [(student, percentage) for student, percentage in stats.items() if percentage < 75]
+
+    y_position_above = height - 100
+    y_position_below = height - 100
+
+    # Printing Above 75% Attendance
+    for student, percentage in above_75:
+        c.drawString(50, y_position_above, f"{student}: {percentage:.2f}%")
+        y_position_above -= 15
+        if y_position_above < 50:
+            c.showPage()
+            c.setFont("Helvetica", 10)
+            y_position_above = height - 50
+
+    # Printing Below 75% Attendance
+    for student, percentage in below_75:
+        c.drawString(350, y_position_below, f"{student}: {percentage:.2f}%")
+        y_position_below -= 15
+        if y_position_below < 50:
+            c.showPage()
+            c.setFont("Helvetica", 10)
+            y_position_below = height - 50
+
+    c.save()
+
+
+def report_key(semester, subject, section, stats):
+    """Hash of everything a report depends on: the layout version, the class and its statistics, in order."""
+    payload = json.dumps([PDF_LAYOUT_VERSION, semester, subject, section, list(stats.items())])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cache_dir():
+    return os.path.join(settings.MEDIA_ROOT, settings.REPORT_CACHE_DIR)
+
+
+def cached_report(semester, subject, section, stats):
+    """
+    The report for these statistics, as a path relative to MEDIA_ROOT. An
+    existing report with the same key is reused; otherwise it is generated into
+    a temporary file and renamed into place, so concurrent requests never see
+    (or overwrite) a half-written PDF.
+    """
+    key = report_key(semester, subject, section, stats)
+    filename = f"attendance_report_{semester}_{subject}_{section}_{key[:24]}.pdf"
+    directory = cache_dir()
+    path = os.path.join(directory, filename)
+
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # Mark as recently used for eviction
+        except OSError:
+            pass  # Evicted meanwhile; regenerate below
+        else:
+            return f"{settings.REPORT_CACHE_DIR}/{filename}"
+
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        generate_pdf(stats, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    evict_reports(keep=path)
+    return f"{settings.REPORT_CACHE_DIR}/{filename}"
+
+
+def evict_reports(keep=None):
+    """
+    Delete the least recently used reports until the cache is within
+    REPORT_CACHE_MAX_FILES and REPORT_CACHE_MAX_BYTES. Returns the number deleted.
+    """
+    with _evict_lock:
+        reports = []
+        with os.scandir(cache_dir()) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.pdf'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                reports.append((stat.st_mtime, stat.st_size, entry.path))
+        reports.sort()
+
+        count = len(reports)
+        size = sum(report_size for _, report_size, _ in reports)
+        deleted = 0
+        for _, report_size, path in reports:
+            if count <= settings.REPORT_CACHE_MAX_FILES and size <= settings.REPORT_CACHE_MAX_BYTES:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            count -= 1
+            size -= report_size
+            deleted += 1
+        return deleted
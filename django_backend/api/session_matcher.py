@@ -0,0 +1,183 @@
+import threading
+import numpy as np
+from django.conf import settings
+from .face_matching import EncodingMatrix, match_faces
+from .face_pipeline import detect_photos, describe_faces
+from .instrumentation import stage, increment
+
+# A face repeats one from an earlier photo when its box overlaps that face's
+# box by at least this much (intersection over union, in photo-relative
+# coordinates) and their appearance hashes differ in at most this many of 64
+# bits. Faces are only reused when at least REUSE_MIN_AGREEMENT of a photo's
+# faces repeat faces of the same earlier photo, i.e. the two are shots of the
+# same scene; a photo panned by a seat puts other students in the same boxes.
+REUSE_MIN_OVERLAP = 0.6
+REUSE_MAX_HASH_DISTANCE = 14
+REUSE_MIN_AGREEMENT = 0.5
+
+COUNTERS = (
+    'sessions',
+    'photos',
+    'photos_skipped',        # never processed: the class was complete
+    'faces',
+    'faces_reused',          # identity taken from the same face in an earlier photo
+    'faces_skipped',         # detected after the class was complete
+    'faces_described',
+    'comparisons_skipped',   # face x stored encoding distances saved by dropping found students
+)
+
+_totals = dict.fromkeys(COUNTERS, 0)
+_totals_lock = threading.Lock()
+
+
+def stats():
+    """Work done and skipped by every session matched in this process."""
+    with _totals_lock:
+        return dict(_totals)
+
+
+def box_overlap(a, b):
+    """Intersection over union of two (left, top, right, bottom) boxes."""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class SessionMatcher:
+    """
+    Matches the photos of one attendance session against a class, photo by
+    photo, doing as little work as the photos allow:
+
+    - students already found are dropped from the candidates later faces are
+      compared with;
+    - a face in the same place and with nearly the same appearance hash as a
+      face handled in an earlier photo takes that face's result, without a
+      descriptor being computed;
+    - once every student is present, remaining photos are not processed.
+
+    Each face gets the same student as matching it against the whole class
+    would give (the first it matches, in roster order).
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.remaining = np.ones(len(matrix), dtype=bool)
+        # Per photo processed, (position, signature, student index or -1) of each face
+        self.photos = []
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def complete(self):
+        return not self.remaining.any()
+
+    def present_students(self):
+        """Students found so far, in roster order."""
+        return [self.matrix.students[i] for i in np.flatnonzero(~self.remaining)]
+
+    @staticmethod
+    def _repeats(face, earlier):
+        """The result of the face in an earlier photo that `face` repeats, or None."""
+        for position, signature, index in earlier:
+            if (box_overlap(face.position, position) >= REUSE_MIN_OVERLAP
+                    and bin(face.signature ^ signature).count('1') <= REUSE_MAX_HASH_DISTANCE):
+                return index
+        return None
+
+    def _reusable(self, faces):
+        """
+        Earlier results for the faces of a photo (None where the face must be
+        described), from the earlier shot of the same scene that explains
+        most of its faces. Only identified faces are reused: a face that
+        matched nobody is described again, as this photo may show it better.
+        """
+        best, best_agreeing = [None] * len(faces), 0
+        for earlier in self.photos:
+            results = [self._repeats(face, earlier) for face in faces]
+            agreeing = sum(result is not None for result in results)
+            if agreeing >= REUSE_MIN_AGREEMENT * len(faces) and agreeing > best_agreeing:
+                best, best_agreeing = results, agreeing
+        return [result if result is not None and result >= 0 else None for result in best]
+
+    def _candidates(self):
+        """EncodingMatrix of the students not found yet, and their indices in the class."""
+        keep = np.flatnonzero(self.remaining)
+        rows = np.flatnonzero(self.remaining[self.matrix.owners])
+        position = np.full(len(self.matrix), -1, dtype=np.intp)
+        position[keep] = np.arange(len(keep))
+        candidates = EncodingMatrix(
+            [self.matrix.students[i] for i in keep],
+            self.matrix.encodings[rows],
+            position[self.matrix.owners[rows]],
+            self.matrix.scale,
+        )
+        return candidates, keep
+
+    def add_photo(self, faces):
+        """Match the detected faces of one photo."""
+        self.counters['photos'] += 1
+        self.counters['faces'] += len(faces)
+        if self.complete():
+            self.counters['faces_skipped'] += len(faces)
+            return
+        results = self._reusable(faces)
+        new = [i for i, result in enumerate(results) if result is None]
+        self.counters['faces_reused'] += len(faces) - len(new)
+
+        if new:
+            encodings = describe_faces([faces[i] for i in new])
+            for i, result in zip(new, self.match_encodings(encodings)):
+                results[i] = result
+        self.photos.append([(face.position, face.signature, result) for face, result in zip(faces, results)])
+
+    def match_encodings(self, encodings):
+        """
+        Match newly described faces against the students not found yet.
+        Returns the student index of each face (-1 for none) and marks them present.
+        """
+        self.counters['faces_described'] += len(encodings)
+        if not encodings:
+            return []
+        results = []
+        with stage('matching'):
+            candidates, _ = self._candidates()
+            self.counters['comparisons_skipped'] += (
+                len(encodings) * (len(self.matrix.encodings) - len(candidates.encodings))
+            )
+            for encoding, candidate in zip(encodings, match_faces(encodings, candidates)):
+                result = -1
+                if candidate >= 0:
+                    # The face may match a student found earlier who comes first in the
+                    # roster; one face against the whole class settles it.
+                    result = int(match_faces([encoding], self.matrix)[0])
+                    self.remaining[result] = False
+                results.append(result)
+        return results
+
+    def finish(self, skipped_photos):
+        self.counters['sessions'] = 1
+        self.counters['photos_skipped'] = skipped_photos
+        with _totals_lock:
+            for name, value in self.counters.items():
+                _totals[name] += value
+        increment('photos_skipped', skipped_photos)
+        increment('descriptors_skipped', self.counters['faces_reused'] + self.counters['faces_skipped'])
+
+
+def match_session(photos, matrix, endpoint='attendance'):
+    """
+    Match the photos (image bytes) of one attendance session against a class
+    EncodingMatrix. Photos are detected a worker pool's worth at a time, so
+    detection stops too once the class is complete. Returns the SessionMatcher.
+    """
+    matcher = SessionMatcher(matrix)
+    batch = max(1, settings.FACE_PIPELINE_MAX_WORKERS or 1)
+    processed = 0
+    while processed < len(photos) and not matcher.complete():
+        for faces in detect_photos(photos[processed:processed + batch], endpoint):
+            matcher.add_photo(faces)
+        processed += len(photos[processed:processed + batch])
+    matcher.finish(len(photos) - processed)
+    return matcher
@@ -0,0 +1,161 @@
+import os
+import threading
+from django.conf import settings
+from googleapiclient.errors import HttpError
+
+# Google Sheets API setup
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+_services = None
+_services_lock = threading.Lock()
+
+
+def get_services():
+    """
+    The (sheets, drive) API clients, built on first use so that importing this
+    module stays cheap. Both are None if the API could not be set up.
+    """
+    global _services
+    if _services is None:
+        with _services_lock:
+            if _services is None:
+                try:
+                    if settings.GOOGLE_SHEETS_BACKEND == 'fake':
+                        from .sheets_fake import FakeGoogleService
+                        sheets = drive = FakeGoogleService()
+                    else:
+                        from googleapiclient.discovery import build
+                        from google.oauth2.service_account import Credentials
+                        creds = Credentials.from_service_account_file(settings.GOOGLE_CREDENTIALS_FILE, scopes=SCOPES)
+                        sheets = build('sheets', 'v4', credentials=creds)
+                        drive = build('drive', 'v3', credentials=creds)
+                except Exception as e:
+                    print(f"Error setting up Google API: {e}")
+                    sheets = drive = None
+                _services = (sheets, drive)
+    return _services
+
+
+def sheets_service():
+    return get_services()[0]
+
+
+def drive_service():
+    return get_services()[1]
+
+
+# Numeric tab ids of each known spreadsheet, {sheet_id: {'Present': gid, 'Absent': gid}}
+_tab_ids = {}
+
+
+def sheets_configured():
+    return None not in get_services()
+
+
+def sheet_id_file(subject, section, semester):
+    return os.path.join(settings.STUDENT_DATA_PATH, f'{subject}_{section}_{semester}_sheet_id.txt')
+
+
+def known_sheet_id(subject, section, semester):
+    """The sheet ID saved for this class, without asking Google whether it still exists."""
+    path = sheet_id_file(subject, section, semester)
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            return file.read().strip() or None
+    return None
+
+
+def get_google_sheet_id(subject, section, semester):
+    """Retrieve the Google Sheet ID for the given semester, subject, and section."""
+    sheet_id = known_sheet_id(subject, section, semester)
+    if sheet_id:
+        # Verify if the sheet exists by making a request to read the sheet's metadata
+        try:
+            sheet_tab_ids(sheet_id, refresh=True)
+            return sheet_id  # Sheet exists, return the ID
+        except HttpError as e:
+            if e.resp.status == 404:
+                print(f"Sheet with ID {sheet_id} not found. Creating a new sheet...")
+                return create_google_sheet(subject, section, semester)
+            else:
+                raise  # Reraise the exception for other HTTP errors
+    else:
+        print("Sheet ID file not found. Creating a new sheet...")
+        return create_google_sheet(subject, section, semester)
+
+
+def create_google_sheet(subject, section, semester):
+    """Create a new Google Sheet and save its ID."""
+    try:
+        spreadsheet = {
+            'properties': {'title': f'Attendance_{semester}_{subject}_{section}'},
+            'sheets': [
+                {'properties': {'title': 'Present'}},
+                {'properties': {'title': 'Absent'}}
+            ]
+        }
+        # Create the sheet
+        sheet = sheets_service().spreadsheets().create(body=spreadsheet).execute()
+        sheet_id = sheet['spreadsheetId']
+        _tab_ids[sheet_id] = {s['properties']['title']: s['properties']['sheetId'] for s in sheet['sheets']}
+
+        # Save the sheet ID to a file for future use
+        with open(sheet_id_file(subject, section, semester), 'w') as file:
+            file.write(sheet_id)
+
+        # Make the sheet viewable by anyone with the link (view only)
+        drive_service().permissions().create(
+            fileId=sheet_id,
+            body={'type': 'anyone', 'role': 'reader'}
+        ).execute()
+
+        return sheet_id
+    except HttpError as err:
+        print(f"Error creating or sharing the sheet: {err}")
+        return None
+
+
+def sheet_tab_ids(sheet_id, refresh=False):
+    """Numeric ids of the Present and Absent tabs, needed by batchUpdate."""
+    if refresh or sheet_id not in _tab_ids:
+        meta = sheets_service().spreadsheets().get(
+            spreadsheetId=sheet_id,
+            fields='sheets.properties(sheetId,title)'
+        ).execute()
+        _tab_ids[sheet_id] = {s['properties']['title']: s['properties']['sheetId'] for s in meta['sheets']}
+    return _tab_ids[sheet_id]
+
+
+def cached_tab_ids(sheet_id):
+    """Tab ids seen for this sheet in this process, or None if it has not been checked yet."""
+    return _tab_ids.get(sheet_id)
+
+
+def forget_sheet(sheet_id):
+    _tab_ids.pop(sheet_id, None)
+
+
+def _row(values):
+    return {'values': [{'userEnteredValue': {'stringValue': str(value)}} for value in values]}
+
+
+def append_attendance_rows(sheet_id, sessions):
+    """
+    Append several attendance sessions to a sheet in a single batchUpdate.
+    `sessions` is a list of (timestamp, present, absent) with present/absent
+    given as lists of "Name (USN)" strings.
+    """
+    tabs = sheet_tab_ids(sheet_id)
+    requests = [
+        {'appendCells': {
+            'sheetId': tabs['Present'],
+            'rows': [_row([timestamp] + present) for timestamp, present, _ in sessions],
+            'fields': 'userEnteredValue',
+        }},
+        {'appendCells': {
+            'sheetId': tabs['Absent'],
+            'rows': [_row([timestamp] + absent) for timestamp, _, absent in sessions],
+            'fields': 'userEnteredValue',
+        }},
+    ]
+    sheets_service().spreadsheets().batchUpdate(spreadsheetId=sheet_id, body={'requests': requests}).execute()
@@ -0,0 +1,143 @@
+import itertools
+import threading
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def http_error(status, reason=''):
+    """An HttpError shaped like the ones googleapiclient raises."""
+    resp = httplib2.Response({'status': status})
+    resp.reason = reason
+    return HttpError(resp, b'')
+
+
+class _Call:
+    """Mimics a googleapiclient request: nothing happens until execute()."""
+
+    def __init__(self, service, func, *args):
+        self.service = service
+        self.func = func
+        self.args = args
+
+    def execute(self):
+        return self.service._execute(self.func, *self.args)
+
+
+class FakeGoogleService:
+    """
+    In-memory stand-in for both the Sheets v4 and Drive v3 clients, covering
+    the calls this app makes. Used when settings.GOOGLE_SHEETS_BACKEND is
+    'fake', so attendance and the Sheets outbox can run without network
+    access.
+
+    `fail_next(count, status)` makes the next `count` requests raise an
+    HttpError, to exercise retries. `calls` records every executed request
+    by name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.spreadsheets_data = {}
+        self.permissions_data = []
+        self.calls = []
+        self._failures = []
+
+    def fail_next(self, count=1, status=429):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def _execute(self, func, *args):
+        with self._lock:
+            self.calls.append(func.__name__.lstrip('_'))
+            if self._failures:
+                raise http_error(self._failures.pop(0), 'Injected failure')
+            return func(*args)
+
+    # Sheets API
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+    def _create(self, body):
+        spreadsheet_id = f'fake-sheet-{next(self._ids)}'
+        tabs = {}
+        for gid, sheet in enumerate(body.get('sheets', [])):
+            tabs[sheet['properties']['title']] = {'sheetId': gid, 'rows': []}
+        self.spreadsheets_data[spreadsheet_id] = {'title': body['properties']['title'], 'tabs': tabs}
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'sheets': [{'properties': {'sheetId': t['sheetId'], 'title': title}} for title, t in tabs.items()],
+        }
+
+    def _sheet(self, spreadsheet_id):
+        if spreadsheet_id not in self.spreadsheets_data:
+            raise http_error(404, 'Requested entity was not found.')
+        return self.spreadsheets_data[spreadsheet_id]
+
+    def _get(self, spreadsheet_id):
+        tabs = self._sheet(spreadsheet_id)['tabs']
+        return {'sheets': [{'properties': {'sheetId': t['sheetId'], 'title': title}} for title, t in tabs.items()]}
+
+    def _batch_update(self, spreadsheet_id, body):
+        tabs = self._sheet(spreadsheet_id)['tabs']
+        by_gid = {t['sheetId']: t for t in tabs.values()}
+        for request in body['requests']:
+            append = request['appendCells']
+            for row in append['rows']:
+                by_gid[append['sheetId']]['rows'].append(
+                    [cell['userEnteredValue']['stringValue'] for cell in row['values']]
+                )
+        return {'spreadsheetId': spreadsheet_id, 'replies': [{} for _ in body['requests']]}
+
+    def _append(self, spreadsheet_id, range_, body):
+        tab = self._sheet(spreadsheet_id)['tabs'][range_.split('!')[0]]
+        tab['rows'].extend([[str(v) for v in row] for row in body['values']])
+        return {'spreadsheetId': spreadsheet_id}
+
+    def rows(self, spreadsheet_id, tab):
+        """Rows written to a tab, for assertions."""
+        return self.spreadsheets_data[spreadsheet_id]['tabs'][tab]['rows']
+
+    # Drive API
+
+    def permissions(self):
+        return _Permissions(self)
+
+    def _create_permission(self, file_id, body):
+        self._sheet(file_id)
+        self.permissions_data.append((file_id, body))
+        return {'id': str(len(self.permissions_data))}
+
+
+class _Spreadsheets:
+    def __init__(self, service):
+        self.service = service
+
+    def create(self, body):
+        return _Call(self.service, self.service._create, body)
+
+    def get(self, spreadsheetId, fields=None):
+        return _Call(self.service, self.service._get, spreadsheetId)
+
+    def batchUpdate(self, spreadsheetId, body):
+        return _Call(self.service, self.service._batch_update, spreadsheetId, body)
+
+    def values(self):
+        return _Values(self.service)
+
+
+class _Values:
+    def __init__(self, service):
+        self.service = service
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        return _Call(self.service, self.service._append, spreadsheetId, range, body)
+
+
+class _Permissions:
+    def __init__(self, service):
+        self.service = service
+
+    def create(self, fileId, body):
+        return _Call(self.service, self.service._create_permission, fileId, body)
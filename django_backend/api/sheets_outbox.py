@@ -0,0 +1,173 @@
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+from .models import AttendanceRecord, SheetsOutbox
+from . import sheets
+from .instrumentation import stage, increment
+
+
+def enqueue_attendance(record, timestamp, present_students, absent_students):
+    """
+    Queue an attendance session for its Google Sheet. Call inside the
+    transaction that saves the record; the worker is woken once it commits.
+    """
+    entry = SheetsOutbox.objects.create(
+        record=record,
+        semester=record.semester,
+        section=record.section,
+        subject=record.subject,
+        timestamp=timestamp,
+        present=[f"{name} ({usn})" for name, usn in present_students],
+        absent=[f"{name} ({usn})" for name, usn in absent_students],
+    )
+    transaction.on_commit(wake_worker)
+    return entry
+
+
+def _backoff(attempts):
+    delay = settings.SHEETS_OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=min(delay, settings.SHEETS_OUTBOX_RETRY_MAX_SECONDS))
+
+
+def _claim(limit):
+    """
+    Lease up to `limit` due entries to this caller. The lease keeps other
+    processes running a worker from sending the same rows.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    available = Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+    due = SheetsOutbox.objects.filter(available, status=SheetsOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+    ids = list(due.order_by('id').values_list('id', flat=True)[:limit])
+    if not ids:
+        return []
+    due.filter(id__in=ids).update(
+        claim_token=token,
+        claimed_until=now + timedelta(seconds=settings.SHEETS_OUTBOX_LEASE_SECONDS),
+    )
+    return list(SheetsOutbox.objects.filter(claim_token=token).order_by('id'))
+
+
+def _resolve_sheet(subject, section, semester):
+    """Sheet ID for a class, checking with Google only the first time this process sees it."""
+    sheet_id = sheets.known_sheet_id(subject, section, semester)
+    if sheet_id and sheets.cached_tab_ids(sheet_id) is not None:
+        return sheet_id
+    return sheets.get_google_sheet_id(subject, section, semester)
+
+
+def _send(entries):
+    """Write the entries of one class with a single batchUpdate."""
+    first = entries[0]
+    sheet_id = _resolve_sheet(first.subject, first.section, first.semester)
+    if not sheet_id:
+        raise RuntimeError('Google Sheet could not be created')
+    try:
+        with stage('sheets'):
+            sheets.append_attendance_rows(sheet_id, [(e.timestamp, e.present, e.absent) for e in entries])
+    except HttpError as e:
+        if e.resp.status == 404:
+            # Deleted behind our back; the retry recreates it.
+            sheets.forget_sheet(sheet_id)
+        raise
+    increment('sheets_rows', len(entries))
+    return sheet_id
+
+
+def flush_once(limit=None):
+    """Send every due entry, one batch per spreadsheet. Returns the number sent."""
+    entries = _claim(limit or settings.SHEETS_OUTBOX_BATCH_SIZE)
+    groups = {}
+    for entry in entries:
+        groups.setdefault((entry.semester, entry.subject, entry.section), []).append(entry)
+
+    sent = 0
+    for group in groups.values():
+        ids = [e.id for e in group]
+        try:
+            sheet_id = _send(group)
+        except Exception as e:
+            for entry in group:
+                entry.attempts += 1
+                entry.last_error = str(e)[:1000]
+                entry.claim_token = ''
+                entry.claimed_until = None
+                entry.next_attempt_at = timezone.now() + _backoff(entry.attempts)
+                if entry.attempts >= settings.SHEETS_OUTBOX_MAX_ATTEMPTS:
+                    entry.status = SheetsOutbox.STATUS_FAILED
+                entry.save(update_fields=['attempts', 'last_error', 'claim_token', 'claimed_until',
+                                          'next_attempt_at', 'status'])
+            print(f"Error writing attendance to Google Sheets (will retry): {e}")
+            continue
+
+        with transaction.atomic():
+            SheetsOutbox.objects.filter(id__in=ids).update(
+                status=SheetsOutbox.STATUS_SENT,
+                sent_at=timezone.now(),
+                claim_token='',
+                claimed_until=None,
+                last_error='',
+            )
+            AttendanceRecord.objects.filter(
+                id__in=[e.record_id for e in group], sheet_id__isnull=True
+            ).update(sheet_id=sheet_id)
+        sent += len(group)
+    return sent
+
+
+class SheetsOutboxWorker(threading.Thread):
+    """Background thread that drains the outbox, waking early when new entries commit."""
+
+    def __init__(self, interval=None):
+        super().__init__(name='sheets-outbox', daemon=True)
+        self.interval = interval or settings.SHEETS_OUTBOX_POLL_SECONDS
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            sent = 0
+            try:
+                if sheets.sheets_configured():
+                    sent = flush_once()
+            except Exception as e:
+                print(f"Error in Sheets outbox worker: {e}")
+            finally:
+                close_old_connections()
+            if not sent:
+                self.wakeup.wait(self.interval)
+                self.wakeup.clear()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = SheetsOutboxWorker()
+            _worker.start()
+    return _worker
+
+
+def autostart():
+    """Start the in-process worker if enabled and not running; called as each request starts."""
+    if settings.SHEETS_OUTBOX_AUTOSTART and (_worker is None or not _worker.is_alive()):
+        start_worker()
+
+
+def wake_worker():
+    """Nudge the in-process worker (starting it if enabled)."""
+    if settings.SHEETS_OUTBOX_AUTOSTART:
+        start_worker().wakeup.set()
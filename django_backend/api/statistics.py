@@ -0,0 +1,205 @@
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from .models import AttendanceRecord, AttendanceDetail, AttendanceSummary, AttendanceClassSummary
+from .attendance_log import iter_sessions
+
+# Attendance percentage separating the two lists of the statistics report.
+THRESHOLD_PERCENTAGE = 75
+
+# Rows written per INSERT when rebuilding the summary table.
+REBUILD_BATCH_SIZE = 1000
+
+
+def attendance_statistics(semester, section, subject, date_from=None, date_to=None):
+    """
+    Attendance percentage of each student of a class, computed by aggregate
+    queries over AttendanceRecord/AttendanceDetail.
+
+    Matches calculate_statistics over the class's text log: every session
+    counts towards the total, and students are keyed by name. Returns None
+    when the database holds no attendance details for the class, so callers
+    can fall back to the text log.
+    """
+    class_details = AttendanceDetail.objects.filter(
+        record__semester=semester, record__section=section, record__subject=subject
+    )
+    if not class_details.exists():
+        return None
+
+    records = AttendanceRecord.objects.filter(semester=semester, section=section, subject=subject)
+    if date_from:
+        records = records.filter(date__gte=date_from)
+    if date_to:
+        records = records.filter(date__lte=date_to)
+
+    total_sessions = _class_sessions(records)
+    if total_sessions == 0:
+        return {}
+
+    rows = (
+        AttendanceDetail.objects
+        .filter(record__in=records)
+        .values('student_id', 'student__name')
+        .annotate(present=Count('id', filter=Q(status=True)))
+    )
+
+    stats = {}
+    for row in rows:
+        # The text log only knows names, so same-named students share a line.
+        name = row['student__name']
+        stats[name] = stats.get(name, 0) + row['present']
+    return {name: (present / total_sessions) * 100 for name, present in stats.items()}
+
+
+def _class_sessions(records):
+    """Sessions of a class that count towards its percentages."""
+    # Only sessions that were saved with their details count, like the text log.
+    return records.filter(details__isnull=False).distinct().count()
+
+
+def update_summaries(record, present_ids, absent_ids):
+    """
+    Add one session to the running totals of its class and students. Call
+    inside the transaction that saves the record's details. Counters are
+    incremented in the database, so concurrent sessions of a class cannot
+    lose updates.
+    """
+    student_ids = list(present_ids) + list(absent_ids)
+    if not student_ids:
+        return
+    AttendanceClassSummary.objects.get_or_create(
+        semester=record.semester, section=record.section, subject=record.subject
+    )
+    AttendanceClassSummary.objects.filter(
+        semester=record.semester, section=record.section, subject=record.subject
+    ).update(sessions=F('sessions') + 1)
+    summaries = AttendanceSummary.objects.filter(
+        semester=record.semester, section=record.section, subject=record.subject
+    )
+    AttendanceSummary.objects.bulk_create([
+        AttendanceSummary(student_id=student_id, semester=record.semester, section=record.section,
+                          subject=record.subject)
+        for student_id in student_ids
+    ], ignore_conflicts=True)
+    if present_ids:
+        summaries.filter(student_id__in=present_ids).update(
+            sessions_total=F('sessions_total') + 1,
+            sessions_present=F('sessions_present') + 1,
+            last_session_date=record.date,
+        )
+    if absent_ids:
+        summaries.filter(student_id__in=absent_ids).update(
+            sessions_total=F('sessions_total') + 1,
+            last_session_date=record.date,
+        )
+
+
+def rebuild_summaries():
+    """
+    Recompute the student and class summary tables from the attendance
+    details. Returns the number of student rows.
+    """
+    rows = (
+        AttendanceDetail.objects
+        .values('student_id', 'record__semester', 'record__section', 'record__subject')
+        .annotate(
+            total=Count('id'),
+            present=Count('id', filter=Q(status=True)),
+            last_date=Max('record__date'),
+        )
+        .order_by()
+    )
+    classes = (
+        AttendanceRecord.objects
+        .filter(details__isnull=False)
+        .values('semester', 'section', 'subject')
+        .annotate(sessions=Count('id', distinct=True))
+        .order_by()
+    )
+    with transaction.atomic():
+        summaries = [
+            AttendanceSummary(
+                student_id=row['student_id'],
+                semester=row['record__semester'],
+                section=row['record__section'],
+                subject=row['record__subject'],
+                sessions_total=row['total'],
+                sessions_present=row['present'],
+                last_session_date=row['last_date'],
+            )
+            for row in rows.iterator()
+        ]
+        AttendanceSummary.objects.all().delete()
+        AttendanceSummary.objects.bulk_create(summaries, batch_size=REBUILD_BATCH_SIZE)
+        AttendanceClassSummary.objects.all().delete()
+        AttendanceClassSummary.objects.bulk_create(
+            [AttendanceClassSummary(**row) for row in classes], batch_size=REBUILD_BATCH_SIZE
+        )
+    return len(summaries)
+
+
+def summary_report(semester, section, subject):
+    """
+    Whole-term attendance_statistics of a class, read from the running totals
+    instead of the details: the same percentages, over every session of the
+    class, with same-named students sharing a line. Returns None when the
+    class has no summary rows.
+    """
+    rows = (
+        AttendanceSummary.objects
+        .filter(semester=semester, section=section, subject=subject)
+        .values('student__name')
+        .annotate(present=Sum('sessions_present'))
+        .order_by()
+    )
+    stats = {row['student__name']: row['present'] for row in rows}
+    if not stats:
+        return None
+    total_sessions = (
+        AttendanceClassSummary.objects
+        .filter(semester=semester, section=section, subject=subject)
+        .values_list('sessions', flat=True)
+        .first()
+    )
+    if total_sessions is None:
+        return None
+    if total_sessions == 0:
+        return {}
+    return {name: (present / total_sessions) * 100 for name, present in stats.items()}
+
+
+def parse_attendance(file_path):
+    """Parse attendance file and extract records."""
+    try:
+        return list(iter_sessions(file_path))
+    except Exception as e:
+        print(f"Error parsing attendance file: {e}")
+        return []
+
+def log_statistics(file_path, date_from=None, date_to=None):
+    """
+    calculate_statistics over a text log, streamed session by session so memory
+    does not grow with the log. Returns None if the log cannot be parsed.
+    """
+    try:
+        return calculate_statistics(iter_sessions(file_path, date_from, date_to))
+    except Exception as e:
+        print(f"Error parsing attendance file: {e}")
+        return None
+
+def calculate_statistics(attendance_records):
+    """Calculate attendance percentages for each student from a list or stream of sessions."""
+    total_sessions = 0
+    attendance = {}
+    for session in attendance_records:
+        total_sessions += 1
+        for student in session["present"]:
+            attendance[student] = attendance.get(student, 0) + 1
+        for student in session["absent"]:
+            attendance.setdefault(student, 0)  # Ensure absent students are included
+
+    if total_sessions == 0:
+        return {}
+
+    stats = {student: (count / total_sessions) * 100 for student, count in attendance.items()}
+    return stats
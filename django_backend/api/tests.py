@@ -0,0 +1,870 @@
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.signals import request_started
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import numpy as np
+from api import descriptor_cache, encoding_formats, sheets
+from api.duplicate_index import DuplicateIndex
+import json
+import pickle
+import threading
+from api.encoding_store import EncodingStore, EncodingStoreError
+from api.face_matching import find_duplicate, match_faces, match_matrix, stack_encodings
+from api.face_pipeline import DetectedFace
+from api.recognition_service import RecognitionServer
+from api.models import (
+    Student, AttendanceRecord, AttendanceDetail, AttendanceSummary, AttendanceClassSummary, SheetsOutbox,
+)
+from api.sheets_outbox import enqueue_attendance, flush_once
+from api.statistics import attendance_statistics, rebuild_summaries, summary_report
+from api import attendance_log, reports
+from api.attendance_bitmap import backfill_bitmaps, load_matrix
+from api.bulk_enrollment import UploadedPhotos, bulk_enroll, parse_manifest
+from api.downloads import resolve_media_path
+from api.encoding_cache import EncodingCache
+from api.session_matcher import SessionMatcher
+from api.views import is_same_person, save_attendance
+
+
+class TempDataMixin:
+    """Runs each test with its own student data and media directories and the fake Google API."""
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir, ignore_errors=True)
+        overrides = override_settings(
+            STUDENT_DATA_PATH=self.data_dir,
+            MEDIA_ROOT=self.data_dir,
+            DESCRIPTOR_CACHE_DIR=None,
+            GOOGLE_SHEETS_BACKEND='fake',
+            SHEETS_OUTBOX_AUTOSTART=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # A fresh fake Google API per test
+        sheets._services = None
+        sheets._tab_ids.clear()
+        self.addCleanup(sheets._tab_ids.clear)
+        self.addCleanup(setattr, sheets, '_services', None)
+
+
+class SaveAttendanceTests(TempDataMixin, TestCase):
+    def _session(self, section, size):
+        students = Student.objects.bulk_create([
+            Student(name=f'Student {i}', usn=f'{section}{i:03d}', semester='5', section=section)
+            for i in range(size)
+        ])
+        present = [(s.name, s.usn) for s in students[::2]]
+        absent = [(s.name, s.usn) for s in students[1::2]]
+        return present, absent
+
+    def _save(self, section, present, absent):
+        return save_attendance('5', section, 'DBMS', None, None, '2026-10-17 09:00:00', present, absent)
+
+    def test_query_count_does_not_grow_with_class_size(self):
+        small = self._session('A', 5)
+        large = self._session('B', 120)
+
+        with CaptureQueriesContext(connection) as queries:
+            self._save('A', *small)
+        with self.assertNumQueries(len(queries)):
+            record = self._save('B', *large)
+
+        self.assertEqual(AttendanceDetail.objects.filter(record=record).count(), 120)
+        self.assertEqual(AttendanceDetail.objects.filter(record=record, status=True).count(), 60)
+
+    def test_unknown_students_are_skipped(self):
+        present, absent = self._session('A', 4)
+        record = self._save('A', present + [('Nobody', 'X999')], absent)
+        self.assertEqual(AttendanceDetail.objects.filter(record=record).count(), 4)
+
+
+
+class SummaryReportTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        for usn, name in (('U1', 'Asha'), ('U2', 'Bharath'), ('U3', 'Asha')):
+            Student.objects.create(name=name, usn=usn, semester='5', section='A')
+        # Asha (U1) attends two sessions alone; Bharath and the other Asha join
+        # for two more, which U1 misses.
+        for _ in range(2):
+            self._save([('Asha', 'U1')], [])
+        for _ in range(2):
+            self._save([('Bharath', 'U2'), ('Asha', 'U3')], [('Asha', 'U1')])
+
+    def _save(self, present, absent):
+        save_attendance('5', 'A', 'DBMS', None, None, '2026-10-17 09:00:00', present, absent)
+
+    def test_whole_term_report_matches_the_details(self):
+        whole_term = summary_report('5', 'A', 'DBMS')
+        self.assertEqual(whole_term, attendance_statistics('5', 'A', 'DBMS'))
+        self.assertEqual(whole_term, attendance_statistics('5', 'A', 'DBMS', date_from=date(2000, 1, 1)))
+        # Over every session of the class, with same-named students on one line
+        self.assertEqual(whole_term, {'Asha': 100.0, 'Bharath': 50.0})
+
+    def test_rebuilt_summaries_give_the_same_report(self):
+        expected = summary_report('5', 'A', 'DBMS')
+        AttendanceSummary.objects.all().delete()
+        AttendanceClassSummary.objects.all().delete()
+        self.assertIsNone(summary_report('5', 'A', 'DBMS'))
+        rebuild_summaries()
+        self.assertEqual(summary_report('5', 'A', 'DBMS'), expected)
+
+    def test_report_does_not_read_the_details(self):
+        self.assertEqual(AttendanceClassSummary.objects.get(subject='DBMS').sessions, 4)
+        with CaptureQueriesContext(connection) as queries:
+            summary_report('5', 'A', 'DBMS')
+        self.assertEqual(len(queries), 2)
+        for query in queries:
+            self.assertNotIn('attendancedetail', query['sql'].lower())
+
+@override_settings(SHEETS_OUTBOX_RETRY_BASE_SECONDS=5, SHEETS_OUTBOX_MAX_ATTEMPTS=3)
+class SheetsOutboxTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.google = sheets.sheets_service()
+
+    def _enqueue(self, subject='DBMS', section='A', present=(('Asha', '1AM22CI001'),), absent=()):
+        record = AttendanceRecord.objects.create(semester='5', section=section, subject=subject)
+        return enqueue_attendance(record, '2026-10-17 09:00:00', list(present), list(absent))
+
+    def _make_due(self):
+        SheetsOutbox.objects.update(next_attempt_at=timezone.now())
+
+    def _sheet_id(self, subject='DBMS', section='A'):
+        return sheets.known_sheet_id(subject, section, '5')
+
+    def test_entries_are_batched_per_spreadsheet(self):
+        for _ in range(3):
+            self._enqueue()
+        self._enqueue(subject='TOC')
+
+        self.assertEqual(flush_once(), 4)
+
+        self.assertEqual(self.google.calls.count('batch_update'), 2)
+        self.assertEqual(len(self.google.rows(self._sheet_id(), 'Present')), 3)
+        self.assertEqual(len(self.google.rows(self._sheet_id('TOC'), 'Present')), 1)
+        self.assertFalse(SheetsOutbox.objects.exclude(status=SheetsOutbox.STATUS_SENT).exists())
+        self.assertEqual(AttendanceRecord.objects.filter(sheet_id__isnull=True).count(), 0)
+
+    def test_failures_back_off_then_succeed(self):
+        entry = self._enqueue()
+        self.google.fail_next(1, status=429)
+
+        self.assertEqual(flush_once(), 0)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, SheetsOutbox.STATUS_PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.next_attempt_at, timezone.now() + timedelta(seconds=3))
+        # Not due yet
+        self.assertEqual(flush_once(), 0)
+
+        self._make_due()
+        self.assertEqual(flush_once(), 1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, SheetsOutbox.STATUS_SENT)
+
+    def test_deleted_sheet_is_recreated(self):
+        self._enqueue()
+        flush_once()
+        old_id = self._sheet_id()
+        del self.google.spreadsheets_data[old_id]
+
+        entry = self._enqueue()
+        self.assertEqual(flush_once(), 0)
+        self._make_due()
+        self.assertEqual(flush_once(), 1)
+
+        new_id = self._sheet_id()
+        self.assertNotEqual(new_id, old_id)
+        self.assertEqual(len(self.google.rows(new_id, 'Present')), 1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, SheetsOutbox.STATUS_SENT)
+
+    def test_entry_fails_after_max_attempts(self):
+        entry = self._enqueue()
+        for _ in range(3):
+            self.google.fail_next(1, status=500)
+            self._make_due()
+            flush_once()
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, SheetsOutbox.STATUS_FAILED)
+        self.assertEqual(entry.attempts, 3)
+        self._make_due()
+        self.assertEqual(flush_once(), 0)
+
+    def test_worker_starts_with_the_first_request(self):
+        with mock.patch('api.sheets_outbox.start_worker') as start_worker:
+            request_started.send(sender=self.__class__)
+            start_worker.assert_not_called()
+            with override_settings(SHEETS_OUTBOX_AUTOSTART=True):
+                request_started.send(sender=self.__class__)
+            start_worker.assert_called_once()
+
+
+class DownloadTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        media = os.path.join(self.data_dir, 'media')
+        os.makedirs(media)
+        self.body = bytes(range(256)) * 400
+        with open(os.path.join(media, 'report.pdf'), 'wb') as f:
+            f.write(self.body)
+        with open(os.path.join(self.data_dir, 'secret.txt'), 'wb') as f:
+            f.write(b'secret')
+        overrides = override_settings(MEDIA_ROOT=media)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.url = '/api/download/report.pdf/'
+
+    @staticmethod
+    def _body(response):
+        if response.streaming:
+            return b''.join(response.streaming_content)
+        return response.content
+
+    def test_repeated_download_is_answered_with_304(self):
+        sent = 0
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        sent += len(self._body(first))
+        self.assertEqual(sent, len(self.body))
+
+        for _ in range(3):
+            again = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(again.status_code, 304)
+            self.assertEqual(again['ETag'], first['ETag'])
+            sent += len(self._body(again))
+        # Four downloads, the file's bytes sent once
+        self.assertEqual(sent, len(self.body))
+
+        since = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+    def test_byte_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.body)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(self._body(response), self.body[100:200])
+
+    def test_suffix_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-500')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {len(self.body) - 500}-{len(self.body) - 1}/{len(self.body)}')
+        self.assertEqual(self._body(response), self.body[-500:])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.body)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.body)}')
+        self.assertEqual(self._body(response), b'')
+
+    def test_if_range(self):
+        etag = self.client.get(self.url)['ETag']
+        current = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(current.status_code, 206)
+        self.assertEqual(self._body(current), self.body[:10])
+
+        # A range of an older version of the file gets the whole new file
+        stale = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(self._body(stale), self.body)
+
+    def test_paths_outside_media_root_are_not_found(self):
+        for url in ('/api/download/../secret.txt/', '/api/download/sub/../../secret.txt/',
+                    '/api/download/%2E%2E/secret.txt/', '/api/download/missing.pdf/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404, url)
+            self.assertNotIn(b'secret', self._body(response))
+        self.assertIsNone(resolve_media_path(settings.MEDIA_ROOT, '../secret.txt'))
+        self.assertIsNotNone(resolve_media_path(settings.MEDIA_ROOT, 'sub/../report.pdf'))
+
+
+class DescriptorCacheCountTests(TempDataMixin, TestCase):
+    def test_counts_of_worker_jobs_are_merged(self):
+        with override_settings(DESCRIPTOR_CACHE_DIR=os.path.join(self.data_dir, 'descriptor_cache')):
+            cache = descriptor_cache.get_cache()
+            # What a job counts in a worker (possibly another process) is handed back...
+            with descriptor_cache.capture() as counts:
+                cache.count('misses')
+                cache.count('hits', 2)
+            self.assertEqual(cache.counters['misses'], 0)
+            self.assertEqual(counts, {'misses': 1, 'hits': 2})
+
+            # ...and added to the cache of the process that ran the request
+            descriptor_cache.merge(counts)
+            stats = descriptor_cache.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+
+class SessionMatcherTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.encodings = rng.normal(0, 1, (2, 128))
+        self.students = [
+            {'name': name, 'usn': usn, 'encodings': [encoding]}
+            for (name, usn), encoding in zip((('Asha', 'U1'), ('Bharath', 'U2')), self.encodings)
+        ]
+        self.faces = [DetectedFace(None, None, (0.1, 0.1, 0.3, 0.4), 0), DetectedFace(None, None, (0.6, 0.1, 0.8, 0.4), 0)]
+
+    def _photo(self, matcher, encodings):
+        with mock.patch('api.session_matcher.describe_faces', return_value=list(encodings)) as describe:
+            matcher.add_photo(self.faces)
+        return describe.call_args[0][0] if describe.called else []
+
+    def test_identified_faces_are_reused(self):
+        matcher = SessionMatcher(stack_encodings(self.students))
+        self._photo(matcher, [self.encodings[0], self.encodings[1] + 1])
+        # The same scene again: only the face that matched nobody is described
+        described = self._photo(matcher, [self.encodings[1]])
+        self.assertEqual(described, [self.faces[1]])
+        self.assertTrue(matcher.complete())
+
+    def test_face_unmatched_in_one_photo_is_matched_in_a_later_one(self):
+        matcher = SessionMatcher(stack_encodings(self.students))
+        # Bharath is blurred in the first photo and matches nobody
+        self._photo(matcher, [self.encodings[0], np.zeros(128)])
+        self.assertEqual([s['usn'] for s in matcher.present_students()], ['U1'])
+
+        self._photo(matcher, [self.encodings[1]])
+        self.assertEqual([s['usn'] for s in matcher.present_students()], ['U1', 'U2'])
+        self.assertEqual(matcher.counters['faces_reused'], 1)
+
+
+def clustered_students(count, per_student=2, seed=0):
+    """Student dicts whose encodings sit close together, and far from every other student's."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(0, 0.05, (count, 128))
+    return [
+        {'name': f'Student {i}', 'usn': f'U{i:04d}', 'semester': '5', 'section': 'A',
+         'encodings': centre + rng.normal(0, 0.01, (per_student, 128))}
+        for i, centre in enumerate(centres)
+    ]
+
+
+class DuplicateIndexTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = EncodingStore(os.path.join(self.data_dir, 'encodings'))
+        self.students = clustered_students(300)
+        self.store.write_students(self.students)
+        self.reference = stack_encodings(self.students)
+
+    def test_exact_index_gives_the_verdicts_of_a_full_scan(self):
+        index = DuplicateIndex(nprobe=None, min_rows=64)
+        index.sync(self.store.snapshot())
+        self.assertIsNotNone(index.centroids)
+
+        groups = [s['encodings'] for s in self.students[::7]] + [np.random.default_rng(1).normal(0, 0.05, (2, 128))]
+        for exclude in (None, 'U0007'):
+            expected = [find_duplicate(group, self.reference, exclude_usn=exclude) for group in groups]
+            actual = index.find_duplicates(groups, [exclude] * len(groups))
+            self.assertEqual([s and s['usn'] for s in actual], [s and s['usn'] for s in expected])
+
+    @override_settings(DUPLICATE_INDEX_MIN_ROWS=64)
+    def test_recall_is_measured_against_the_exact_scan(self):
+        out = StringIO()
+        with mock.patch('api.management.commands.validate_duplicate_index.encoding_store', self.store):
+            call_command('validate_duplicate_index', '--nprobe', '1', '1000', '--sample', '0', stdout=out)
+        output = out.getvalue()
+        self.assertIn('300 of which the exact scan finds a match', output)
+        self.assertIn('nprobe 1000: recall 1.0000', output)
+
+
+class EncodingStoreOpeningTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = os.path.join(self.data_dir, 'encodings')
+        self.pickle_path = os.path.join(self.data_dir, 'encodings.pkl')
+        self.students = clustered_students(3)
+
+    def _write_pickle(self, students, tail=b''):
+        with open(self.pickle_path, 'wb') as f:
+            for student in students:
+                pickle.dump(dict(student, encodings=list(student['encodings'])), f)
+            f.write(tail)
+
+    def test_legacy_pickle_is_imported_on_first_use(self):
+        self._write_pickle(self.students)
+        store = EncodingStore(self.directory, legacy_pickle=self.pickle_path)
+        self.assertFalse(store.exists())
+        self.assertEqual([e['usn'] for e in store.snapshot().students], ['U0000', 'U0001', 'U0002'])
+
+    def test_failed_import_is_not_replaced_by_an_empty_store(self):
+        self._write_pickle(self.students[:1], tail=b'not a pickle')
+        store = EncodingStore(self.directory, legacy_pickle=self.pickle_path)
+        with self.assertRaises(EncodingStoreError):
+            store.snapshot()
+        with self.assertRaises(EncodingStoreError):
+            store.upsert(self.students[2])
+        self.assertFalse(store.exists())
+
+        # Once the pickle is readable, every student in it is imported
+        self._write_pickle(self.students[:2])
+        store.upsert(self.students[2])
+        self.assertEqual(len(store.snapshot().students), 3)
+
+    def test_students_round_trip_through_a_memory_mapped_matrix(self):
+        store = EncodingStore(self.directory)
+        store.write_students(self.students)
+        snapshot = EncodingStore(self.directory).snapshot()
+        self.assertIsInstance(snapshot.matrix, np.memmap)
+        self.assertEqual(snapshot.matrix.dtype, np.float32)
+        for student, stored in zip(self.students, snapshot.student_dicts()):
+            self.assertEqual((stored['usn'], stored['name']), (student['usn'], student['name']))
+            np.testing.assert_allclose(stored['encodings'], student['encodings'], rtol=1e-6)
+
+    def test_writes_of_another_process_are_seen(self):
+        reader = EncodingStore(self.directory)
+        writer = EncodingStore(self.directory)
+        writer.write_students(self.students[:2])
+        self.assertEqual(len(reader.snapshot().students), 2)
+        stamp = reader.stamp()
+        self.assertEqual(reader.stamp(), stamp)
+        writer.upsert(self.students[2])
+        self.assertNotEqual(reader.stamp(), stamp)
+        self.assertEqual(len(reader.snapshot().students), 3)
+
+    def test_unknown_format_is_rejected(self):
+        store = EncodingStore(self.directory)
+        store.write_students(self.students)
+        with open(store.index_path) as f:
+            index = json.load(f)
+        index['format'] = 99
+        with open(store.index_path, 'w') as f:
+            json.dump(index, f)
+        with self.assertRaises(EncodingStoreError):
+            EncodingStore(self.directory).snapshot()
+
+    def test_matrix_removed_by_a_concurrent_compaction_is_reopened(self):
+        store = EncodingStore(self.directory)
+        store.write_students(self.students)
+        store.upsert(self.students[0])
+        open_matrix = store._open_matrix
+
+        def compacted_meanwhile(state):
+            # Another process compacts between our reading the index and opening its matrix
+            store._open_matrix = open_matrix
+            EncodingStore(self.directory).compact()
+            return open_matrix(state)
+
+        store._open_matrix = compacted_meanwhile
+        snapshot = store.snapshot()
+        self.assertEqual(snapshot.dead_rows, 0)
+        self.assertEqual(len(snapshot.matrix), 6)
+
+
+@override_settings(ENCODING_STORE_DTYPE='int8')
+class QuantizedStoreTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = EncodingStore(os.path.join(self.data_dir, 'encodings'))
+        self.students = clustered_students(50)
+        self.store.write_students(self.students)
+
+    def _stored(self, usn):
+        snapshot = self.store.snapshot()
+        return snapshot.encodings(snapshot.find(usn))
+
+    def test_rows_beyond_the_scale_are_requantized_not_clipped(self):
+        scale = self.store.snapshot().scale
+        outlier = dict(self.students[0], usn='U9999', encodings=np.full((2, 128), scale.max() * 200))
+        self.store.upsert(outlier)
+
+        snapshot = self.store.snapshot()
+        self.assertEqual(snapshot.generation, 2)
+        self.assertFalse(np.array_equal(snapshot.scale, scale))
+        np.testing.assert_allclose(self._stored('U9999'), outlier['encodings'], atol=snapshot.scale.max())
+        np.testing.assert_allclose(self._stored('U0003'), self.students[3]['encodings'], atol=snapshot.scale.max())
+        self.assertEqual([e['usn'] for e in snapshot.students][-2:], ['U0049', 'U9999'])
+
+    def test_compaction_refits_the_scale(self):
+        # The widest students are re-enrolled closer to the origin, so the old scale is too wide
+        for student in self.students:
+            self.store.upsert(dict(student, encodings=student['encodings'] / 4))
+        old = self.store.snapshot()
+        self.assertGreater(old.dead_rows, 0)
+        self.store.compact()
+        new = self.store.snapshot()
+        self.assertLess(new.scale.max(), old.scale.max())
+        self.assertEqual(new.dead_rows, 0)
+        np.testing.assert_allclose(self._stored('U0003'), self.students[3]['encodings'] / 4, atol=old.scale.max())
+
+    def test_duplicate_index_scans_in_chunks(self):
+        reference = stack_encodings(self.students)
+        index = DuplicateIndex(nprobe=None, min_rows=10 ** 6)
+        index.sync(self.store.snapshot())
+        groups = [s['encodings'] for s in self.students]
+        with mock.patch('api.duplicate_index.DECODE_CHUNK', 7), \
+                mock.patch('api.duplicate_index.decode', wraps=encoding_formats.decode) as decode:
+            actual = index.find_duplicates(groups)
+        self.assertTrue(all(len(call.args[0]) <= 7 for call in decode.call_args_list))
+        self.assertEqual([s['usn'] for s in actual], [find_duplicate(g, reference)['usn'] for g in groups])
+
+    def test_formats_are_compared_with_float64_is_same_person(self):
+        out = StringIO()
+        with mock.patch('api.management.commands.validate_encoding_formats.encoding_store', self.store), \
+                mock.patch('api.management.commands.validate_encoding_formats.is_same_person',
+                           wraps=is_same_person) as reference:
+            call_command('validate_encoding_formats', '--sample', '0', stdout=out)
+        self.assertTrue(reference.called)
+        self.assertTrue(all(call.args[1].dtype == np.float64 for call in reference.call_args_list))
+        self.assertIn('float32:', out.getvalue())
+        self.assertIn('0 of 5000 decisions changed', out.getvalue())
+
+
+class FaceMatchingTests(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        centre = rng.normal(0, 0.05, 128)
+        direction = rng.normal(0, 1, 128)
+        direction /= np.linalg.norm(direction)
+        # Students with one, two and three encodings around the same face, and one elsewhere
+        self.students = [
+            {'name': 'One', 'usn': 'U1', 'encodings': [centre + 0.3 * direction]},
+            {'name': 'Two', 'usn': 'U2', 'encodings': [centre + 0.1 * direction, centre + 0.5 * direction]},
+            {'name': 'Three', 'usn': 'U3', 'encodings': [centre, centre + 0.2 * direction, centre - 0.45 * direction]},
+            {'name': 'Far', 'usn': 'U4', 'encodings': list(rng.normal(0, 0.05, (2, 128)))},
+        ]
+        # Faces along the line, some a hair either side of the threshold from stored encodings
+        offsets = [-0.6, -0.25, 0.0, 0.05, 0.099, 0.15, 0.3, 0.45, 0.5, 0.7, 0.8, 0.9]
+        self.faces = [centre + t * direction for t in offsets] + [centre + 0.3 * direction + 0.39 * direction[::-1]]
+        self.faces += list(rng.normal(0, 0.05, (5, 128)))
+
+    def _expected(self):
+        return np.array([[is_same_person(s['encodings'], face) for s in self.students] for face in self.faces])
+
+    def test_match_matrix_agrees_with_is_same_person(self):
+        expected = self._expected()
+        self.assertTrue(expected.any() and not expected.all())
+        np.testing.assert_array_equal(match_matrix(self.faces, stack_encodings(self.students)), expected)
+
+    def test_match_faces_gives_the_first_student_in_roster_order(self):
+        expected = self._expected()
+        first = [int(np.argmax(row)) if row.any() else -1 for row in expected]
+        self.assertEqual(list(match_faces(self.faces, stack_encodings(self.students))), first)
+
+    def test_empty_inputs(self):
+        self.assertEqual(match_matrix([], stack_encodings(self.students)).shape, (0, 4))
+        self.assertEqual(list(match_faces(self.faces[:2], stack_encodings([]))), [-1, -1])
+
+
+class EncodingStoreWriteTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = os.path.join(self.data_dir, 'encodings')
+        self.store = EncodingStore(self.directory)
+        self.students = clustered_students(4)
+        self.store.write_students(self.students[:2])
+
+    def _file(self, suffix):
+        [name] = [n for n in os.listdir(self.directory) if n.endswith(suffix)]
+        return os.path.join(self.directory, name)
+
+    def _assert_stored(self, store, students):
+        snapshot = store.snapshot()
+        self.assertEqual([e['usn'] for e in snapshot.students], [s['usn'] for s in students])
+        for student in students:
+            np.testing.assert_allclose(snapshot.encodings(snapshot.find(student['usn'])), student['encodings'],
+                                       rtol=1e-6)
+
+    def test_torn_journal_line_is_ignored_then_repaired(self):
+        with open(self._file('.journal'), 'ab') as f:
+            f.write(b'{"op": "put", "rows": 99, "stud')
+        self._assert_stored(EncodingStore(self.directory), self.students[:2])
+
+        self.store.upsert(self.students[2])
+        self._assert_stored(EncodingStore(self.directory), self.students[:3])
+
+    def test_torn_matrix_tail_and_unpublished_rows_are_skipped(self):
+        # A crash after appending rows, before their journal line, and one mid-row
+        with open(self._file('.f32'), 'ab') as f:
+            f.write(np.ones((3, 128), dtype=np.float32).tobytes() + b'\x01' * 100)
+        self._assert_stored(EncodingStore(self.directory), self.students[:2])
+
+        self.store.upsert(self.students[2])
+        self.assertEqual(os.path.getsize(self._file('.f32')) % (128 * 4), 0)
+        self._assert_stored(EncodingStore(self.directory), self.students[:3])
+
+    def test_reenrolled_usn_keeps_its_place_with_new_encodings(self):
+        again = dict(self.students[0], name='Renamed', encodings=self.students[3]['encodings'])
+        self.assertEqual(self.store.upsert_many([again, self.students[2]]), [True, False])
+
+        snapshot = EncodingStore(self.directory).snapshot()
+        self.assertEqual([e['usn'] for e in snapshot.students], ['U0000', 'U0001', 'U0002'])
+        self.assertEqual(snapshot.find('U0000')['name'], 'Renamed')
+        self.assertEqual(snapshot.dead_rows, 2)
+        self._assert_stored(self.store, [again, self.students[1], self.students[2]])
+
+    def test_compaction_keeps_the_live_rows(self):
+        for student in self.students:
+            self.store.upsert(dict(student, encodings=student['encodings'][:1]))
+        before = self.store.snapshot()
+        self.assertEqual(before.dead_rows, 4)
+        old_matrix = self._file('.f32')
+
+        self.assertEqual(self.store.compact(), 4)
+
+        after = EncodingStore(self.directory).snapshot()
+        self.assertEqual((after.generation, after.dead_rows, len(after.matrix)), (before.generation + 1, 0, 4))
+        self.assertFalse(os.path.exists(old_matrix))
+        self._assert_stored(self.store, [dict(s, encodings=s['encodings'][:1]) for s in self.students])
+
+
+class BulkEnrollTests(TempDataMixin, TestCase):
+    """Bulk enrollment with the face pipeline replaced: each photo's bytes name the encoding it yields."""
+
+    def setUp(self):
+        super().setUp()
+        self.store = EncodingStore(os.path.join(self.data_dir, 'encodings'))
+        self.students = clustered_students(3)
+        self.store.write_students(self.students[:1])
+        self.encodings = {}
+        for student in self.students:
+            for k, encoding in enumerate(student['encodings']):
+                self.encodings[f'{student["usn"]}-{k}'.encode()] = encoding
+        for target, value in (('encoding_store', self.store), ('encoding_cache', EncodingCache(self.store)),
+                              ('detect_photos', self._detect), ('describe_faces', self._describe)):
+            patcher = mock.patch(f'api.bulk_enrollment.{target}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _detect(photos, endpoint):
+        return [[] if photo == b'blank' else [photo] for photo in photos]
+
+    def _describe(self, faces):
+        return [self.encodings[face] for face in faces]
+
+    def _enroll(self, entries, photos):
+        files = [SimpleUploadedFile(name, data) for name, data in photos.items()]
+        return bulk_enroll(parse_manifest(json.dumps(entries), 'manifest.json', {'semester': '5', 'section': 'A'}),
+                           UploadedPhotos(files))
+
+    def test_each_student_gets_a_report(self):
+        entries = [
+            {'name': 'Copy of 0', 'usn': 'N0001', 'photos': ['a.jpg', 'b.jpg']},
+            {'name': 'Student 1', 'usn': 'U0001'},
+            {'name': 'Copy of 1', 'usn': 'N0002', 'photos': ['c.jpg']},
+            {'name': 'Renamed 0', 'usn': 'U0000', 'photos': ['a.jpg']},
+            {'name': 'Student 2', 'usn': 'U0002', 'photos': ['blank.jpg']},
+            {'name': 'Missing', 'usn': 'N0003', 'photos': ['gone.jpg']},
+            {'name': 'Again', 'usn': 'U0001', 'photos': ['a.jpg']},
+            {'name': '', 'usn': 'N0004', 'photos': ['a.jpg']},
+        ]
+        photos = {'a.jpg': b'U0000-0', 'b.jpg': b'U0000-1', 'U0001_1.jpg': b'U0001-0', 'U0001_2.jpg': b'U0001-1',
+                  'c.jpg': b'U0001-1', 'blank.jpg': b'blank'}
+        reports = self._enroll(entries, photos)
+
+        self.assertEqual([r['usn'] for r in reports], [e['usn'] for e in entries])
+        self.assertEqual([r['status'] for r in reports],
+                         ['rejected', 'enrolled', 'rejected', 'updated', 'rejected', 'rejected', 'rejected',
+                          'rejected'])
+        self.assertIn('existing student (Student 0)', reports[0]['message'])
+        self.assertIn('another student in the batch (Student 1, U0001)', reports[2]['message'])
+        self.assertIn('No face detected', reports[4]['message'])
+        self.assertIn('gone.jpg', reports[5]['message'])
+        self.assertEqual(reports[6]['message'], 'USN appears more than once in the batch')
+        self.assertEqual(reports[7]['message'], 'Missing required fields')
+
+        snapshot = self.store.snapshot()
+        self.assertEqual([e['usn'] for e in snapshot.students], ['U0000', 'U0001'])
+        self.assertEqual(snapshot.find('U0000')['name'], 'Renamed 0')
+        np.testing.assert_allclose(snapshot.encodings(snapshot.find('U0001')), self.students[1]['encodings'],
+                                   rtol=1e-6)
+        self.assertEqual(sorted(Student.objects.values_list('usn', 'name')),
+                         [('U0000', 'Renamed 0'), ('U0001', 'Student 1')])
+
+    def test_earlier_batch_student_wins_over_a_later_duplicate(self):
+        entries = [{'name': 'First', 'usn': 'N0001', 'photos': ['x.jpg']},
+                   {'name': 'Second', 'usn': 'N0002', 'photos': ['y.jpg']},
+                   {'name': 'Other', 'usn': 'N0003', 'photos': ['z.jpg']}]
+        reports = self._enroll(entries, {'x.jpg': b'U0002-0', 'y.jpg': b'U0002-1', 'z.jpg': b'U0001-0'})
+
+        self.assertEqual([r['status'] for r in reports], ['enrolled', 'rejected', 'enrolled'])
+        self.assertIn('(First, N0001)', reports[1]['message'])
+        self.assertEqual([e['usn'] for e in self.store.snapshot().students], ['U0000', 'N0001', 'N0003'])
+
+
+class VideoAttendanceServiceTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        socket_path = os.path.join(self.data_dir, 'recognition.sock')
+        server = RecognitionServer(socket_path, max_pending=2, queue_wait=1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        overrides = override_settings(RECOGNITION_SERVICE_SOCKET=socket_path)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.server = server
+
+    def test_unreadable_video_is_reported_not_a_service_failure(self):
+        video = SimpleUploadedFile('clip.mp4', b'not a video')
+        cache = EncodingCache(EncodingStore(os.path.join(self.data_dir, 'encodings')))
+        with mock.patch('api.views.models_loaded', return_value=True), mock.patch('api.views.encoding_cache', cache):
+            response = self.client.post('/api/take-attendance/video/', {
+                'subject': 'Maths', 'semester': '5', 'section': 'A', 'video': video,
+            })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'success': False, 'message': 'Could not read the video'})
+        self.assertEqual((self.server.completed, self.server.failed), (1, 0))
+
+
+class AttendanceBitmapTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        students = [Student.objects.create(name=f'Student {i}', usn=f'B{i:02d}', semester='5', section='A')
+                    for i in range(10)]
+        rng = np.random.default_rng(5)
+        for session in range(12):
+            # The last two students join the class after four sessions
+            roster = students if session >= 4 else students[:8]
+            status = rng.random(len(roster)) < 0.6
+            present = [(s.name, s.usn) for s, p in zip(roster, status) if p]
+            absent = [(s.name, s.usn) for s, p in zip(roster, status) if not p]
+            save_attendance('5', 'A', 'DBMS', None, None, '2026-10-17 09:00:00', present, absent)
+
+    def _from_details(self):
+        """Percentage, longest and current absence streak per USN, from AttendanceDetail."""
+        expected = {}
+        details = AttendanceDetail.objects.order_by('record__date', 'record_id').select_related('student')
+        for detail in details:
+            present, total, longest, run = expected.get(detail.student.usn, (0, 0, 0, 0))
+            run = 0 if detail.status else run + 1
+            expected[detail.student.usn] = (present + detail.status, total + 1, max(longest, run), run)
+        return {usn: (present * 100.0 / total, longest, run) for usn, (present, total, longest, run) in expected.items()}
+
+    def _from_bitmaps(self):
+        matrix = load_matrix('5', 'A', 'DBMS')
+        longest, current = matrix.absence_streaks()
+        return {
+            usn: (percentage, int(l), int(c))
+            for (_, usn, _), percentage, l, c in zip(matrix.students, matrix.percentages(), longest, current)
+        }
+
+    def test_percentages_and_streaks_match_the_details(self):
+        bitmaps = self._from_bitmaps()
+        expected = self._from_details()
+        self.assertEqual(bitmaps.keys(), expected.keys())
+        for usn, (percentage, longest, current) in expected.items():
+            self.assertAlmostEqual(bitmaps[usn][0], percentage)
+            self.assertEqual(bitmaps[usn][1:], (longest, current), usn)
+        matrix = load_matrix('5', 'A', 'DBMS')
+        self.assertEqual(matrix.present.shape, (12, 10))
+        self.assertEqual(int(matrix.marked[:4, 8:].sum()), 0)
+
+    def test_backfilled_bitmaps_give_the_same_matrix(self):
+        expected = load_matrix('5', 'A', 'DBMS').as_dict()
+        AttendanceRecord.objects.update(present_bits=None, marked_bits=None)
+        self.assertEqual(load_matrix('5', 'A', 'DBMS').present.shape[0], 0)
+        self.assertEqual(backfill_bitmaps(batch_size=5), 12)
+        self.assertEqual(load_matrix('5', 'A', 'DBMS').as_dict(), expected)
+
+
+class AttendanceLogTests(TempDataMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.log = os.path.join(self.data_dir, 'attendance_5_DBMS_A.txt')
+        self.days = [date(2026, 9, 1) + timedelta(days=i) for i in range(30)]
+        for i, day in enumerate(self.days):
+            attendance_log.append_session(self.log, f'{day.isoformat()} 09:00:00', [f'P{i}'], [f'A{i}'])
+
+    def _headers_at(self, offsets):
+        with open(self.log, 'rb') as f:
+            data = f.read()
+        return [data[offset:offset + len(attendance_log.SESSION_HEADER)] for offset in offsets]
+
+    def test_index_points_at_every_session_header(self):
+        entries = attendance_log.load_index(self.log)
+        self.assertEqual([day for _, day in entries], self.days)
+        self.assertEqual(set(self._headers_at([offset for offset, _ in entries])), {attendance_log.SESSION_HEADER})
+
+    def test_date_range_seeks_to_the_first_session(self):
+        with mock.patch('api.attendance_log._header_date', wraps=attendance_log._header_date) as parsed:
+            sessions = list(attendance_log.iter_sessions(self.log, self.days[25], self.days[26]))
+        self.assertEqual([s['present'] for s in sessions], [['P25'], ['P26']])
+        # The last header, to check the index is current, then those from the
+        # 26th session up to the first one past the range
+        self.assertEqual(parsed.call_count, 4)
+
+        everything = list(attendance_log.iter_sessions(self.log))
+        self.assertEqual(len(everything), 30)
+        self.assertEqual(everything[25:27], sessions)
+
+    def test_sessions_written_without_the_index_are_synced_incrementally(self):
+        last_offset = attendance_log.load_index(self.log)[-1][0]
+        # Appended the way the code before the index did
+        with open(self.log, 'a') as f:
+            f.write("\n--- Attendance Session: 2026-10-01 09:00:00 ---\nPresent Students: X\nAbsent Students: \n")
+        with mock.patch('api.attendance_log._scan_headers', wraps=attendance_log._scan_headers) as scan:
+            entries = attendance_log.load_index(self.log)
+        scan.assert_called_once_with(self.log, last_offset)
+        self.assertEqual(entries[-1][1], date(2026, 10, 1))
+        self.assertEqual(len(entries), 31)
+
+        attendance_log.append_session(self.log, '2026-10-02 09:00:00', ['Y'], [])
+        entries = attendance_log.load_index(self.log)
+        self.assertEqual([day for _, day in entries[-2:]], [date(2026, 10, 1), date(2026, 10, 2)])
+        self.assertEqual(set(self._headers_at([offset for offset, _ in entries])), {attendance_log.SESSION_HEADER})
+
+    def test_index_of_a_replaced_log_is_rebuilt(self):
+        with open(self.log, 'w') as f:
+            f.write("\n--- Attendance Session: 2026-11-05 09:00:00 ---\nPresent Students: Z\nAbsent Students: \n")
+        self.assertEqual(attendance_log.load_index(self.log), [(1, date(2026, 11, 5))])
+
+
+class ReportCacheTests(TempDataMixin, TestCase):
+    stats = {'Asha': 100.0, 'Bharath': 50.0}
+
+    def _report(self, stats=None):
+        return reports.cached_report('5', 'DBMS', 'A', stats or self.stats)
+
+    def _path(self, name):
+        return os.path.join(settings.MEDIA_ROOT, name)
+
+    def test_identical_content_reuses_the_report(self):
+        with mock.patch('api.reports.generate_pdf', wraps=reports.generate_pdf) as generate:
+            first = self._report()
+            again = self._report(dict(self.stats))
+            changed = self._report({'Asha': 100.0, 'Bharath': 75.0})
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, changed)
+        self.assertEqual(generate.call_count, 2)
+        with open(self._path(first), 'rb') as f:
+            self.assertEqual(f.read(5), b'%PDF-')
+        self.assertEqual([n for n in os.listdir(reports.cache_dir()) if not n.endswith('.pdf')], [])
+
+    @override_settings(REPORT_CACHE_MAX_FILES=2)
+    def test_least_recently_used_reports_are_evicted(self):
+        oldest = self._report({'Asha': 10.0})
+        used = self._report({'Asha': 20.0})
+        os.utime(self._path(oldest), (1, 1))
+        os.utime(self._path(used), (2, 2))
+        self.assertEqual(self._report({'Asha': 20.0}), used)  # Marks it recently used
+
+        newest = self._report({'Asha': 30.0})
+        self.assertFalse(os.path.exists(self._path(oldest)))
+        self.assertTrue(os.path.exists(self._path(used)))
+        self.assertTrue(os.path.exists(self._path(newest)))
+
+    @override_settings(REPORT_CACHE_MAX_BYTES=1)
+    def test_the_report_just_generated_is_kept(self):
+        first = self._report({'Asha': 10.0})
+        second = self._report({'Asha': 20.0})
+        self.assertFalse(os.path.exists(self._path(first)))
+        self.assertTrue(os.path.exists(self._path(second)))
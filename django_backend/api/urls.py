@@ -4,8 +4,15 @@ from . import views
 urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('enroll/', views.enroll_student, name='enroll'),
+    path('enroll/bulk/', views.bulk_enroll_students, name='bulk_enroll'),
     path('take-attendance/', views.take_attendance, name='take_attendance'),
+    path('take-attendance/video/', views.take_video_attendance, name='take_video_attendance'),
     path('attendance-files/', views.get_attendance_files, name='attendance_files'),
     path('generate-statistics/', views.generate_statistics, name='generate_statistics'),
-    path('download/<str:filename>/', views.download_file, name='download_file'),
+    path('download/<path:filename>/', views.download_file, name='download_file'),
+    path('attendance-matrix/', views.attendance_matrix, name='attendance_matrix'),
+    path('encoding-cache/stats/', views.encoding_cache_stats, name='encoding_cache_stats'),
+    path('descriptor-cache/stats/', views.descriptor_cache_stats, name='descriptor_cache_stats'),
+    path('session-matcher/stats/', views.session_matcher_stats, name='session_matcher_stats'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
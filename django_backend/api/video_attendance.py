@@ -0,0 +1,309 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from .face_pipeline import get_pipeline, detection_frame, describe_faces, run_job, _service
+from .session_matcher import SessionMatcher, box_overlap
+from .instrumentation import stage, increment
+
+# A detection continues a track when it overlaps the track's current box by at
+# least this much.
+TRACK_MIN_OVERLAP = 0.3
+
+# Trackers search for each face where its last movement predicts it. While
+# faces are tracked, frames are sampled so that faces stray about this fraction
+# of their width from where they were predicted between samples, well within
+# a correlation tracker's reach: steady pans are sampled sparsely, shaky or
+# changing movement densely. The sampling interval at most doubles per sample.
+TRACK_MAX_SHIFT = 0.25
+
+# While the camera pans, faces are detected at least this many times in the
+# time a face takes to cross the picture.
+PAN_DETECTIONS = 2
+
+# A face that matched nobody is described again only once it is at least this
+# much wider than when it was last described, i.e. seen from closer.
+REDESCRIBE_MIN_GROWTH = 1.25
+
+# Side of the grayscale thumbnails compared to measure how fast the picture changes.
+THUMBNAIL_SIZE = (64, 36)
+
+COUNTERS = (
+    'clips',
+    'frames',              # frames of the clip read, up to where it was processed
+    'frames_sampled',      # frames decoded and looked at
+    'keyframes',           # sampled frames faces were detected in
+    'detections',
+    'tracks',              # distinct faces followed through the clip
+    'faces_described',
+    'frames_skipped',      # never read: the class was complete
+)
+
+_totals = dict.fromkeys(COUNTERS, 0)
+_totals_lock = threading.Lock()
+
+
+class VideoError(ValueError):
+    pass
+
+
+def stats():
+    """Work done by every video attendance clip processed in this process."""
+    with _totals_lock:
+        return dict(_totals)
+
+
+class _Track:
+    """A face followed from frame to frame by a correlation tracker."""
+
+    __slots__ = ('tracker', 'position', 'velocity', 'student', 'described', 'described_width', 'missed')
+
+    def __init__(self, tracker, position, velocity):
+        self.tracker = tracker
+        self.position = position
+        self.velocity = velocity  # Movement per frame, as fractions of the frame
+        self.student = None  # Index in the class once matched, -1 while unmatched
+        self.described = 0
+        self.described_width = 0.0
+        self.missed = 0
+
+    def needs_descriptor(self, position, limit):
+        if self.student is not None and self.student >= 0 or self.described >= limit:
+            return False
+        return self.described == 0 or position[2] - position[0] >= REDESCRIBE_MIN_GROWTH * self.described_width
+
+
+def _rectangle(position, frame):
+    import dlib
+
+    height, width = frame.shape[:2]
+    left, top, right, bottom = position
+    return dlib.rectangle(int(left * width), int(top * height), int(right * width), int(bottom * height))
+
+
+def _position(rectangle, frame):
+    height, width = frame.shape[:2]
+    return (rectangle.left() / width, rectangle.top() / height, rectangle.right() / width, rectangle.bottom() / height)
+
+
+def _in_frame(position):
+    left, top, right, bottom = position
+    return 0.0 <= (left + right) / 2 <= 1.0 and 0.0 <= (top + bottom) / 2 <= 1.0
+
+
+class VideoSession:
+    """
+    Attendance from one video clip. Frames are sampled adaptively and faces are
+    detected only every so often; in between, each face is followed by a
+    correlation tracker, so a student who stays in view for the whole clip is
+    described once (at most `descriptors_per_track` times while unmatched)
+    instead of once per frame. Descriptors are matched by a SessionMatcher, and
+    the clip stops being read once the whole class is present.
+    """
+
+    def __init__(self, matrix):
+        self.matcher = SessionMatcher(matrix)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def present_students(self):
+        return self.matcher.present_students()
+
+    def run(self, path):
+        import cv2
+
+        options = settings.VIDEO_ATTENDANCE
+        video = cv2.VideoCapture(path)
+        if not video.isOpened():
+            raise VideoError('Could not read the video')
+        try:
+            fps = video.get(cv2.CAP_PROP_FPS)
+            if not fps or not np.isfinite(fps) or fps <= 0:
+                fps = 30.0
+            total = int(video.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+            self._track(video, fps, options)
+        finally:
+            video.release()
+        if self.matcher.complete():
+            self.counters['frames_skipped'] = max(0, total - self.counters['frames'])
+        if not self.counters['frames_sampled']:
+            raise VideoError('The video has no frames')
+
+    def _track(self, video, fps, options):
+        import cv2
+
+        pipeline = get_pipeline()
+        min_step = max(1, round(options['min_interval'] * fps))
+        max_step = max(min_step, round(options['max_interval'] * fps))
+        detect_every = max(1, round(options['detect_interval'] * fps))
+        max_frames = int(options['max_seconds'] * fps)
+
+        tracks = []
+        step = min_step
+        last_detection = None
+        previous = None
+        while self.counters['frames'] < max_frames and not self.matcher.complete():
+            # Frames between samples are only grabbed, not converted
+            with stage('decode'):
+                for _ in range(step - 1):
+                    if not video.grab():
+                        return
+                    self.counters['frames'] += 1
+                ok, bgr_img = video.read()
+                if not ok:
+                    return
+                self.counters['frames'] += 1
+                frame, scale = detection_frame(bgr_img, settings.FACE_DETECTION['video']['width'])
+                gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+            self.counters['frames_sampled'] += 1
+            index = self.counters['frames']
+            thumbnail = cv2.resize(gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+            # Largest distance between where a face was predicted and where it
+            # was found, in face widths per frame
+            shift = None
+            with stage('tracking'):
+                # Faces that left the picture are not followed any further
+                tracks = [track for track in tracks if _in_frame(track.position)]
+                for track in tracks:
+                    dx, dy = track.velocity[0] * step, track.velocity[1] * step
+                    left, top, right, bottom = track.position
+                    guess = (left + dx, top + dy, right + dx, bottom + dy)
+                    track.tracker.update(gray, _rectangle(guess, gray))
+                    position = _position(track.tracker.get_position(), gray)
+                    width = right - left
+                    # Faces at the edge of the picture are cut off and tracked poorly
+                    if width > 0 and min(guess) >= 0.0 and max(guess) <= 1.0:
+                        error = max(abs(position[0] - guess[0]), abs(position[1] - guess[1]))
+                        shift = max(shift or 0.0, error / width / step)
+                    track.velocity = ((position[0] - left) / step, (position[1] - top) / step)
+                    track.position = position
+
+            # Sample more often the less predictably faces (or, with none tracked, the picture) move
+            if shift is not None:
+                step = min(2 * step, round(TRACK_MAX_SHIFT / shift) if shift > 0 else max_step)
+            elif previous is not None:
+                speed = min(1.0, float(np.abs(thumbnail - previous).mean()) / options['fast_motion'])
+                step = round(max_step - (max_step - min_step) * speed)
+            step = min(max(step, min_step), max_step)
+            previous = thumbnail
+
+            # When the camera pans, new faces come into view sooner
+            due = detect_every
+            if tracks:
+                pan = float(np.median([abs(track.velocity[0]) for track in tracks]))
+                if pan > 0:
+                    due = max(step, min(detect_every, round(1 / (PAN_DETECTIONS * pan))))
+            if last_detection is None or index - last_detection >= due:
+                last_detection = index
+                tracks = self._detect(pipeline, tracks, bgr_img, frame, scale, gray, options)
+
+    def _detect(self, pipeline, tracks, bgr_img, frame, scale, gray, options):
+        """Detect the faces of a keyframe, continue or start their tracks and describe new faces."""
+        import dlib
+
+        faces = pipeline.detect_frame(bgr_img, frame, scale, 'video')
+        self.counters['keyframes'] += 1
+        self.counters['detections'] += len(faces)
+
+        # Pair detections with tracks, best overlap first
+        pairs = sorted(
+            ((box_overlap(face.position, track.position), f, t)
+             for f, face in enumerate(faces) for t, track in enumerate(tracks)),
+            reverse=True,
+        )
+        track_of = {}
+        taken = set()
+        for overlap, f, t in pairs:
+            if overlap < TRACK_MIN_OVERLAP:
+                break
+            if f not in track_of and t not in taken:
+                track_of[f] = tracks[t]
+                taken.add(t)
+
+        kept = []
+        for t, track in enumerate(tracks):
+            if t in taken:
+                track.missed = 0
+            else:
+                track.missed += 1
+            if track.missed <= options['max_missed']:
+                kept.append(track)
+
+        # New faces are expected to move with the others, as when the camera pans
+        velocity = (0.0, 0.0)
+        if kept:
+            velocity = tuple(np.median([track.velocity for track in kept], axis=0))
+
+        to_describe = []
+        with stage('tracking'):
+            for f, face in enumerate(faces):
+                track = track_of.get(f)
+                if track is None:
+                    track = _Track(dlib.correlation_tracker(), face.position, velocity)
+                    self.counters['tracks'] += 1
+                    kept.append(track)
+                # Restart the tracker on the detection, which has not drifted
+                track.tracker.start_track(gray, _rectangle(face.position, gray))
+                track.position = face.position
+                if track.needs_descriptor(face.position, options['descriptors_per_track']):
+                    to_describe.append((track, face))
+
+        if to_describe:
+            encodings = describe_faces([face for _, face in to_describe])
+            self.counters['faces_described'] += len(encodings)
+            for (track, _), student in zip(to_describe, self.matcher.match_encodings(encodings)):
+                track.described += 1
+                track.described_width = track.position[2] - track.position[0]
+                track.student = student
+        return kept
+
+    def finish(self):
+        self.counters['clips'] = 1
+        self.matcher.counters['faces'] = self.counters['tracks']
+        self.matcher.finish(0)
+        with _totals_lock:
+            for name, value in self.counters.items():
+                _totals[name] += value
+        increment('faces', self.counters['tracks'])
+        increment('descriptors_skipped', self.counters['detections'] - self.counters['faces_described'])
+
+
+@contextmanager
+def _video_file(video):
+    """A path OpenCV can read the video (an uploaded file or bytes) from."""
+    temporary_file_path = getattr(video, 'temporary_file_path', None)
+    if temporary_file_path is not None:
+        yield temporary_file_path()
+        return
+    suffix = os.path.splitext(getattr(video, 'name', '') or '')[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+        f.write(video if isinstance(video, bytes) else video.read())
+        f.flush()
+        yield f.name
+
+
+def track_video(video, matrix):
+    """Run a VideoSession over a video (an uploaded file or bytes) in this process."""
+    session = VideoSession(matrix)
+    with _video_file(video) as path:
+        session.run(path)
+    return session
+
+
+def match_video(video, matrix):
+    """
+    Match the students in a video of the class against a class EncodingMatrix,
+    in the recognition service when one is configured, else wherever the face
+    models are (see run_job). Returns the finished VideoSession.
+    """
+    service = _service()
+    if service is not None:
+        session = service.call('video', video=video.read(), matrix=matrix)
+        if isinstance(session, VideoError):
+            raise session
+    else:
+        session = run_job(track_video, video.read(), matrix)
+    session.finish()
+    return session
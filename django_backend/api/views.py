@@ -1,48 +1,30 @@
 import os
-import cv2
-import dlib
-import pickle
 import numpy as np
 from datetime import datetime
 from django.conf import settings
-from django.http import JsonResponse, FileResponse
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
 from django.contrib.auth.hashers import check_password, make_password
 from rest_framework.decorators import api_view
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.oauth2.service_account import Credentials
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 from .models import User, Student, AttendanceRecord, AttendanceDetail
-
-# Initialize face detection and recognition models.
-try:
-    face_detector = dlib.get_frontal_face_detector()
-    shape_predictor = dlib.shape_predictor(os.path.join(settings.BASE_DIR, 'shape_predictor_68_face_landmarks.dat'))
-    face_recognizer = dlib.face_recognition_model_v1(os.path.join(settings.BASE_DIR, 'dlib_face_recognition_resnet_model_v1.dat'))
-except Exception as e:
-    print(f"Error loading face recognition models: {e}")
-    face_detector = None
-    shape_predictor = None
-    face_recognizer = None
-
-# Google Sheets API setup
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-try:
-    creds = Credentials.from_service_account_file(settings.GOOGLE_CREDENTIALS_FILE, scopes=SCOPES)
-    sheets_service = build('sheets', 'v4', credentials=creds)
-    drive_service = build('drive', 'v3', credentials=creds)
-except Exception as e:
-    print(f"Error setting up Google API: {e}")
-    sheets_service = None
-    drive_service = None
-
-# Ensure the pickle file exists
-if not os.path.exists(settings.PICKLE_FILE):
-    with open(settings.PICKLE_FILE, 'wb') as f:
-        pass  # Create an empty pickle file
+from .encoding_cache import encoding_cache
+from .encoding_store import encoding_store
+from .face_pipeline import models_loaded, detect_photos, describe_faces
+from . import descriptor_cache, face_pipeline, session_matcher, video_attendance
+from .sheets import sheets_configured, known_sheet_id
+from .sheets_outbox import enqueue_attendance
+from .bulk_enrollment import BulkEnrollmentError, ArchivePhotos, UploadedPhotos, parse_manifest, bulk_enroll
+from .reports import cached_report
+from .downloads import resolve_media_path, serve_file
+from .attendance_log import append_session
+from .attendance_bitmap import roster_positions, pack_session, load_matrix
+from .instrumentation import stage, increment, registry
+from .statistics import (
+    attendance_statistics, summary_report, update_summaries, log_statistics,
+    THRESHOLD_PERCENTAGE,
+)
 
 def compute_face_distance(encoding1, encoding2):
     """Compute the Euclidean distance between two face encodings."""
@@ -72,21 +54,6 @@ def is_same_person(known_encodings, test_encoding, threshold=0.4):
     else:
         return min_distance < threshold
 
-def load_all_students():
-    """Load all students from the pickle file."""
-    students = []
-    try:
-        with open(settings.PICKLE_FILE, 'rb') as f:
-            while True:
-                try:
-                    student = pickle.load(f)
-                    students.append(student)
-                except EOFError:
-                    break
-    except FileNotFoundError:
-        pass
-    return students
-
 @api_view(['POST'])
 def login_view(request):
     """Handle user login."""
@@ -110,7 +77,7 @@ def login_view(request):
 @api_view(['POST'])
 def enroll_student(request):
     """Enroll a student with face recognition."""
-    if face_detector is None or shape_predictor is None or face_recognizer is None:
+    if not models_loaded():
         return Response({
             'success': False,
             'message': 'Face recognition models not loaded. Please check server configuration.'
@@ -128,20 +95,11 @@ def enroll_student(request):
             'message': 'Missing required fields'
         })
     
-    encodings = []
+    # Detect faces in every photo (in parallel)
+    with stage('recognition'):
+        detected = detect_photos([file.read() for file in files], endpoint='enroll')
     
-    # Process each photo and extract face encodings
-    for file in files:
-        img_bytes = file.read()
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Convert to RGB (dlib expects RGB images)
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Detect faces
-        faces = face_detector(rgb_img)
-        
+    for faces in detected:
         if not faces:
             return Response({
                 'success': False,
@@ -153,11 +111,10 @@ def enroll_student(request):
                 'success': False,
                 'message': f'Multiple faces detected in one image. Please upload photos with only the student\'s face.'
             })
-        
-        for face in faces:
-            shape = shape_predictor(rgb_img, face)
-            face_encoding = np.array(face_recognizer.compute_face_descriptor(rgb_img, shape))
-            encodings.append(face_encoding)
+    
+    # Extract the face encoding of each photo
+    with stage('recognition'):
+        encodings = describe_faces([faces[0] for faces in detected])
     
     if not encodings:
         return Response({
@@ -165,53 +122,37 @@ def enroll_student(request):
             'message': 'No valid face encodings could be generated. Please try again with clearer photos.'
         })
     
-    # Load existing students
-    existing_students = load_all_students()
-    
     # Check if this face already exists in the system
-    for student in existing_students:
-        if student['usn'] != usn:  # Skip the current student's previous encodings
-            for encoding in encodings:
-                if is_same_person(student['encodings'], encoding):
-                    return Response({
-                        'success': False,
-                        'message': f'This face appears to match an existing student ({student["name"]}). Please verify the student\'s identity.'
-                    })
-    
-    # Update or create student
-    student_exists = False
-    for student in existing_students:
-        if student['usn'] == usn:
-            student['name'] = name
-            student['encodings'] = encodings
-            student['semester'] = semester
-            student['section'] = section
-            student_exists = True
-            break
-         # If student doesn't exist, add new entry
-    if not student_exists:
-        existing_students.append({
+    # (the student's own previous encodings are skipped)
+    with stage('matching'):
+        duplicate = encoding_cache.duplicate_index().find_duplicate(encodings, exclude_usn=usn)
+    if duplicate is not None:
+        return Response({
+            'success': False,
+            'message': f'This face appears to match an existing student ({duplicate["name"]}). Please verify the student\'s identity.'
+        })
+    
+    # Update or create student in the encoding store
+    with stage('store'):
+        student_exists = encoding_store.upsert({
             "name": name,
             "usn": usn,
             "encodings": encodings,
             "semester": semester,
             "section": section
         })
-    
-    # Save all students back to pickle file
-    with open(settings.PICKLE_FILE, 'wb') as f:
-        for student in existing_students:
-            pickle.dump(student, f)
+        encoding_cache.invalidate()
     
     # Update or create student in database
-    student_obj, created = Student.objects.update_or_create(
-        usn=usn,
-        defaults={
-            'name': name,
-            'semester': semester,
-            'section': section
-        }
-    )
+    with stage('db'):
+        student_obj, created = Student.objects.update_or_create(
+            usn=usn,
+            defaults={
+                'name': name,
+                'semester': semester,
+                'section': section
+            }
+        )
     
     message = f"Student {'updated' if student_exists else 'enrolled'} successfully"
     return Response({
@@ -219,16 +160,66 @@ def enroll_student(request):
         'message': message
     })
 
+@api_view(['POST'])
+def bulk_enroll_students(request):
+    """
+    Enroll a whole class at once. Send either a zip `archive` holding a
+    manifest.json/manifest.csv and the photos, or a `manifest` plus the photos
+    as multipart `photos` files. `semester` and `section` fields apply to
+    entries that leave them out.
+    """
+    if not models_loaded():
+        return Response({
+            'success': False,
+            'message': 'Face recognition models not loaded. Please check server configuration.'
+        })
+    
+    defaults = {'semester': request.data.get('semester'), 'section': request.data.get('section')}
+    archive = request.FILES.get('archive')
+    manifest = request.FILES.get('manifest') or request.data.get('manifest')
+    
+    if not archive and not manifest:
+        return Response({
+            'success': False,
+            'message': 'Upload a zip archive or a manifest with photos'
+        })
+    
+    try:
+        if archive:
+            source = ArchivePhotos(archive)
+            data, manifest_name = source.manifest()
+        else:
+            source = UploadedPhotos(request.FILES.getlist('photos'))
+            if hasattr(manifest, 'read'):
+                data, manifest_name = manifest.read(), manifest.name
+            else:
+                data, manifest_name = manifest, 'manifest.json'
+        reports = bulk_enroll(parse_manifest(data, manifest_name, defaults), source)
+    except BulkEnrollmentError as e:
+        return Response({
+            'success': False,
+            'message': str(e)
+        })
+    
+    counts = {status: sum(report['status'] == status for report in reports)
+              for status in ('enrolled', 'updated', 'rejected')}
+    return Response({
+        'success': True,
+        'message': f"{counts['enrolled']} enrolled, {counts['updated']} updated, {counts['rejected']} rejected",
+        **counts,
+        'students': reports
+    })
+
 @api_view(['POST'])
 def take_attendance(request):
     """Take attendance using face recognition."""
-    if face_detector is None or shape_predictor is None or face_recognizer is None:
+    if not models_loaded():
         return Response({
             'success': False,
             'message': 'Face recognition models not loaded. Please check server configuration.'
         })
     
-    if sheets_service is None or drive_service is None:
+    if not sheets_configured():
         return Response({
             'success': False,
             'message': 'Google API not configured. Please check server configuration.'
@@ -245,87 +236,91 @@ def take_attendance(request):
             'message': 'Missing required fields'
         })
     
-    # Get or create Google Sheet
-    sheet_id = get_google_sheet_id(subject, section, semester)
-    if not sheet_id:
-        sheet_id = create_google_sheet(subject, section, semester)
+    # Stacked encodings of the class, kept warm by the encoding cache
+    with stage('encodings'):
+        class_matrix = encoding_cache.class_matrix(semester, section)
     
-    # Create attendance record in database
-    attendance_record = AttendanceRecord.objects.create(
-        semester=semester,
-        section=section,
-        subject=subject,
-        sheet_id=sheet_id
-    )
+    # Match the class photos in order: faces seen in an earlier photo are not
+    # described again, and photos left once the whole class is found are skipped
+    with stage('recognition'):
+        matcher = session_matcher.match_session([file.read() for file in files], class_matrix, endpoint='attendance')
+    increment('photos', len(files))
+    increment('faces', matcher.counters['faces'])
+    
+    return record_session(semester, section, subject, class_matrix.students, matcher.present_students())
+
+@api_view(['POST'])
+def take_video_attendance(request):
+    """Take attendance from a short video of the class, tracking faces across frames."""
+    if not models_loaded():
+        return Response({
+            'success': False,
+            'message': 'Face recognition models not loaded. Please check server configuration.'
+        })
+    
+    if not sheets_configured():
+        return Response({
+            'success': False,
+            'message': 'Google API not configured. Please check server configuration.'
+        })
+    
+    subject = request.data.get('subject')
+    section = request.data.get('section')
+    semester = request.data.get('semester')
+    video = request.FILES.get('video')
+    
+    if not all([subject, section, semester, video]):
+        return Response({
+            'success': False,
+            'message': 'Missing required fields'
+        })
+    
+    with stage('encodings'):
+        class_matrix = encoding_cache.class_matrix(semester, section)
+    
+    with stage('recognition'):
+        try:
+            session = video_attendance.match_video(video, class_matrix)
+        except video_attendance.VideoError as e:
+            return Response({
+                'success': False,
+                'message': str(e)
+            })
+    
+    return record_session(semester, section, subject, class_matrix.students, session.present_students())
+
+def record_session(semester, section, subject, class_students, present):
+    """
+    Record an attendance session given the students recognized (student dicts
+    of the class): the text log, the database and the Sheets outbox. Returns
+    the response of the attendance views.
+    """
+    # The sheet itself is created/verified by the Sheets outbox worker
+    sheet_id = known_sheet_id(subject, section, semester)
     
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     attendance_file = f"attendance_{semester}_{subject}_{section}.txt"
     file_path = os.path.join(settings.STUDENT_DATA_PATH, attendance_file)
-    attendance_record.file_path = file_path
-    attendance_record.save()
-    
-    present_students = set()  # Use set to avoid duplicates
-    
-    # Load all enrolled students first
-    enrolled_students = load_all_students()
-    class_students = [s for s in enrolled_students if s['semester'] == semester and s['section'] == section]
-    
-    # Process each class photo
-    for file in files:
-        img_bytes = file.read()
-        nparr = np.frombuffer(img_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        faces = face_detector(rgb_img)
-        
-        # Process each detected face
-        for face in faces:
-            shape = shape_predictor(rgb_img, face)
-            face_encoding = np.array(face_recognizer.compute_face_descriptor(rgb_img, shape))
-            
-            # Compare with each enrolled student
-            for student in class_students:
-                if is_same_person(student['encodings'], face_encoding):
-                    present_students.add((student['name'], student['usn']))
-                    break
+    
+    present_students = {(student['name'], student['usn']) for student in present}  # Set to avoid duplicates
+    increment('students_present', len(present_students))
     
     # Get absent students
     all_class_students = [(student['name'], student['usn']) for student in class_students]
     absent_students = [(name, usn) for name, usn in all_class_students if (name, usn) not in present_students]
     
-    # Update attendance in Google Sheets
-    update_attendance_in_sheet(sheet_id, list(present_students), absent_students, timestamp)
-    
     # Save attendance in text file
-    with open(file_path, 'a') as report:
-        report.write(f"\n--- Attendance Session: {timestamp} ---\n")
-        report.write("Present Students: " + ", ".join([name for name, _ in present_students]) + "\n")
-        report.write("Absent Students: " + ", ".join([name for name, _ in absent_students]) + "\n")
+    with stage('log'):
+        append_session(file_path, timestamp, [name for name, _ in present_students],
+                       [name for name, _ in absent_students])
     
-    # Save attendance details in database
-    for name, usn in present_students:
-        try:
-            student = Student.objects.get(usn=usn)
-            AttendanceDetail.objects.create(
-                record=attendance_record,
-                student=student,
-                status=True  # Present
-            )
-        except Student.DoesNotExist:
-            pass
-    
-    for name, usn in absent_students:
-        try:
-            student = Student.objects.get(usn=usn)
-            AttendanceDetail.objects.create(
-                record=attendance_record,
-                student=student,
-                status=False  # Absent
-            )
-        except Student.DoesNotExist:
-            pass
+    # Save the record, its details and the Sheets outbox entry in one transaction
+    with stage('db'):
+        save_attendance(semester, section, subject, sheet_id, file_path, timestamp,
+                        present_students, absent_students)
     
-    sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit?usp=sharing"
+    # A class's first session has no sheet yet; it is created by the worker
+    sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit?usp=sharing" if sheet_id else None
     
     return Response({
         'success': True,
@@ -335,6 +330,52 @@ def take_attendance(request):
         'sheet_url': sheet_url
     })
 
+def save_attendance(semester, section, subject, sheet_id, file_path, timestamp,
+                    present_students, absent_students):
+    """
+    Persist one attendance session with a constant number of queries: one
+    lookup of every class student, the class roster, the record with its
+    attendance bitmaps, one bulk insert of the details, the attendance summary
+    updates and the Sheets outbox entry, all in a single transaction.
+    """
+    status_by_usn = {usn: True for _, usn in present_students}
+    status_by_usn.update({usn: False for _, usn in absent_students})
+    
+    with transaction.atomic():
+        # Students missing from the database are skipped, as before
+        students = list(Student.objects.filter(usn__in=status_by_usn.keys()).only('id', 'usn'))
+        status_by_student = {student.id: status_by_usn[student.usn] for student in students}
+        
+        present_bits = marked_bits = None
+        if settings.ATTENDANCE_BITMAPS:
+            positions = roster_positions(semester, section, sorted(status_by_student))
+            present_bits, marked_bits = pack_session(positions, status_by_student)
+        
+        attendance_record = AttendanceRecord.objects.create(
+            semester=semester,
+            section=section,
+            subject=subject,
+            sheet_id=sheet_id,
+            file_path=file_path,
+            present_bits=present_bits,
+            marked_bits=marked_bits
+        )
+        
+        AttendanceDetail.objects.bulk_create([
+            AttendanceDetail(record=attendance_record, student=student, status=status_by_usn[student.usn])
+            for student in students
+        ])
+        update_summaries(
+            attendance_record,
+            [student_id for student_id, status in status_by_student.items() if status],
+            [student_id for student_id, status in status_by_student.items() if not status],
+        )
+        
+        # Queue the Google Sheets update; the outbox worker sends it after commit
+        enqueue_attendance(attendance_record, timestamp, list(present_students), absent_students)
+    
+    return attendance_record
+
 @api_view(['GET'])
 def get_attendance_files(request):
     """Get list of attendance files for statistics."""
@@ -380,40 +421,52 @@ def generate_statistics(request):
             'message': 'Missing file ID'
         })
     
+    date_from = request.data.get('date_from')
+    date_to = request.data.get('date_to')
+    try:
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    except (TypeError, ValueError):
+        return Response({
+            'success': False,
+            'message': 'Dates must be given as YYYY-MM-DD'
+        })
+    
     try:
         record = AttendanceRecord.objects.get(id=file_id)
-        file_path = record.file_path
         
-        if not file_path or not os.path.exists(file_path):
-            return Response({
-                'success': False,
-                'message': 'Attendance file not found'
-            })
-        
-        # Parse attendance records
-        attendance_records = parse_attendance(file_path)
-        if not attendance_records:
-            return Response({
-                'success': False,
-                'message': 'Failed to parse attendance file'
-            })
-        
-        # Calculate statistics
-        stats = calculate_statistics(attendance_records)
+        # Running totals answer the whole-term report; date ranges need the details
+        stats = None
+        if not (date_from or date_to):
+            stats = summary_report(record.semester, record.section, record.subject)
         
-        # Generate PDF
-        pdf_filename = f"attendance_report_{record.semester}_{record.subject}_{record.section}.pdf"
-        pdf_path = os.path.join(settings.MEDIA_ROOT, pdf_filename)
-        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+        if stats is None:
+            # Calculate statistics from the database
+            stats = attendance_statistics(record.semester, record.section, record.subject, date_from, date_to)
         
-        generate_pdf(stats, pdf_path)
+        if stats is None:
+            # Sessions taken before attendance was stored in the database
+            file_path = record.file_path
+            if not file_path or not os.path.exists(file_path):
+                return Response({
+                    'success': False,
+                    'message': 'Attendance file not found'
+                })
+            
+            # Parse the attendance log and calculate statistics
+            stats = log_statistics(file_path, date_from, date_to)
+            if stats is None or (not stats and not (date_from or date_to)):
+                return Response({
+                    'success': False,
+                    'message': 'Failed to parse attendance file'
+                })
         
         # Prepare response data
         above_75 = []
         below_75 = []
         
         for student, percentage in stats.items():
-            if percentage >= 75:
+            if percentage >= THRESHOLD_PERCENTAGE:
                 above_75.append({'student': student, 'percentage': percentage})
             else:
                 below_75.append({'student': student, 'percentage': percentage})
@@ -422,6 +475,9 @@ def generate_statistics(request):
         above_75.sort(key=lambda x: x['percentage'], reverse=True)
         below_75.sort(key=lambda x: x['percentage'], reverse=True)
         
+        # Generate PDF, or reuse the one already generated from the same statistics
+        pdf_filename = cached_report(record.semester, record.subject, record.section, stats)
+        
         pdf_url = f"/media/{pdf_filename}"
         
         return Response({
@@ -442,177 +498,73 @@ def generate_statistics(request):
             'message': f'Error generating statistics: {str(e)}'
         })
 
-def download_file(request, filename):
-    """Download a file."""
-    file_path = os.path.join(settings.MEDIA_ROOT, filename)
-    if os.path.exists(file_path):
-        return FileResponse(open(file_path, 'rb'), as_attachment=True)
-    return JsonResponse({'error': 'File not found'}, status=404)
-
-# Helper functions for Google Sheets
-def get_google_sheet_id(subject, section, semester):
-    """Retrieve the Google Sheet ID for the given semester, subject, and section."""
-    sheet_id_file = os.path.join(settings.STUDENT_DATA_PATH, f'{subject}_{section}_{semester}_sheet_id.txt')
-    if os.path.exists(sheet_id_file):
-        with open(sheet_id_file, 'r') as file:
-            sheet_id = file.read().strip()
-        
-        # Verify if the sheet exists by making a request to read the sheet's metadata
-        try:
-            sheets_service.spreadsheets().get(spreadsheetId=sheet_id).execute()
-            return sheet_id  # Sheet exists, return the ID
-        except HttpError as e:
-            if e.resp.status == 404:
-                print(f"Sheet with ID {sheet_id} not found. Creating a new sheet...")
-                return create_google_sheet(subject, section, semester)
-            else:
-                raise  # Reraise the exception for other HTTP errors
-    else:
-        print("Sheet ID file not found. Creating a new sheet...")
-        return create_google_sheet(subject, section, semester)
-
-def create_google_sheet(subject, section, semester):
-    """Create a new Google Sheet and save its ID."""
-    try:
-        spreadsheet = {
-            'properties': {'title': f'Attendance_{semester}_{subject}_{section}'},
-            'sheets': [
-                {'properties': {'title': 'Present'}},
-                {'properties': {'title': 'Absent'}}
-            ]
-        }
-        # Create the sheet
-        sheet = sheets_service.spreadsheets().create(body=spreadsheet).execute()
-        sheet_id = sheet['spreadsheetId']
-        
-        # Save the sheet ID to a file for future use
-        sheet_id_file = os.path.join(settings.STUDENT_DATA_PATH, f'{subject}_{section}_{semester}_sheet_id.txt')
-        with open(sheet_id_file, 'w') as file:
-            file.write(sheet_id)
-        
-        # Make the sheet viewable by anyone with the link (view only)
-        drive_service.permissions().create(
-            fileId=sheet_id,
-            body={'type': 'anyone', 'role': 'reader'}
-        ).execute()
-        
-        return sheet_id
-    except HttpError as err:
-        print(f"Error creating or sharing the sheet: {err}")
-        return None
-
-def update_attendance_in_sheet(sheet_id, present_students, absent_students, timestamp):
-    """Update attendance data in Google Sheet."""
-    range_present = 'Present!A1'
-    range_absent = 'Absent!A1'
-    values_present = [[timestamp] + [f"{name} ({usn})" for name, usn in present_students]]
-    values_absent = [[timestamp] + [f"{name} ({usn})" for name, usn in absent_students]]
+@api_view(['GET'])
+def encoding_cache_stats(request):
+    """Expose the encoding cache hit/miss/reload counters."""
+    return Response({
+        'success': True,
+        'stats': encoding_cache.stats()
+    })
 
-    # Append the attendance data without overwriting existing data
-    sheets_service.spreadsheets().values().append(
-        spreadsheetId=sheet_id,
-        range=range_present,
-        valueInputOption='RAW',
-        body={'values': values_present}
-    ).execute()
+@api_view(['GET'])
+def descriptor_cache_stats(request):
+    """Expose the descriptor cache counters and its size on disk."""
+    # With a recognition service, the cache is used by the service process
+    service = face_pipeline._service()
+    stats = service.call('stats')['descriptor_cache'] if service is not None else descriptor_cache.stats()
+    return Response({
+        'success': True,
+        'stats': stats
+    })
 
-    # Append absent students
-    sheets_service.spreadsheets().values().append(
-        spreadsheetId=sheet_id,
-        range=range_absent,
-        valueInputOption='RAW',
-        body={'values': values_absent}
-    ).execute()
+@api_view(['GET'])
+def session_matcher_stats(request):
+    """Expose how much recognition work attendance sessions skipped."""
+    return Response({
+        'success': True,
+        'stats': session_matcher.stats(),
+        'video': video_attendance.stats()
+    })
 
-# Helper functions for attendance statistics
-def parse_attendance(file_path):
-    """Parse attendance file and extract records."""
+@api_view(['GET'])
+def attendance_matrix(request):
+    """Export the sessions x students attendance matrix of a class and subject."""
+    semester = request.query_params.get('semester')
+    section = request.query_params.get('section')
+    subject = request.query_params.get('subject')
+    
+    if not all([semester, section, subject]):
+        return Response({
+            'success': False,
+            'message': 'Missing required parameters'
+        })
+    
+    date_from = request.query_params.get('date_from')
+    date_to = request.query_params.get('date_to')
     try:
-        attendance_records = []
-        with open(file_path, "r", encoding="utf-8") as file:
-            lines = file.readlines()
-            session_date = None
-            present = []
-            absent = []
-
-            for line in lines:
-                if line.startswith("--- Attendance Session:"):
-                    if session_date:
-                        attendance_records.append({"date": session_date, "present": present, "absent": absent})
-                    timestamp = line.split(": ")[1].strip().split(" ")[0]
-                    session_date = datetime.strptime(timestamp, "%Y-%m-%d")
-                    present = []
-                    absent = []
-                elif line.startswith("Present Students:"):
-                    present = [student.strip() for student in line.split(":")[1].split(",") if student.strip()]
-                elif line.startswith("Absent Students:"):
-                    absent = [student.strip() for student in line.split(":")[1].split(",") if student.strip()]
-
-            # Add the last session's attendance
-            if session_date:
-                attendance_records.append({"date": session_date, "present": present, "absent": absent})
-
-        return attendance_records
-
-    except Exception as e:
-        print(f"Error parsing attendance file: {e}")
-        return []
-
-def calculate_statistics(attendance_records):
-    """Calculate attendance percentages for each student."""
-    total_sessions = len(attendance_records)
-    if total_sessions == 0:
-        return {}
-
-    attendance = {}
-    for session in attendance_records:
-        for student in session["present"]:
-            attendance[student] = attendance.get(student, 0) + 1
-        for student in session["absent"]:
-            attendance.setdefault(student, 0)  # Ensure absent students are included
-
-    stats = {student: (count / total_sessions) * 100 for student, count in attendance.items()}
-    return stats
-
-def generate_pdf(stats, output_file):
-    """Generate PDF report with attendance statistics."""
-    c = canvas.Canvas(output_file, pagesize=letter)
-    width, height = letter
-
-    # Title
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(220, height - 40, "Attendance Statistics")
-
-    # Column Headers
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(50, height - 80, "Above 75% Attendance")
-    c.drawString(350, height - 80, "Below 75% Attendance")
-
-    # Draw the lists of students
-    c.setFont("Helvetica", 10)
-
-    above_75 = [(student, percentage) for student, percentage in stats.items() if percentage >= 75]
-    below_75 = [(student, percentage) for student, percentage in stats.items() if percentage < 75]
-
-    y_position_above = height - 100
-    y_position_below = height - 100
-
-    # Printing Above 75% Attendance
-    for student, percentage in above_75:
-        c.drawString(50, y_position_above, f"{student}: {percentage:.2f}%")
-        y_position_above -= 15
-        if y_position_above < 50:
-            c.showPage()
-            c.setFont("Helvetica", 10)
-            y_position_above = height - 50
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    except ValueError:
+        return Response({
+            'success': False,
+            'message': 'Dates must be given as YYYY-MM-DD'
+        })
+    
+    matrix = load_matrix(semester, section, subject, date_from, date_to)
+    return Response({
+        'success': True,
+        **matrix.as_dict()
+    })
 
-    # Printing Below 75% Attendance
-    for student, percentage in below_75:
-        c.drawString(350, y_position_below, f"{student}: {percentage:.2f}%")
-        y_position_below -= 15
-        if y_position_below < 50:
-            c.showPage()
-            c.setFont("Helvetica", 10)
-            y_position_below = height - 50
+def download_file(request, filename):
+    """Download a file from MEDIA_ROOT, honouring conditional and range requests."""
+    file_path = resolve_media_path(settings.MEDIA_ROOT, filename)
+    if file_path:
+        return serve_file(request, file_path)
+    return JsonResponse({'error': 'File not found'}, status=404)
 
-    c.save()
\ No newline at end of file
+def metrics(request):
+    """Stage timings and counters of this process, in the Prometheus text format."""
+    if not settings.METRICS_ENABLED or request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,35 @@
+"""
+Settings for 'manage.py run_benchmarks': the project settings with the database,
+student data and media moved to a scratch directory and Google Sheets replaced
+by the in-memory fake, so a benchmark run never touches real data or the network.
+
+    python manage.py run_benchmarks --settings=attendance_system.benchmark_settings
+"""
+import os
+import tempfile
+from .settings import *  # noqa: F401,F403
+
+BENCHMARK_MODE = True
+DEBUG = False  # Query logging would skew database timings
+
+# Set BENCHMARK_DIR to keep the scratch data after the run.
+BENCHMARK_DIR = os.environ.get('BENCHMARK_DIR') or tempfile.mkdtemp(prefix='attendance-benchmark-')
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_DIR, 'db.sqlite3'),
+    }
+}
+
+STUDENT_DATA_PATH = os.path.join(BENCHMARK_DIR, 'student_data')
+PICKLE_FILE = os.path.join(STUDENT_DATA_PATH, 'encodings.pkl')
+ENCODING_STORE_DIR = os.path.join(STUDENT_DATA_PATH, 'encodings')
+MEDIA_ROOT = os.path.join(BENCHMARK_DIR, 'media')
+# Timed runs submit the same photos again and again; measure the pipeline, not the cache
+DESCRIPTOR_CACHE_DIR = None
+os.makedirs(ENCODING_STORE_DIR, exist_ok=True)
+
+GOOGLE_SHEETS_BACKEND = 'fake'
+SHEETS_OUTBOX_AUTOSTART = False
+ALLOWED_HOSTS = ['testserver']
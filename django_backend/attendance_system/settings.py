@@ -26,6 +26,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -94,6 +95,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Generated PDF reports are cached under MEDIA_ROOT/<REPORT_CACHE_DIR>, named by a
+# hash of their content; the least recently used are deleted beyond these limits
+REPORT_CACHE_DIR = 'reports'
+REPORT_CACHE_MAX_FILES = 500
+REPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -102,10 +109,151 @@ CORS_ALLOW_ALL_ORIGINS = True  # For development only, restrict in production
 
 # Directories for student data
 STUDENT_DATA_PATH = os.path.join(BASE_DIR, 'student_data')
-PICKLE_FILE = os.path.join(STUDENT_DATA_PATH, 'encodings.pkl')
+PICKLE_FILE = os.path.join(STUDENT_DATA_PATH, 'encodings.pkl')  # Legacy format, migrated when the store is first used
+
+# Memory-mapped encoding matrix and its sidecar index
+ENCODING_STORE_DIR = os.path.join(STUDENT_DATA_PATH, 'encodings')
+
+# Format of the encoding matrix: 'float32', 'float16' (half the size) or 'int8'
+# (a quarter, with a per-dimension scale). Distances are computed on the
+# compact rows. Run validate_encoding_formats to see how many match decisions
+# each format would change for the enrolled students, then compact_encodings
+# to convert the store after changing this.
+ENCODING_STORE_DTYPE = 'float32'
+
+# Faces found in uploaded photos (positions, appearance hashes and descriptors)
+# are cached on disk, keyed by a hash of the photo and the face pipeline
+# settings, so a photo submitted again (a retried request) skips straight to
+# matching. Every process using the directory shares it; the least recently
+# used entries are deleted beyond MAX_BYTES. None disables the cache.
+DESCRIPTOR_CACHE_DIR = os.path.join(STUDENT_DATA_PATH, 'descriptor_cache')
+DESCRIPTOR_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+# Re-enrollments leave dead rows behind; compact in the background once they
+# reach this share of the matrix (and at least this many rows)
+ENCODING_COMPACT_DEAD_RATIO = 0.5
+ENCODING_COMPACT_MIN_DEAD_ROWS = 256
+
+# Nearest-neighbour index for the enrollment duplicate check. With NPROBE None
+# it searches every list that could hold a match (same verdicts as a full scan).
+# A number caps the lists searched per encoding, which is faster but may miss
+# duplicates: only set one that validate_duplicate_index measures within the
+# recall you accept on the enrolled students. Stores with fewer rows than
+# MIN_ROWS are simply scanned.
+DUPLICATE_INDEX_NPROBE = None
+DUPLICATE_INDEX_MIN_ROWS = 2048
+
+# Bulk enrollment: largest batch accepted, students whose photos are decoded and
+# described together (bounds memory), and the largest extracted zip archive
+BULK_ENROLL_MAX_STUDENTS = 5000
+BULK_ENROLL_CHUNK_STUDENTS = 64
+BULK_ENROLL_MAX_ARCHIVE_BYTES = 4 * 1024 * 1024 * 1024
+
+# Multipart bulk enrollment uploads every photo as its own file (Django's default cap is 100)
+DATA_UPLOAD_MAX_NUMBER_FILES = 10000
 
 # Create necessary directories
 os.makedirs(STUDENT_DATA_PATH, exist_ok=True)
 
+# Face pipeline parts, to trade accuracy for throughput per deployment:
+# - detector: 'hog' (fast on CPU) or 'cnn' (mmod_human_face_detector.dat;
+#   handles pose better, needs CUDA to be fast)
+# - landmarks: 68 or 5 (shape_predictor_5_face_landmarks.dat; much smaller and
+#   faster). The two align faces differently, so descriptors are not
+#   interchangeable: re-enroll students after switching.
+# - batch_descriptors: run the ResNet model once per batch of aligned faces
+FACE_PIPELINE = {
+    'detector': 'hog',
+    'landmarks': 68,
+    'batch_descriptors': True,
+}
+
+# Face models are loaded on first use. Set PRELOAD_MODELS to load them when the
+# WSGI application starts instead; with `gunicorn --preload` that happens once in
+# the master and the forked workers share the memory.
+PRELOAD_MODELS = False
+
+# Face pipeline: photos and faces of one request are spread over a pool of at
+# most this many workers per web process (1 runs everything inline). 'thread'
+# shares the models this process loaded (or preloaded). 'process' runs the dlib
+# stages truly in parallel, but every web process then starts its own pool from a
+# fork server and each worker loads its own copy of the models (the web process
+# loads none); prefer the recognition service, which shares one set of models
+# and caps the workers across all web processes.
+FACE_PIPELINE_EXECUTOR = 'thread'
+FACE_PIPELINE_MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+# Optional recognition service ('manage.py run_recognition_service'): a separate
+# process that owns the face models and worker pool, so web workers neither load
+# the models nor run inference in request threads. Set the socket path to use it.
+# The service runs at most MAX_PENDING jobs at once; further jobs wait up to
+# QUEUE_WAIT seconds for a slot and are then refused as busy (HTTP 503). Web
+# workers give up on a job after TIMEOUT seconds.
+RECOGNITION_SERVICE_SOCKET = None  # e.g. os.path.join(BASE_DIR, 'recognition.sock')
+RECOGNITION_SERVICE_MAX_PENDING = 8
+RECOGNITION_SERVICE_QUEUE_WAIT = 5
+RECOGNITION_SERVICE_TIMEOUT = 120
+
+# Face detection runs on a copy of each photo scaled down to at most `width`
+# pixels across (None keeps full resolution); landmarks and descriptors still use
+# full-resolution crops. The HOG detector finds faces of about 80 px, so the
+# smallest face found is roughly 80 * photo width / width / 2**upsample pixels.
+# Enrollment photos are close-ups; classroom photos keep more resolution so
+# back-row faces survive. Video frames are detected in many times per clip, and
+# the camera can be brought closer to the back rows.
+FACE_DETECTION = {
+    'enroll': {'width': 800, 'upsample': 0},
+    'attendance': {'width': 3200, 'upsample': 0},
+    'video': {'width': 1280, 'upsample': 0},
+}
+
+# Video attendance samples a frame every min_interval to max_interval seconds:
+# with no faces tracked, more often the faster the picture changes (mean
+# difference between small grayscale thumbnails of consecutive samples, out of
+# 255; fast_motion or more samples at min_interval), otherwise the less
+# predictably the tracked faces move. Faces are detected at least every
+# detect_interval seconds, sooner while the camera pans, and followed by
+# correlation trackers in between. A face is described at most
+# descriptors_per_track times while it matches nobody, and its track is dropped
+# after max_missed detections without it. Only the first max_seconds of a clip
+# are used.
+VIDEO_ATTENDANCE = {
+    'min_interval': 0.1,
+    'max_interval': 0.5,
+    'fast_motion': 12.0,
+    'detect_interval': 2.0,
+    'descriptors_per_track': 2,
+    'max_missed': 1,
+    'max_seconds': 120,
+}
+
 # Google API credentials
-GOOGLE_CREDENTIALS_FILE = os.path.join(BASE_DIR, 'credentials.json')
\ No newline at end of file
+GOOGLE_CREDENTIALS_FILE = os.path.join(BASE_DIR, 'credentials.json')
+
+# 'google' talks to the real APIs; 'fake' keeps sheets in memory (tests, offline dev)
+GOOGLE_SHEETS_BACKEND = 'google'
+
+# Attendance is written to Google Sheets from a local outbox table by a background
+# worker, batched per spreadsheet and retried with exponential backoff. The worker
+# runs as a thread in each web process (AUTOSTART), started by the first request
+# the process serves, or via 'manage.py run_sheets_outbox'. Without AUTOSTART, or
+# to send what a previous run left pending before any request comes in, run the
+# command (e.g. 'run_sheets_outbox --once' at deploy time).
+SHEETS_OUTBOX_AUTOSTART = True
+SHEETS_OUTBOX_POLL_SECONDS = 30
+SHEETS_OUTBOX_BATCH_SIZE = 200
+SHEETS_OUTBOX_LEASE_SECONDS = 120
+SHEETS_OUTBOX_RETRY_BASE_SECONDS = 5
+SHEETS_OUTBOX_RETRY_MAX_SECONDS = 3600
+SHEETS_OUTBOX_MAX_ATTEMPTS = 20
+# Also store each session as packed bitsets over the class roster, for the
+# attendance matrix export and fast range analytics
+ATTENDANCE_BITMAPS = True
+
+# Per-stage timings of each request (decode, detection, landmarks, descriptors,
+# matching, database, log and Sheets writes) in a Server-Timing response header,
+# and their histograms at /api/metrics/ in the Prometheus text format, served to
+# the listed addresses only. Metrics are kept per process. Off, the timing
+# hooks cost a settings lookup each.
+METRICS_ENABLED = False
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
@@ -8,4 +8,13 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'attendance_system.settings')
 
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+# Load the face models up front. Under `gunicorn --preload` this runs in the
+# master, so the workers it forks share the model pages instead of each
+# loading their own copy.
+from django.conf import settings
+
+if settings.PRELOAD_MODELS:
+    from api.preload import preload
+    preload()